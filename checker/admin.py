@@ -1,6 +1,9 @@
 from django.contrib import admin
 
-from .models import PipelineApp, PipelineEnv
+from .models import Scan, PipelineApp, PipelineEnv, DriftSummary, RescanRequest
 
+admin.site.register(Scan)
 admin.site.register(PipelineApp)
 admin.site.register(PipelineEnv)
+admin.site.register(DriftSummary)
+admin.site.register(RescanRequest)
@@ -0,0 +1,485 @@
+from django.conf import settings
+
+from asgiref.sync import sync_to_async
+from datetime import datetime
+from urllib.parse import urlencode, urlparse, parse_qs
+import asyncio
+import aiohttp
+import base64
+import json
+import requests
+from multidict import CIMultiDict
+from .models import GitCommit, GitCompare
+from .check import (
+    get_app_config_yaml, primary_branch_name, set_head_commit, new_pipeline_app, set_config, set_repo, set_repo_info, is_uktrade_pipeline,
+    new_pipeline_env, app_guid_missing, set_cf_commit, set_simple_drift, set_compare, set_merge_base_drift, read_pipeline_snapshot,
+    read_previous_pipeline, read_repo_infos, read_cf_app_changes, carry_forward_pipeline, carry_forward_environment, start_scan, fail_scan,
+    write_scan, cf_login,
+)
+from .cf_cache import CfGuidCache, app_git_env
+from .git_mirror import GitMirrors, GitMirrorError
+from .github_cache import is_cacheable, cache_key, read_entry, touch_entry, write_entry, prune_github_cache
+from .rate_limit import get_limiter, low_priority, log_rate_limit_budgets
+from .metrics import timed, format_phase_times
+from .branch_lists import primary_branch_candidates
+from .commit_store import read_commit, write_commit, read_count_anchor, count_from_compare, write_commit_count, read_compare, write_compare
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def header_links(headers):
+    # The Link header as aiohttp gives it in response.links, for a response answered from the cache
+    return {link["rel"]: link for link in requests.utils.parse_header_links(headers["Link"])} if "Link" in headers else {}
+
+
+class AsyncGithub:
+    # Github REST API client, with at most GITHUB_ASYNC_CONCURRENCY requests in flight
+    def __init__(self, session, concurrency, mirrors=None):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.mirrors = mirrors
+        # Compares are shared as tasks, so environments deploying the same commit await one compare
+        self.compares = {}
+
+    async def request(self, url, params=None):
+        # Same as github_cache.CachingConnectionClass - conditional GETs, with 304s answered from the cache
+        parsed_url = urlparse(url)
+        cache_url = parsed_url.path + (f"?{urlencode(params)}" if params else f"?{parsed_url.query}" if parsed_url.query else "")
+        headers = {}
+        entry = None
+        use_cache = settings.GITHUB_CACHE_ENABLED and is_cacheable(cache_url)
+        if use_cache:
+            port = parsed_url.port or (443 if parsed_url.scheme == "https" else 80)
+            key = cache_key(f"{parsed_url.hostname}:{port}", cache_url, self.session.headers.get("Accept"))
+            entry = await sync_to_async(read_entry)(key, cache_url)
+            if entry is not None:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+        limiter = get_limiter("github")
+        async with self.semaphore:
+            await limiter.acquire_async()
+            async with self.session.get(url, params=params, headers=headers) as response:
+                limiter.update(response.headers)
+                if response.status == 304 and entry is not None:
+                    log.debug(f"Github cache hit: {cache_url}")
+                    await sync_to_async(touch_entry)(entry)
+                    # Rate limit headers etc. come from the 304 response, everything else from the cache
+                    cached_headers = CIMultiDict(entry.headers)
+                    cached_headers.update(response.headers)
+                    return json.loads(entry.body), cached_headers, header_links(cached_headers)
+                response.raise_for_status()
+                body = await response.text()
+                if use_cache and response.status == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+                    await sync_to_async(write_entry)(key, cache_url, response.headers, body)
+                return json.loads(body), response.headers, response.links
+
+    async def from_mirror(self, repo_name, read):
+        # Same as the threaded engine's git mirror use - git runs in a worker thread, and None means the Github API is used instead
+        if self.mirrors is None:
+            return None
+        try:
+            return await asyncio.to_thread(lambda: read(self.mirrors.get(repo_name)))
+        except GitMirrorError as ex:
+            log.debug(f"Cannot read from git mirror: {ex}")
+            return None
+
+    async def get(self, path, **params):
+        data, headers, links = await self.request(f"{settings.GITHUB_API_URL}{path}", params)
+        return data
+
+    async def get_list(self, path, **params):
+        results = []
+        data, headers, links = await self.request(f"{settings.GITHUB_API_URL}{path}", params)
+        results.extend(data)
+        while "next" in links:
+            data, headers, links = await self.request(str(links["next"]["url"]))
+            results.extend(data)
+        return results
+
+    async def get_primary_branch(self, repo_name, default_branch):
+        # Tries only the candidate branches, most preferred first, as check.read_primary_branch
+        for branch_name in primary_branch_candidates(default_branch):
+            try:
+                return await self.get(f"/repos/{repo_name}/branches/{branch_name}")
+            except aiohttp.ClientResponseError as ex:
+                if ex.status != 404:
+                    raise
+        raise ValueError(f"No primary branch in {repo_name}")
+
+    async def get_commit(self, repo_name, sha):
+        git_commit = await sync_to_async(read_commit)(repo_name, sha)
+        if git_commit is not None:
+            return git_commit
+
+        data, headers, links = await self.request(f"{settings.GITHUB_API_URL}/repos/{repo_name}/commits/{sha}")
+        git_commit = GitCommit(
+            repo=repo_name,
+            sha=data["sha"],
+            date=datetime.strptime(headers["Last-Modified"], settings.GIT_RESPONSE_DATE_FORMAT),
+            author=(data["author"] or {}).get("login"),
+            committer=(data["committer"] or {}).get("login"),
+        )
+        await sync_to_async(write_commit)(git_commit)
+        return git_commit
+
+    async def commit_date(self, repo_name, sha):
+        commit_date = await self.from_mirror(repo_name, lambda mirror: mirror.commit_date(sha))
+        if commit_date is None:
+            commit_date = (await self.get_commit(repo_name, sha)).date
+        return commit_date
+
+    def mirror_compare(self, mirror, repo_name, base_sha, head_sha):
+        ahead_by, behind_by = mirror.ahead_behind(base_sha, head_sha)
+        return GitCompare(repo=repo_name, base_sha=base_sha, head_sha=head_sha, ahead_by=ahead_by, behind_by=behind_by, merge_base_sha=mirror.merge_base(base_sha, head_sha))
+
+    async def fetch_compare(self, repo_name, base_sha, head_sha):
+        # Same as commit_store.CompareCache - compares are worked out in the git mirror, and stored compares are reused across scans
+        git_compare = await self.from_mirror(repo_name, lambda mirror: self.mirror_compare(mirror, repo_name, base_sha, head_sha))
+        if git_compare is not None:
+            return git_compare
+        git_compare = await sync_to_async(read_compare)(repo_name, base_sha, head_sha)
+        if git_compare is None:
+            github_compare = await self.get(f"/repos/{repo_name}/compare/{base_sha}...{head_sha}")
+            git_compare = GitCompare(
+                repo=repo_name,
+                base_sha=base_sha,
+                head_sha=head_sha,
+                ahead_by=github_compare["ahead_by"],
+                behind_by=github_compare["behind_by"],
+                merge_base_sha=github_compare["merge_base_commit"]["sha"],
+            )
+            await sync_to_async(write_compare)(git_compare)
+        return git_compare
+
+    async def compare(self, repo_name, base_sha, head_sha):
+        key = (repo_name, base_sha, head_sha)
+        if key not in self.compares:
+            self.compares[key] = asyncio.ensure_future(self.fetch_compare(repo_name, base_sha, head_sha))
+        return await self.compares[key]
+
+    async def get_commit_count(self, repo_name, git_commit):
+        # Same approach as commit_store.get_commit_count - count from an anchor commit, falling back to the history length
+        if git_commit.count is not None:
+            return git_commit.count
+
+        count = await self.from_mirror(repo_name, lambda mirror: mirror.commit_count(git_commit.sha))
+        anchor = await sync_to_async(read_count_anchor)(git_commit) if count is None else None
+        if anchor is not None:
+            try:
+                anchor_compare = await self.compare(repo_name, anchor.sha, git_commit.sha)
+                count = count_from_compare(anchor.count, anchor_compare)
+            except aiohttp.ClientResponseError as ex:
+                log.warning(f"Cannot compare with anchor commit {anchor.sha} ({repo_name}): {ex}")
+        if count is None:
+            # With one commit per page, the number of the last page is the number of commits
+            data, headers, links = await self.request(f"{settings.GITHUB_API_URL}/repos/{repo_name}/commits", {"sha": git_commit.sha, "per_page": 1})
+            if "last" in links:
+                count = int(parse_qs(urlparse(str(links["last"]["url"])).query)["page"][0])
+            else:
+                count = len(data)
+        await sync_to_async(write_commit_count)(git_commit, count)
+        return count
+
+
+class AsyncCf:
+    # Cloud Foundry v3 API client, with at most CF_ASYNC_CONCURRENCY requests in flight
+    def __init__(self, cf, session, concurrency, cf_envs):
+        # The synchronous client is only used to log in and refresh the access token
+        self.cf = cf
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.proxy = settings.CF_PROXY or None
+        self.cf_envs = cf_envs
+        # Only for the GUIDs stored by earlier scans - lookups within the scan are shared as tasks
+        self.stored_guids = CfGuidCache(cf)
+        # Lookups are shared as tasks, so coroutines wanting the same org, space or app listing await one request
+        self.tasks = {}
+
+    async def request(self, url, params=None):
+        limiter = get_limiter("cf")
+        async with self.semaphore:
+            for attempt in range(2):
+                await limiter.acquire_async()
+                access_token = self.cf._access_token
+                headers = {"Authorization": f"Bearer {access_token}"}
+                async with self.session.get(url, params=params, headers=headers, proxy=self.proxy) as response:
+                    limiter.update(response.headers)
+                    if response.status == 401 and attempt == 0:
+                        await asyncio.to_thread(self.cf.refresh_expired_token, access_token)
+                        continue
+                    response.raise_for_status()
+                    return await response.json()
+
+    async def get_list(self, path, **params):
+        results = []
+        data = await self.request(f"{settings.CF_ENDPOINT}{path}", params)
+        while True:
+            results.append(data)
+            next_page = (data.get("pagination") or {}).get("next")
+            if not next_page:
+                return results
+            data = await self.request(next_page["href"])
+
+    def shared(self, key, coroutine_function, *args, **kwargs):
+        if key not in self.tasks:
+            self.tasks[key] = asyncio.ensure_future(coroutine_function(*args, **kwargs))
+        return self.tasks[key]
+
+    async def resolve_guid(self, kind, name, parent_guid, path, **params):
+        # Same as cf_cache.CfGuidCache - a GUID stored within CF_GUID_CACHE_TTL seconds is used without a lookup
+        guid = await sync_to_async(self.stored_guids.read_stored)(kind, name, parent_guid)
+        if guid:
+            return guid
+        guid = ""
+        for page in await self.get_list(path, **params):
+            for resource in page["resources"]:
+                guid = resource["guid"]
+        if guid:
+            await sync_to_async(self.stored_guids.store)(kind, name, parent_guid, guid)
+        return guid
+
+    async def org_guid(self, org_name):
+        return await self.shared(("org", org_name), self.resolve_guid, "org", org_name, "", "/v3/organizations", names=org_name)
+
+    async def space_guid(self, space_name, org_guid):
+        return await self.shared(
+            ("space", space_name, org_guid), self.resolve_guid, "space", space_name, org_guid, "/v3/spaces", names=space_name, organization_guids=org_guid
+        )
+
+    async def list_org_apps(self, org_guid):
+        # Same index as cf_cache.CfAppIndex - every app in the org keyed by "org/space/app"
+        apps = {}
+        for page in await self.get_list("/v3/apps", organization_guids=org_guid, include="space,space.organization", per_page=settings.CF_APP_PAGE_SIZE):
+            included = page.get("included", {})
+            org_names = {cf_org["guid"]: cf_org["name"] for cf_org in included.get("organizations", [])}
+            spaces = {
+                cf_space["guid"]: f"{org_names.get(cf_space['relationships']['organization']['data']['guid'])}/{cf_space['name']}"
+                for cf_space in included.get("spaces", [])
+            }
+            for cf_app in page["resources"]:
+                apps[f"{spaces.get(cf_app['relationships']['space']['data']['guid'])}/{cf_app['name']}"] = cf_app["guid"]
+        log.debug(f"Indexed {len(apps)} CF apps in org {org_guid}")
+        return apps
+
+    async def app_guid(self, org_guid, full_name):
+        apps = await self.shared(("apps", org_guid), self.list_org_apps, org_guid)
+        return apps.get(full_name, "")
+
+    async def git_env(self, app_guid):
+        # Same as cf_cache.CfAppEnvs - an app with no CF audit events since the previous scan keeps its branch and commit
+        known_git_env = self.cf_envs.known_git_env(app_guid)
+        if known_git_env is not None:
+            return known_git_env
+        return app_git_env(await self.request(f"{settings.CF_ENDPOINT}/v3/apps/{app_guid}/env"))
+
+
+async def timed_call(phase, record, awaitable):
+    # Times one of several calls awaited together
+    with timed(phase, record):
+        return await awaitable
+
+
+async def process_environment(github, cf, pipeline_app, environment_yaml, previous_env=None):
+    pipeline_file = pipeline_app.config_filename
+    repo_name = pipeline_app.config["scm"]
+    log.info(f"{pipeline_file} - Processing environment '{environment_yaml['environment']}'")
+    pipeline_env = new_pipeline_env(pipeline_app, environment_yaml)
+    if pipeline_env.log_message:
+        return pipeline_env
+
+    # Read the org, space and app GUIDs for this environment
+    with timed("cf_resolution", pipeline_env):
+        setattr(pipeline_env, "cf_org_guid", await cf.org_guid(pipeline_env.cf_org_name))
+        setattr(pipeline_env, "cf_space_guid", await cf.space_guid(pipeline_env.cf_space_name, pipeline_env.cf_org_guid))
+        setattr(pipeline_env, "cf_app_guid", await cf.app_guid(pipeline_env.cf_org_guid, pipeline_env.cf_full_name))
+
+    if app_guid_missing(pipeline_env):
+        return pipeline_env
+
+    # Get app environment configuration
+    try:
+        with timed("env_fetch", pipeline_env):
+            cf_app_git_branch, cf_app_git_commit = await cf.git_env(pipeline_env.cf_app_guid)
+        setattr(pipeline_env, "cf_app_git_branch", cf_app_git_branch)
+        setattr(pipeline_env, "cf_app_git_commit", cf_app_git_commit)
+    except:
+        pipeline_env.log_message = ("No SCM Branch or Commit Hash in app environmant")
+        log.error(pipeline_env.log_message)
+        return pipeline_env
+
+    if carry_forward_environment(previous_env, pipeline_env):
+        return pipeline_env
+
+    try:
+        # Get commit details of CF commit sha
+        with timed("commits", pipeline_env):
+            cf_commit = await github.get_commit(repo_name, pipeline_env.cf_app_git_commit)
+        set_cf_commit(pipeline_env, cf_commit)
+    except:
+        pipeline_env.log_message = f"Cannot read commit {pipeline_env.cf_app_git_commit}"
+        log.error(pipeline_env.log_message)
+        return pipeline_env
+    set_simple_drift(pipeline_app, pipeline_env)
+
+    with timed("compare", pipeline_env):
+        cf_compare = await github.compare(repo_name, pipeline_app.scm_repo_primary_branch_head_commit_sha, pipeline_env.cf_app_git_commit)
+    cf_commit_count = set_compare(pipeline_app, pipeline_env, cf_compare)
+    if cf_commit.count is None:
+        await sync_to_async(write_commit_count)(cf_commit, cf_commit_count)
+    setattr(pipeline_env, "cf_commit_count", cf_commit.count)
+    with timed("commits", pipeline_env):
+        merge_base_commit_date = await github.commit_date(repo_name, pipeline_env.git_compare_merge_base_commit)
+    set_merge_base_drift(pipeline_app, pipeline_env, merge_base_commit_date)
+
+    return pipeline_env
+
+
+async def read_pipeline_config(github, pipeline_file, scan_start_time, snapshot=None):
+    pipeline_app = new_pipeline_app(pipeline_file, scan_start_time, snapshot)
+    if snapshot is not None:
+        return pipeline_app
+
+    # Read config - this starts a new pipeline, so waits behind pipelines already in progress when the rate limit is low
+    # (with a config snapshot, the pipeline's first request is its repo read)
+    with low_priority(), timed("config_read", pipeline_app):
+        pipeline_config_contents = await github.get(f"/repos/{settings.GIT_PIPELINE_REPO}/contents/{pipeline_file}")
+    set_config(pipeline_app, pipeline_config_contents["sha"], get_app_config_yaml(base64.b64decode(pipeline_config_contents["content"]).decode()))
+    return pipeline_app
+
+
+async def read_repo(github, pipeline_app):
+    repo_name = pipeline_app.config["scm"]
+    if settings.GITHUB_BRANCH_LIST_ENABLED:
+        # Read pipeline app SCM repo, and its branches to set the branch to compare for code-drift calculations
+        with low_priority():
+            pipeline_repo, pipeline_repo_branches = await asyncio.gather(
+                timed_call("repo_metadata", pipeline_app, github.get(f"/repos/{repo_name}")),
+                timed_call("branches", pipeline_app, github.get_list(f"/repos/{repo_name}/branches", per_page=100)),
+            )
+        setattr(pipeline_app, "scm_repo_branch_list", [branch["name"] for branch in pipeline_repo_branches])
+        setattr(pipeline_app, "scm_repo_primary_branch_name", primary_branch_name(pipeline_app.scm_repo_branch_list, pipeline_repo["default_branch"]))
+
+        # Read pipeline app SCM repo primary branch
+        with timed("branches", pipeline_app):
+            pipeline_repo_primary_branch = await github.get(f"/repos/{repo_name}/branches/{pipeline_app.scm_repo_primary_branch_name}")
+    else:
+        with low_priority(), timed("repo_metadata", pipeline_app):
+            pipeline_repo = await github.get(f"/repos/{repo_name}")
+        with timed("branches", pipeline_app):
+            pipeline_repo_primary_branch = await github.get_primary_branch(repo_name, pipeline_repo["default_branch"])
+        setattr(pipeline_app, "scm_repo_primary_branch_name", pipeline_repo_primary_branch["name"])
+    set_repo(pipeline_app, pipeline_repo["name"], pipeline_repo["id"], pipeline_repo["private"], pipeline_repo["archived"], pipeline_repo["default_branch"])
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_sha", pipeline_repo_primary_branch["commit"]["sha"])
+
+
+async def process_pipeline(github, cf, pipeline_app, incremental, repo_info=None):
+    # Process pipelines, checking for a "uktrade" repo
+    pipeline_file = pipeline_app.config_filename
+    if not is_uktrade_pipeline(pipeline_app):
+        log.warning(f"Not a UKTRADE repo: {pipeline_app.config['scm']}")
+        return pipeline_app, []
+    repo_name = pipeline_app.config["scm"]
+
+    if repo_info is not None:
+        await sync_to_async(set_repo_info)(pipeline_app, repo_info)
+    else:
+        await read_repo(github, pipeline_app)
+
+    previous_app = await sync_to_async(read_previous_pipeline)(pipeline_file, pipeline_app.scan_start_time) if incremental else None
+    if carry_forward_pipeline(previous_app, pipeline_app):
+        previous_envs = {previous_env.config_env: previous_env for previous_env in await sync_to_async(list)(previous_app.pipelineenv_set.all())}
+    else:
+        if repo_info is None:
+            with timed("commits", pipeline_app):
+                pipeline_repo_primary_branch_head_commit = await github.get_commit(repo_name, pipeline_app.scm_repo_primary_branch_head_commit_sha)
+                set_head_commit(pipeline_app, pipeline_repo_primary_branch_head_commit)
+                setattr(pipeline_app, "scm_repo_primary_branch_head_commit_count", await github.get_commit_count(repo_name, pipeline_repo_primary_branch_head_commit))
+        previous_envs = {}
+
+    # Process each environment concurrently, keeping the order from the pipeline config
+    pipeline_envs = await asyncio.gather(*[
+        process_environment(github, cf, pipeline_app, environment_yaml, previous_envs.get(environment_yaml["environment"]))
+        for environment_yaml in pipeline_app.config["environments"]
+    ])
+
+    for pipeline_env in pipeline_envs:
+        log.debug(f"{pipeline_file} - Environment '{pipeline_env.config_env}' phase times: {format_phase_times(pipeline_env)}")
+    return pipeline_app, list(pipeline_envs)
+
+
+async def scan(cf, cf_envs, scan_start_time, incremental, snapshot=None, mirrors=None):
+    github_headers = {"Authorization": f"token {settings.GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
+    async with aiohttp.ClientSession(headers=github_headers) as github_session, aiohttp.ClientSession() as cf_session:
+        github = AsyncGithub(github_session, settings.GITHUB_ASYNC_CONCURRENCY, mirrors)
+        async_cf = AsyncCf(cf, cf_session, settings.CF_ASYNC_CONCURRENCY, cf_envs)
+
+        # Read the pipeline configs
+        if snapshot is not None:
+            pipeline_files = snapshot.pipeline_files()
+        else:
+            pipeline_files = [
+                content_file["path"]
+                for content_file in await github.get(f"/repos/{settings.GIT_PIPELINE_REPO}/contents/")
+                if ".yaml" in content_file["path"]
+            ]
+        log.debug(f"Pipelines: {pipeline_files}")
+
+        log.info(f"Processing {len(pipeline_files)} pipelines asynchronously")
+        # Every config is read first, so the SCM repos can be read together
+        configs = await asyncio.gather(
+            *[read_pipeline_config(github, pipeline_file, scan_start_time, snapshot) for pipeline_file in pipeline_files],
+            return_exceptions=True,
+        )
+        pipeline_apps = []
+        failed_pipeline_count = 0
+        for pipeline_file, config in zip(pipeline_files, configs):
+            if isinstance(config, Exception):
+                failed_pipeline_count += 1
+                log.error(f"{pipeline_file} - FAILED Processing pipeline file: {type(config).__name__} {config.args!r}")
+            else:
+                pipeline_apps.append(config)
+
+        repo_infos = await sync_to_async(read_repo_infos)(pipeline_apps)
+        results = await asyncio.gather(
+            *[process_pipeline(github, async_cf, pipeline_app, incremental, repo_infos.get(pipeline_app.config["scm"])) for pipeline_app in pipeline_apps],
+            return_exceptions=True,
+        )
+
+    # Results are collected in pipeline file order, as in check.scan_pipelines
+    pipeline_results = []
+    for pipeline_app, result in zip(pipeline_apps, results):
+        if isinstance(result, Exception):
+            failed_pipeline_count += 1
+            log.error(f"{pipeline_app.config_filename} - FAILED Processing pipeline file: {type(result).__name__} {result.args!r}")
+        else:
+            pipeline_results.append(result)
+    return pipeline_results, failed_pipeline_count
+
+
+def run_check_async(incremental=None):
+    if incremental is None:
+        incremental = settings.CHECK_INCREMENTAL
+
+    check_scan = start_scan()
+    try:
+        # The CloudFoundry object is used for its access token, and for the audit events read before the scan
+        cf = cf_login()
+        snapshot = read_pipeline_snapshot(check_scan)
+        cf_envs = read_cf_app_changes(cf, check_scan)
+        mirrors = GitMirrors() if settings.GIT_MIRROR_ENABLED else None
+        pipeline_results, failed_pipeline_count = asyncio.run(scan(cf, cf_envs, check_scan.start_time, incremental, snapshot, mirrors))
+        write_scan(check_scan, pipeline_results, failed_pipeline_count)
+    except BaseException:
+        fail_scan(check_scan)
+        raise
+    log_rate_limit_budgets()
+
+    if settings.GITHUB_CACHE_ENABLED:
+        prune_github_cache()
+
+    exit()
@@ -0,0 +1,505 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from aiohttp import web
+from collections import Counter
+from datetime import datetime, timedelta
+import asyncio
+import base64
+import hashlib
+import io
+import multiprocessing
+import re
+import resource
+import tarfile
+import threading
+import time
+import tracemalloc
+from . import config_snapshot, rate_limit
+from .models import Scan
+from .check import run_check
+from .async_check import run_check_async
+
+import logging
+
+log = logging.getLogger(__name__)
+
+BENCHMARK_ORG = "uktrade"
+BENCHMARK_PIPELINE_REPO = f"{BENCHMARK_ORG}/benchmark-pipelines"
+BENCHMARK_CF_ORG = "benchmark"
+HEAD_DATE = datetime(2024, 1, 31, 12, 0, 0)
+GRAPHQL_REPO_RE = re.compile(r'(r\d+): repository\(owner: "([^"]+)", name: "([^"]+)"\)')
+
+
+def fake_sha(*parts):
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class Fleet:
+    # A synthetic estate of pipelines, each with its own repo and one CF app per environment
+    def __init__(self, pipelines, environments=2, branches=20, commits=500):
+        self.pipelines = pipelines
+        self.environments = environments
+        self.branches = branches
+        self.commits = commits
+        self.env_names = [f"env{j}" for j in range(environments)]
+        self.repo_names = [f"app{i:04d}" for i in range(pipelines)]
+        self.repo_index = {repo_name: i for i, repo_name in enumerate(self.repo_names)}
+        self.app_guids = {
+            fake_sha("app", repo_name, env_name): (repo_name, env_name) for repo_name in self.repo_names for env_name in self.env_names
+        }
+        self.deploy_counts = Counter()
+        self.audit_events = []
+
+    def config(self, repo_name):
+        environments = "".join(
+            f"- environment: {env_name}\n  type: gds\n  app: {BENCHMARK_CF_ORG}/{env_name}/{repo_name}\n" for env_name in self.env_names
+        )
+        return f"scm: git@github.com:{BENCHMARK_ORG}/{repo_name}.git\nenvironments:\n{environments}"
+
+    def config_commit_sha(self):
+        return fake_sha("config", self.pipelines, self.environments)
+
+    def config_archive(self):
+        # The config repo as Github serves it from /tarball, every file under one "{owner}-{repo}-{sha}/" directory
+        archive_bytes = io.BytesIO()
+        with tarfile.open(fileobj=archive_bytes, mode="w:gz") as archive:
+            for repo_name in self.repo_names:
+                config = self.config(repo_name).encode()
+                member = tarfile.TarInfo(f"uktrade-benchmark-pipelines-{self.config_commit_sha()[:7]}/{repo_name}.yaml")
+                member.size = len(config)
+                archive.addfile(member, io.BytesIO(config))
+        return archive_bytes.getvalue()
+
+    def branch_list(self):
+        return ["main"] + [f"feature-{k}" for k in range(1, self.branches)]
+
+    def head_sha(self, repo_name):
+        return fake_sha(repo_name, "head")
+
+    def deployed_sha(self, repo_name, env_name):
+        deploy_count = self.deploy_counts[fake_sha("app", repo_name, env_name)]
+        return fake_sha(repo_name, env_name, deploy_count) if deploy_count else fake_sha(repo_name, env_name)
+
+    def deploy(self, repo_name, env_name, created_at):
+        # A new commit deployed to one app, recorded as CF records a deployment
+        app_guid = fake_sha("app", repo_name, env_name)
+        self.deploy_counts[app_guid] += 1
+        self.audit_events.append({
+            "guid": fake_sha("event", app_guid, self.deploy_counts[app_guid]),
+            "type": "audit.app.deployment.create",
+            "created_at": created_at,
+            "target": {"guid": app_guid, "type": "app", "name": repo_name},
+        })
+
+    def commit_date(self, repo_name, sha):
+        if sha == self.head_sha(repo_name):
+            return HEAD_DATE
+        return HEAD_DATE - timedelta(hours=int(sha[:4], 16) % 240)
+
+    def compare(self, repo_name, base_sha, head_sha):
+        # Deterministic drift, so every run of a fleet produces the same results
+        behind_by = int(head_sha[:4], 16) % 50
+        return {
+            "status": "diverged" if behind_by else "identical",
+            "ahead_by": int(head_sha[4:6], 16) % 3,
+            "behind_by": behind_by,
+            "total_commits": 0,
+            "merge_base_commit": {"sha": fake_sha(repo_name, head_sha, "base")},
+            "commits": [],
+            "files": [],
+        }
+
+
+def base_url(request):
+    return f"{request.scheme}://{request.host}"
+
+
+def link_header(request, page, last_page, **params):
+    links = []
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    if page < last_page:
+        links.append(f'<{base_url(request)}{request.path}?{query}&page={page + 1}>; rel="next"')
+    links.append(f'<{base_url(request)}{request.path}?{query}&page={last_page}>; rel="last"')
+    return ", ".join(links)
+
+
+def fake_app(fleet, latency, api_calls):
+    # Github REST/GraphQL, UAA and CF v3 endpoints for the fleet, counting calls by route
+    @web.middleware
+    async def count_calls(request, handler):
+        route = request.match_info.route.resource
+        api_calls[f"{request.method} {route.canonical if route else request.path}"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        return await handler(request)
+
+    def commit_json(request, repo, sha):
+        return {
+            "sha": sha,
+            "url": f"{base_url(request)}/repos/{BENCHMARK_ORG}/{repo}/commits/{sha}",
+            "author": {"login": "benchmark-author"},
+            "committer": {"login": "benchmark-committer"},
+        }
+
+    def last_modified(date):
+        return date.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+    async def repo(request):
+        repo = request.match_info["repo"]
+        if f"{BENCHMARK_ORG}/{repo}" != BENCHMARK_PIPELINE_REPO and repo not in fleet.repo_index:
+            raise web.HTTPNotFound()
+        return web.json_response({
+            "id": fleet.repo_index.get(repo, -1) + 1000,
+            "name": repo,
+            "full_name": f"{BENCHMARK_ORG}/{repo}",
+            "url": f"{base_url(request)}/repos/{BENCHMARK_ORG}/{repo}",
+            "private": False,
+            "archived": False,
+            "default_branch": "main",
+        })
+
+    async def contents_root(request):
+        return web.json_response([
+            {"type": "file", "name": f"{repo_name}.yaml", "path": f"{repo_name}.yaml", "sha": fake_sha(repo_name, "config")}
+            for repo_name in fleet.repo_names
+        ])
+
+    async def contents(request):
+        repo_name = request.match_info["path"].removesuffix(".yaml")
+        if repo_name not in fleet.repo_index:
+            raise web.HTTPNotFound()
+        return web.json_response({
+            "type": "file",
+            "path": request.match_info["path"],
+            "sha": fake_sha(repo_name, "config"),
+            "encoding": "base64",
+            "content": base64.b64encode(fleet.config(repo_name).encode()).decode(),
+        })
+
+    async def branches(request):
+        per_page = int(request.query.get("per_page", 30))
+        page = int(request.query.get("page", 1))
+        branch_list = fleet.branch_list()
+        last_page = max(1, -(-len(branch_list) // per_page))
+        page_branches = branch_list[(page - 1) * per_page:page * per_page]
+        return web.json_response(
+            [{"name": branch_name, "commit": {"sha": fake_sha(request.match_info["repo"], branch_name)}} for branch_name in page_branches],
+            headers={"Link": link_header(request, page, last_page, per_page=per_page)},
+        )
+
+    async def branch(request):
+        repo = request.match_info["repo"]
+        branch_name = request.match_info["branch"]
+        if branch_name not in fleet.branch_list():
+            return web.json_response({"message": "Branch not found"}, status=404)
+        sha = fleet.head_sha(repo) if branch_name == "main" else fake_sha(repo, branch_name)
+        return web.json_response({"name": branch_name, "commit": commit_json(request, repo, sha)})
+
+    async def commit(request):
+        repo = request.match_info["repo"]
+        sha = request.match_info["sha"]
+        if sha == "HEAD" and request.headers.get("Accept") == "application/vnd.github.sha":
+            return web.Response(text=fleet.config_commit_sha())
+        return web.json_response(
+            commit_json(request, repo, sha), headers={"Last-Modified": last_modified(fleet.commit_date(repo, sha))}
+        )
+
+    async def commits(request):
+        # Only the commit count is read from this list, through the "last" page link
+        per_page = int(request.query.get("per_page", 30))
+        page = int(request.query.get("page", 1))
+        last_page = max(1, -(-fleet.commits // per_page))
+        return web.json_response(
+            [commit_json(request, request.match_info["repo"], fake_sha(request.match_info["repo"], "commit", page))],
+            headers={"Link": link_header(request, page, last_page, sha=request.query.get("sha", ""), per_page=per_page)},
+        )
+
+    async def tarball(request):
+        return web.Response(body=fleet.config_archive(), content_type="application/x-gzip")
+
+    async def compare(request):
+        repo = request.match_info["repo"]
+        base_sha, head_sha = request.match_info["basehead"].split("...", 1)
+        return web.json_response(fleet.compare(repo, base_sha, head_sha))
+
+    def graphql_commit(repo, sha):
+        return {
+            "oid": sha,
+            "committedDate": fleet.commit_date(repo, sha).strftime(settings.GIT_GRAPHQL_DATE_FORMAT),
+            "author": {"user": {"login": "benchmark-author"}},
+            "committer": {"user": {"login": "benchmark-committer"}},
+            "history": {"totalCount": fleet.commits},
+        }
+
+    def graphql_refs(cursor, page_size=100):
+        start = int(cursor or 0)
+        branch_list = fleet.branch_list()
+        return {
+            "pageInfo": {"hasNextPage": start + page_size < len(branch_list), "endCursor": str(start + page_size)},
+            "nodes": [{"name": branch_name} for branch_name in branch_list[start:start + page_size]],
+        }
+
+    async def graphql(request):
+        body = await request.json()
+        variables = body.get("variables") or {}
+        if "cursor" in variables:
+            return web.json_response({"data": {"repository": {"refs": graphql_refs(variables["cursor"])}}})
+        data = {}
+        for alias, owner, repo in GRAPHQL_REPO_RE.findall(body["query"]):
+            if repo not in fleet.repo_index:
+                data[alias] = None
+                continue
+            head = {"name": "main", "target": graphql_commit(repo, fleet.head_sha(repo))}
+            data[alias] = {
+                "name": repo,
+                "databaseId": fleet.repo_index[repo] + 1000,
+                "isPrivate": False,
+                "isArchived": False,
+                "defaultBranchRef": head,
+                "master": None,
+                "main": head,
+            }
+            if "refs(" in body["query"]:
+                data[alias]["refs"] = graphql_refs(None)
+        return web.json_response({"data": data})
+
+    async def cf_root(request):
+        return web.json_response({"links": {"cloud_controller_v2": {"meta": {"version": "2.200.0"}}, "login": {"href": base_url(request)}}})
+
+    async def token(request):
+        return web.json_response({"access_token": "benchmark", "refresh_token": "benchmark", "token_type": "bearer", "expires_in": 3600})
+
+    def cf_list(request, resources, included=None):
+        per_page = int(request.query.get("per_page", 50))
+        page = int(request.query.get("page", 1))
+        next_page = None
+        if page * per_page < len(resources):
+            next_page = {"href": f"{base_url(request)}{request.path}?{request.query_string}&page={page + 1}"}
+        response = {"pagination": {"total_results": len(resources), "next": next_page}, "resources": resources[(page - 1) * per_page:page * per_page]}
+        if included is not None:
+            response["included"] = included
+        return web.json_response(response)
+
+    async def organizations(request):
+        return cf_list(request, [{"guid": fake_sha("org", name), "name": name} for name in request.query.get("names", "").split(",")])
+
+    async def spaces(request):
+        return cf_list(request, [
+            {"guid": fake_sha("space", name), "name": name, "relationships": {"organization": {"data": {"guid": request.query.get("organization_guids")}}}}
+            for name in request.query.get("names", "").split(",")
+        ])
+
+    async def apps(request):
+        org_guid = fake_sha("org", BENCHMARK_CF_ORG)
+        cf_apps = [
+            {"guid": app_guid, "name": repo_name, "relationships": {"space": {"data": {"guid": fake_sha("space", env_name)}}}}
+            for app_guid, (repo_name, env_name) in fleet.app_guids.items()
+        ]
+        included = {
+            "spaces": [
+                {"guid": fake_sha("space", env_name), "name": env_name, "relationships": {"organization": {"data": {"guid": org_guid}}}}
+                for env_name in fleet.env_names
+            ],
+            "organizations": [{"guid": org_guid, "name": BENCHMARK_CF_ORG}],
+        }
+        return cf_list(request, cf_apps, included)
+
+    async def app_env(request):
+        if request.match_info["guid"] not in fleet.app_guids:
+            raise web.HTTPNotFound()
+        repo_name, env_name = fleet.app_guids[request.match_info["guid"]]
+        return web.json_response({"environment_variables": {"GIT_BRANCH": "main", "GIT_COMMIT": fleet.deployed_sha(repo_name, env_name)}})
+
+    async def audit_events(request):
+        types = request.query["types"].split(",") if "types" in request.query else None
+        since = request.query.get("created_ats[gte]", "")
+        events = sorted(
+            [event for event in fleet.audit_events if (types is None or event["type"] in types) and event["created_at"] >= since],
+            key=lambda event: event["created_at"],
+            reverse=request.query.get("order_by") == "-created_at",
+        )
+        return cf_list(request, events)
+
+    app = web.Application(middlewares=[count_calls])
+    app.router.add_get("/repos/{owner}/{repo}", repo)
+    app.router.add_get("/repos/{owner}/{repo}/contents/", contents_root)
+    app.router.add_get("/repos/{owner}/{repo}/contents/{path}", contents)
+    app.router.add_get("/repos/{owner}/{repo}/branches", branches)
+    app.router.add_get("/repos/{owner}/{repo}/branches/{branch}", branch)
+    app.router.add_get("/repos/{owner}/{repo}/commits", commits)
+    app.router.add_get("/repos/{owner}/{repo}/commits/{sha}", commit)
+    app.router.add_get("/repos/{owner}/{repo}/compare/{basehead}", compare)
+    app.router.add_get("/repos/{owner}/{repo}/tarball/{ref}", tarball)
+    app.router.add_post("/graphql", graphql)
+    app.router.add_get("/", cf_root)
+    app.router.add_post("/oauth/token", token)
+    app.router.add_get("/v3/organizations", organizations)
+    app.router.add_get("/v3/spaces", spaces)
+    app.router.add_get("/v3/apps", apps)
+    app.router.add_get("/v3/apps/{guid}/env", app_env)
+    app.router.add_get("/v3/audit_events", audit_events)
+    return app
+
+
+class FakeServer:
+    # Serves the fake APIs from a background thread with its own event loop
+    def __init__(self, fleet, latency=0):
+        self.api_calls = Counter()
+        self.app = fake_app(fleet, latency, self.api_calls)
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.url = None
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        self.started.wait()
+        return self.url
+
+    def serve(self):
+        asyncio.set_event_loop(self.loop)
+        self.runner = web.AppRunner(self.app, access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        self.started.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class QueryCounter:
+    # Counts queries on every database connection, including the ones worker threads open
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender=None, connection=None, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.install)
+        for connection in connections.all():
+            if connection.connection is not None:
+                self.install(connection=connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+def cf_timestamp():
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def run_engine(engine, workers):
+    try:
+        if engine == "async":
+            run_check_async()
+        else:
+            run_check(workers=workers)
+    except SystemExit:
+        # Both engines exit the process when they finish
+        pass
+
+
+def run_benchmark(fleet, engine="threads", workers=None, latency=0, graphql=False, branch_lists=False, request_rate=0, trace_memory=False, deploys=None):
+    # Runs one full scan of the fleet against the fake APIs and returns its measurements
+    # With deploys, a first scan is followed by that many deployments, and the measurements are of the incremental scan after them
+    server = FakeServer(fleet, latency)
+    url = server.start()
+    call_command("flush", interactive=False, verbosity=0)
+    rate_limit.limiters.clear()
+    config_snapshot.snapshots.clear()
+    incremental_settings = {} if deploys is None else {"CHECK_INCREMENTAL": True, "CF_AUDIT_EVENTS_ENABLED": True}
+    try:
+        with override_settings(
+            GITHUB_API_URL=url,
+            GITHUB_GRAPHQL_URL=f"{url}/graphql",
+            GITHUB_GRAPHQL_ENABLED=graphql,
+            GITHUB_BRANCH_LIST_ENABLED=branch_lists,
+            GIT_PIPELINE_REPO=BENCHMARK_PIPELINE_REPO,
+            GIT_MIRROR_ENABLED=False,
+            CF_ENDPOINT=url,
+            CF_PROXY="",
+            GITHUB_REQUEST_RATE=request_rate,
+            CF_REQUEST_RATE=request_rate,
+            **incremental_settings,
+        ):
+            if deploys is not None:
+                # An earlier deployment gives the first scan an audit event cursor to start the next scan from
+                fleet.deploy(fleet.repo_names[0], fleet.env_names[0], cf_timestamp())
+                run_engine(engine, workers)
+                for repo_name, env_name in list(fleet.app_guids.values())[:deploys]:
+                    fleet.deploy(repo_name, env_name, cf_timestamp())
+                server.api_calls.clear()
+
+            with QueryCounter() as queries:
+                if trace_memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                run_engine(engine, workers)
+                wall_time = time.perf_counter() - start
+                memory_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+                if trace_memory:
+                    tracemalloc.stop()
+    finally:
+        server.stop()
+        rate_limit.limiters.clear()
+
+    scan = Scan.objects.order_by("-start_time").first()
+    # The peak of the whole process - run_benchmark_process gives each fleet a process of its own, so the peak is the fleet's
+    return {
+        "pipelines": fleet.pipelines,
+        "environments": fleet.pipelines * fleet.environments,
+        "engine": engine,
+        "deploys": deploys,
+        "status": scan.status if scan else None,
+        "environments_written": scan.environment_count if scan else 0,
+        "wall_time": round(wall_time, 3),
+        "api_calls": sum(server.api_calls.values()),
+        "api_calls_by_endpoint": dict(server.api_calls.most_common()),
+        "db_queries": queries.count,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "traced_memory_peak": memory_peak,
+    }
+
+
+def send_benchmark(sender, fleet, options):
+    sender.send(run_benchmark(fleet, **options))
+    sender.close()
+
+
+def run_benchmark_process(fleet, **options):
+    # Runs run_benchmark in a forked process, so max_rss_kb is not the peak of a larger fleet scanned before it
+    # Connections are closed first so the child opens its own rather than sharing the parent's
+    connections.close_all()
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=send_benchmark, args=(sender, fleet, options))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        # The child printed its traceback when it failed
+        result = None
+    process.join()
+    if result is None:
+        raise RuntimeError(f"Benchmark of {fleet.pipelines} pipelines failed (exit code {process.exitcode})")
+    return result
@@ -0,0 +1,43 @@
+from django.conf import settings
+
+from datetime import datetime, timedelta
+import hashlib
+import json
+from .models import Blob
+
+
+def content_hash(content):
+    # Key order and whitespace do not change the hash, so equal content is stored once
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def store_blobs(contents):
+    # Writes the contents not already stored and returns {sha256: Blob} for all of them
+    blobs = {content_hash(content): content for content in contents if content is not None}
+    stored = {}
+    # A blob the prune deleted between the insert and the read is written again
+    while len(stored) < len(blobs):
+        missing = [sha256 for sha256 in blobs if sha256 not in stored]
+        stored_time = datetime.now()
+        Blob.objects.bulk_create(
+            [Blob(sha256=sha256, content=blobs[sha256], stored_time=stored_time) for sha256 in missing],
+            batch_size=settings.CHECK_WRITE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        # Content already stored is marked as stored again, so the prune keeps it for the grace window.
+        # Only blobs past half the window are updated, so most scans write nothing here
+        touch_before = stored_time - timedelta(seconds=settings.RETENTION_BLOB_GRACE / 2)
+        Blob.objects.filter(sha256__in=missing, stored_time__lt=touch_before).update(stored_time=stored_time)
+        stored.update(Blob.objects.only("id", "sha256").in_bulk(missing, field_name="sha256"))
+    return stored
+
+
+def link_blobs(pipeline_apps):
+    blobs = store_blobs(
+        [pipeline_app.config for pipeline_app in pipeline_apps] + [pipeline_app.scm_repo_branch_list for pipeline_app in pipeline_apps]
+    )
+    for pipeline_app in pipeline_apps:
+        if pipeline_app.config is not None:
+            setattr(pipeline_app, "config_blob", blobs[content_hash(pipeline_app.config)])
+        if pipeline_app.scm_repo_branch_list is not None:
+            setattr(pipeline_app, "scm_repo_branch_list_blob", blobs[content_hash(pipeline_app.scm_repo_branch_list)])
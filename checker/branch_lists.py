@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import DatabaseError
+
+from datetime import datetime, timedelta
+from .blob_store import store_blobs, content_hash
+from .models import Scan, RepoBranchList
+from .rate_limit import low_priority
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def primary_branch_candidates(default_branch):
+    # Same preference as check.primary_branch_name - "main", then "master", then the default branch
+    candidates = []
+    for branch_name in ["main", "master", default_branch]:
+        if branch_name and branch_name not in candidates:
+            candidates.append(branch_name)
+    return candidates
+
+
+def link_branch_lists(pipeline_apps):
+    # Apps scanned without their branch list share the repo's last captured one
+    repo_names = {pipeline_app.config["scm"] for pipeline_app in pipeline_apps if pipeline_app.scm_repo_branch_list is None}
+    if not repo_names:
+        return
+    try:
+        blob_ids = dict(RepoBranchList.objects.filter(repo__in=repo_names).values_list("repo", "branch_list_blob_id"))
+    except DatabaseError as ex:
+        log.warning(f"Captured branch list read failed: {ex}")
+        return
+    for pipeline_app in pipeline_apps:
+        if pipeline_app.scm_repo_branch_list is None and pipeline_app.config["scm"] in blob_ids:
+            setattr(pipeline_app, "scm_repo_branch_list_blob_id", blob_ids[pipeline_app.config["scm"]])
+
+
+def scanned_repo_names():
+    # The repos of the latest completed scan
+    last_scan = Scan.objects.filter(status=Scan.Status.COMPLETED).order_by("-start_time").first()
+    if last_scan is None:
+        return []
+    pipeline_apps = last_scan.pipeline_apps().filter(config_blob__isnull=False).select_related("config_blob")
+    return sorted({pipeline_app.config["scm"] for pipeline_app in pipeline_apps if "uktrade" in pipeline_app.config["scm"]})
+
+
+def capture_branch_list(github, repo_name):
+    with low_priority():
+        branch_list = [branch.name for branch in github.get_repo(repo_name, lazy=True).get_branches()]
+    blob = store_blobs([branch_list])[content_hash(branch_list)]
+    RepoBranchList.objects.update_or_create(repo=repo_name, defaults={"branch_list_blob": blob, "captured_time": datetime.now()})
+    return branch_list
+
+
+def capture_branch_lists(github, max_age_hours=None):
+    # Lists the branches of each scanned repo not captured within max_age_hours
+    if max_age_hours is None:
+        max_age_hours = settings.BRANCH_LIST_MAX_AGE_HOURS
+    repo_names = scanned_repo_names()
+    fresh = set(RepoBranchList.objects.filter(captured_time__gte=datetime.now() - timedelta(hours=max_age_hours)).values_list("repo", flat=True))
+    captured = 0
+    for repo_name in repo_names:
+        if repo_name in fresh:
+            continue
+        try:
+            branch_list = capture_branch_list(github, repo_name)
+        except Exception as ex:
+            log.error(f"Cannot capture branch list of {repo_name}: {type(ex).__name__} {ex.args!r}")
+            continue
+        log.info(f"Captured {len(branch_list)} branches of {repo_name}")
+        captured += 1
+    log.info(f"Captured branch lists of {captured} of {len(repo_names)} repos")
@@ -0,0 +1,150 @@
+from django.conf import settings
+from django.db import DatabaseError
+
+from datetime import datetime, timedelta
+import threading
+from cloudfoundry_client.v3.entities import EntityManager
+from .models import CfGuid
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class CfGuidCache:
+    # Resolves CF org and space names to GUIDs once per scan, and optionally across scans for CF_GUID_CACHE_TTL seconds
+    def __init__(self, cf, ttl=None):
+        self.cf = cf
+        self.ttl = settings.CF_GUID_CACHE_TTL if ttl is None else ttl
+        self.guids = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def org_guid(self, org_name):
+        return self.resolve("org", org_name, "")
+
+    def space_guid(self, space_name, org_guid):
+        return self.resolve("space", space_name, org_guid)
+
+    def resolve(self, kind, name, parent_guid):
+        key = (kind, name, parent_guid)
+        # Environments sharing an org or space wait for the first lookup rather than repeating it
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.guids:
+                guid = self.read_stored(kind, name, parent_guid)
+                if not guid:
+                    guid = self.lookup(kind, name, parent_guid)
+                    if guid:
+                        self.store(kind, name, parent_guid, guid)
+                self.guids[key] = guid
+        return self.guids[key]
+
+    def forget_misses(self):
+        # A name that did not resolve may have been created since, so a reused cache looks it up again
+        with self.lock:
+            self.guids = {key: guid for key, guid in self.guids.items() if guid}
+
+    def lookup(self, kind, name, parent_guid):
+        guid = ""
+        if kind == "org":
+            for cf_orgs in self.cf.v3.organizations.list(names=name):
+                guid = cf_orgs["guid"]
+        else:
+            for cf_spaces in self.cf.v3.spaces.list(names=name, organization_guids=parent_guid):
+                guid = cf_spaces["guid"]
+        log.debug(f"Resolved CF {kind} '{name}': {guid}")
+        return guid
+
+    def read_stored(self, kind, name, parent_guid):
+        if self.ttl <= 0:
+            return None
+        try:
+            stored = CfGuid.objects.filter(
+                kind=kind, name=name, parent_guid=parent_guid, resolved_time__gte=datetime.now() - timedelta(seconds=self.ttl)
+            ).first()
+        except DatabaseError as ex:
+            log.warning(f"CF GUID cache read failed ({kind} '{name}'): {ex}")
+            return None
+        return stored.guid if stored else None
+
+    def store(self, kind, name, parent_guid, guid):
+        if self.ttl <= 0:
+            return
+        try:
+            CfGuid.objects.update_or_create(
+                kind=kind, name=name, parent_guid=parent_guid, defaults={"guid": guid, "resolved_time": datetime.now()}
+            )
+        except DatabaseError as ex:
+            log.warning(f"CF GUID cache write failed ({kind} '{name}'): {ex}")
+
+
+class CfAppIndex:
+    # Lists every app in an org once per scan (with its space and org included) and indexes the GUIDs by "org/space/app"
+    def __init__(self, cf, page_size=None):
+        self.cf = cf
+        self.page_size = settings.CF_APP_PAGE_SIZE if page_size is None else page_size
+        self.apps = {}
+        self.orgs = set()
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def app_guid(self, org_guid, full_name):
+        with self.lock:
+            org_lock = self.locks.setdefault(org_guid, threading.Lock())
+        with org_lock:
+            if org_guid not in self.orgs:
+                self.prefetch(org_guid)
+                self.orgs.add(org_guid)
+        return self.apps.get(full_name, "")
+
+    def prefetch(self, org_guid):
+        app_count = 0
+        for cf_app in self.cf.v3.apps.list(organization_guids=org_guid, include="space,space.organization", per_page=self.page_size):
+            cf_space = cf_app.space()
+            self.apps[f"{cf_space.organization()['name']}/{cf_space['name']}/{cf_app['name']}"] = cf_app["guid"]
+            app_count += 1
+        log.debug(f"Indexed {app_count} CF apps in org {org_guid}")
+
+
+def app_git_env(cf_app_env):
+    # The branch and commit the deploy pipeline sets on every app
+    return cf_app_env["environment_variables"]["GIT_BRANCH"], cf_app_env["environment_variables"]["GIT_COMMIT"]
+
+
+class CfAppEnvs:
+    # Reads each app's GIT_BRANCH and GIT_COMMIT, reusing the previous scan's for apps with no CF audit events since it
+    def __init__(self, cf, since=None, known=None, event_types=None, page_size=None):
+        self.cf = cf
+        self.since = since
+        self.cursor = since
+        self.known = {} if known is None else known
+        self.changed = set()
+        self.event_types = settings.CF_AUDIT_EVENT_TYPES if event_types is None else event_types
+        self.page_size = settings.CF_APP_PAGE_SIZE if page_size is None else page_size
+
+    def poll(self):
+        # The cursor is the created_at of the newest event seen, so the next scan starts from CF's own clock
+        audit_events = EntityManager(self.cf.v3.apps.target_endpoint, self.cf, "/v3/audit_events")
+        if self.since is None:
+            # Nothing to compare against, so every app is read and only the cursor is needed - the newest event of any type
+            latest_event = audit_events.get_first(order_by="-created_at")
+            self.cursor = latest_event["created_at"] if latest_event else None
+            return
+        for audit_event in audit_events.list(**{"types": self.event_types, "order_by": "created_at", "per_page": self.page_size, "created_ats[gte]": self.since}):
+            self.changed.add(audit_event["target"]["guid"])
+            self.cursor = audit_event["created_at"]
+        log.debug(f"CF audit events since {self.since}: {len(self.changed)} apps changed")
+
+    def known_git_env(self, app_guid):
+        # None when the app's env has to be read
+        if app_guid in self.changed:
+            return None
+        return self.known.get(app_guid)
+
+    def git_env(self, app_guid):
+        known_git_env = self.known_git_env(app_guid)
+        if known_git_env is not None:
+            return known_git_env
+        return app_git_env(self.cf.v3.apps.get_env(application_guid=app_guid))
@@ -0,0 +1,34 @@
+import threading
+from .rate_limit import RateLimitedCloudFoundryClient
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class SharedTokenCloudFoundryClient(RateLimitedCloudFoundryClient):
+    # One client is shared by every worker thread (and by the async engine, for its access token), so an expired access token is
+    # refreshed once between them. This overrides oauth2_client's CredentialManager._bearer_request and relies on its _access_token,
+    # _refresh_token and _is_token_expired - the version is pinned in pyproject.toml, and CfClientTests checks these are unchanged
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_lock = threading.Lock()
+
+    def refresh_expired_token(self, expired_token):
+        # Every thread whose request failed with the expired token lands here, but only the first refreshes it -
+        # the others wait and retry with the new token, rather than spending the refresh token again
+        with self.refresh_lock:
+            if self._access_token == expired_token:
+                log.debug("Refreshing the expired CF access token")
+                self._refresh_token()
+
+    def _bearer_request(self, method, url, **kwargs):
+        # As the library's version, but refreshing through refresh_expired_token
+        if kwargs.get("headers") is None:
+            kwargs["headers"] = dict()
+        access_token = self._access_token
+        response = method(url, **kwargs)
+        if self.refresh_token is not None and self._is_token_expired(response):
+            self.refresh_expired_token(access_token)
+            return method(url, **kwargs)
+        return response
@@ -1,18 +1,83 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, connections, transaction, DatabaseError
 
-from github import Github
-from cloudfoundry_client.client import CloudFoundryClient
+from github import Github, GithubException
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import yaml
-import csv
 import json
-from .models import PipelineApp, PipelineEnv
+from .models import Scan, PipelineApp, PipelineEnv, GitCommit
+from .github_cache import install_github_cache, prune_github_cache
+from .cf_cache import CfGuidCache, CfAppIndex, CfAppEnvs
+from .blob_store import link_blobs
+from .branch_lists import primary_branch_candidates, link_branch_lists
+from .commit_store import get_commit, get_commit_count, count_from_compare, write_commit, write_commit_count, CompareCache
+from .github_graphql import fetch_repos
+from .config_snapshot import read_config_snapshot
+from .git_mirror import GitMirrors, GitMirrorError
+from .cf_client import SharedTokenCloudFoundryClient
+from .rate_limit import low_priority, log_rate_limit_budgets, rate_limit_budgets
+from .metrics import timed, reset_scan_metrics, scan_phase_times, scan_api_calls, format_phase_times
 
 import logging
 
 log = logging.getLogger(__name__)
 
+# Fields read from Github commits and compares, which an incremental scan copies from the previous scan when nothing changed
+HEAD_COMMIT_FIELDS = [
+    "scm_repo_primary_branch_head_commit_date",
+    "scm_repo_primary_branch_head_commit_author",
+    "scm_repo_primary_branch_head_commit_committer",
+    "scm_repo_primary_branch_head_commit_count",
+]
+ENV_COMMIT_FIELDS = [
+    "cf_commit_date",
+    "cf_commit_author",
+    "cf_commit_count",
+    "drift_time_simple",
+    "git_compare_ahead_by",
+    "git_compare_behind_by",
+    "git_compare_merge_base_commit",
+    "git_compare_merge_base_commit_date",
+    "drift_time_merge_base",
+]
+
+# PyGithub connections are not thread safe, so each worker thread gets its own client
+thread_local = threading.local()
+
+
+def get_github():
+    if not hasattr(thread_local, "github"):
+        install_github_cache()
+        thread_local.github = Github(settings.GITHUB_TOKEN, base_url=settings.GITHUB_API_URL)
+    return thread_local.github
+
+
+# Worker threads open their own database connections (e.g. for the Github cache), and keep them for the whole scan
+worker_connections = set()
+worker_connections_lock = threading.Lock()
+
+
+def run_in_worker(function, *args):
+    with worker_connections_lock:
+        worker_connections.update(connections[alias] for alias in connections)
+    return function(*args)
+
+
+def close_worker_connections():
+    # Called once the pools have finished the scan's tasks, so no worker is using its connection
+    with worker_connections_lock:
+        for connection in worker_connections:
+            connection.inc_thread_sharing()
+            try:
+                connection.close()
+            except DatabaseError as ex:
+                log.warning(f"Could not close worker database connection: {ex}")
+            finally:
+                connection.dec_thread_sharing()
+        worker_connections.clear()
+
 
 def get_pipeline_configs(repo):
     yaml_file_list = []
@@ -22,14 +87,113 @@ def get_pipeline_configs(repo):
     return yaml_file_list
 
 
-def get_app_config_yaml(repo, config_file):
-    config_text = repo.get_contents(config_file).decoded_content.decode()
+def get_app_config_yaml(config_text):
     config_yaml = yaml.safe_load(config_text)
     for git_cleanup in settings.GIT_CLEANUP_LIST:
         config_yaml["scm"] = config_yaml["scm"].replace(git_cleanup, "")
     return config_yaml
 
 
+def primary_branch_name(branch_list, default_branch):
+    # Override primary branch with "master" or "main" if they exist (prefer "main")
+    primary_branch = None
+    for branch_name in [default_branch, "master", "main"]:
+        if branch_name in branch_list:
+            primary_branch = branch_name
+    return primary_branch
+
+
+def set_head_commit(pipeline_app, head_commit):
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_date", head_commit.date)
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_author", head_commit.author)
+    if pipeline_app.scm_repo_primary_branch_head_commit_author is None:
+        log.warn("Author cannot be read")
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_committer", head_commit.committer)
+    if pipeline_app.scm_repo_primary_branch_head_commit_committer is None:
+        log.warn("Committer cannot be read")
+
+
+def read_previous_pipeline(pipeline_file, scan_start_time):
+    # Only completed scans, so a crashed scan is never used as the baseline
+    return (
+        PipelineApp.objects.filter(config_filename=pipeline_file, scan_start_time__lt=scan_start_time, scan_fk__status=Scan.Status.COMPLETED)
+        .order_by("-scan_start_time")
+        .first()
+    )
+
+
+def read_base_scan(scan_start_time, pipeline_files, rescan_files):
+    # The full scan a partial scan builds on - none when there is no complete view to build on, or a rescanned config is gone
+    previous_scan = Scan.objects.filter(status=Scan.Status.COMPLETED, start_time__lt=scan_start_time).order_by("-start_time").first()
+    if previous_scan is None or not all(rescan_file in pipeline_files for rescan_file in rescan_files):
+        return None
+    return previous_scan.base_scan_fk if previous_scan.partial else previous_scan
+
+
+def read_cf_app_changes(cf, scan):
+    # Only apps with CF audit events since the previous scan's cursor have their env read again
+    if not settings.CF_AUDIT_EVENTS_ENABLED:
+        return CfAppEnvs(cf)
+    previous_scan = Scan.objects.filter(status=Scan.Status.COMPLETED, start_time__lt=scan.start_time).order_by("-start_time").first()
+    since, known = None, {}
+    if previous_scan is not None and previous_scan.cf_audit_cursor:
+        since = previous_scan.cf_audit_cursor
+        known = {
+            cf_app_guid: (cf_app_git_branch, cf_app_git_commit)
+            for cf_app_guid, cf_app_git_branch, cf_app_git_commit in previous_scan.pipeline_envs()
+            .exclude(cf_app_git_commit="")
+            .values_list("cf_app_guid", "cf_app_git_branch", "cf_app_git_commit")
+        }
+    cf_envs = CfAppEnvs(cf, since, known)
+    try:
+        with timed("cf_changes"):
+            cf_envs.poll()
+    except Exception as ex:
+        log.warning(f"CF audit events read failed, reading every app env: {type(ex).__name__} {ex.args!r}")
+        return CfAppEnvs(cf)
+    # A partial scan leaves most environments as its base scan read them, so the next scan has to look back as far as this one did
+    setattr(scan, "cf_audit_cursor", cf_envs.since if scan.partial else cf_envs.cursor)
+    log.info(f"CF audit events since {since}: {len(cf_envs.changed)} apps changed, {len(known)} deployments known")
+    return cf_envs
+
+
+def pipeline_fingerprint(pipeline_app):
+    return (pipeline_app.config_sha, pipeline_app.scm_repo_primary_branch_name, pipeline_app.scm_repo_primary_branch_head_commit_sha)
+
+
+def environment_fingerprint(pipeline_env):
+    return (pipeline_env.cf_full_name, pipeline_env.cf_app_guid, pipeline_env.cf_app_git_commit)
+
+
+def environment_unchanged(previous_env, pipeline_env):
+    # Only a previous environment that was fully processed has results worth carrying forward
+    return previous_env is not None and previous_env.drift_time_merge_base is not None and environment_fingerprint(previous_env) == environment_fingerprint(pipeline_env)
+
+
+def carry_forward(previous_record, record, fields):
+    for field in fields:
+        setattr(record, field, getattr(previous_record, field))
+
+
+# The steps below are shared by both engines, which differ only in how they read from Github and CF
+def carry_forward_pipeline(previous_app, pipeline_app):
+    # Incremental scan - an unchanged config and primary branch head keep the previous scan's commit results
+    if previous_app is None or pipeline_fingerprint(previous_app) != pipeline_fingerprint(pipeline_app):
+        return False
+    log.info(f"{pipeline_app.config_filename} - Pipeline unchanged since previous scan (id={previous_app.id})")
+    carry_forward(previous_app, pipeline_app, HEAD_COMMIT_FIELDS)
+    return True
+
+
+def carry_forward_environment(previous_env, pipeline_env):
+    # Incremental scan - the same commit is deployed as last time, so the previous commit and drift results still hold
+    if not environment_unchanged(previous_env, pipeline_env):
+        return False
+    log.info(f"{pipeline_env.pipeline_app_fk.config_filename} - Environment '{pipeline_env.config_env}' unchanged since previous scan")
+    carry_forward(previous_env, pipeline_env, ENV_COMMIT_FIELDS)
+    return True
+
+
 def record_json(record):
     record_dict = {}
     for field in record._meta.get_fields():
@@ -38,183 +202,452 @@ def record_json(record):
     return json.dumps(record_dict)
 
 
-def write_record(record):
-    log.info(record_json(record))
+def new_pipeline_env(pipeline_app, environment_yaml):
+    # Reads the environment from the pipeline yaml, setting log_message if it cannot be processed
+    pipeline_env = PipelineEnv()
+    setattr(pipeline_env, "pipeline_app_fk", pipeline_app)
+    setattr(pipeline_env, "config_env", environment_yaml["environment"])
+    setattr(pipeline_env, "cf_app_type", environment_yaml["type"])
+    if pipeline_env.cf_app_type != "gds":
+        pipeline_env.log_message = f"App type is '{pipeline_env.cf_app_type}'. Only processing 'gds' type apps here."
+        log.warning(pipeline_env.log_message)
+        return pipeline_env
+
+    # Read the CF path from the pipeline yaml
+    setattr(pipeline_env, "cf_full_name", environment_yaml["app"])
+
+    # Check CF application path has exactly 2 "/" characters - i.e. "org/spoace/app"
+    if pipeline_env.cf_full_name.count("/") != 2:
+        pipeline_env.log_message = f"Invalid app path: {pipeline_env.cf_full_name}"
+        log.error(pipeline_env.log_message)
+        return pipeline_env
+
+    # Read the org, space and app names for this environment
+    setattr(pipeline_env, "cf_org_name", pipeline_env.cf_full_name.split("/")[0])
+    setattr(pipeline_env, "cf_space_name", pipeline_env.cf_full_name.split("/")[1])
+    setattr(pipeline_env, "cf_app_name", pipeline_env.cf_full_name.split("/")[2])
+    return pipeline_env
+
+
+def app_guid_missing(pipeline_env):
+    # App GUID validation
+    if pipeline_env.cf_app_guid:
+        return False
+    pipeline_env.log_message = f"Cannot read app '{pipeline_env.cf_app_name}' with guid '{pipeline_env.cf_app_guid}'"
+    log.error(pipeline_env.log_message)
+    return True
+
+
+def set_cf_commit(pipeline_env, cf_commit):
+    if cf_commit.author is None:
+        raise ValueError(f"Commit {cf_commit.sha} has no author")
+    setattr(pipeline_env, "cf_commit_date", cf_commit.date)
+    setattr(pipeline_env, "cf_commit_author", cf_commit.author)
+
+
+def set_simple_drift(pipeline_app, pipeline_env):
+    # Calculate "simple" drift days - between head commit date and CF commit date
+    drift_time_simple = pipeline_env.cf_commit_date - pipeline_app.scm_repo_primary_branch_head_commit_date
+    setattr(pipeline_env, "drift_time_simple", drift_time_simple)
+
+
+def set_compare(pipeline_app, pipeline_env, cf_compare):
+    # Returns the CF commit count, which the compare gives from the head commit count without walking the CF commit history
+    setattr(pipeline_env, "git_compare_ahead_by", cf_compare.ahead_by)
+    setattr(pipeline_env, "git_compare_behind_by", cf_compare.behind_by)
+    setattr(pipeline_env, "git_compare_merge_base_commit", cf_compare.merge_base_sha)
+    return count_from_compare(pipeline_app.scm_repo_primary_branch_head_commit_count, cf_compare)
+
+
+def set_merge_base_drift(pipeline_app, pipeline_env, merge_base_commit_date):
+    # Calculate merge-base drift days - between primary branch head commit date and date of last common ancestor (head and cf)
+    setattr(pipeline_env, "git_compare_merge_base_commit_date", merge_base_commit_date)
+    drift_time_merge_base = pipeline_env.git_compare_merge_base_commit_date - pipeline_app.scm_repo_primary_branch_head_commit_date
+    setattr(pipeline_env, "drift_time_merge_base", drift_time_merge_base)
+
+
+def read_commit_date(repo, repo_name, sha, mirrors):
+    if mirrors is not None:
+        try:
+            return mirrors.get(repo_name).commit_date(sha)
+        except GitMirrorError as ex:
+            log.debug(f"Cannot read commit date from git mirror: {ex}")
+    return get_commit(repo, repo_name, sha).date
+
+
+def process_environment(cf_envs, cf_guids, cf_apps, compares, pipeline_app, environment_yaml, previous_env=None):
+    pipeline_file = pipeline_app.config_filename
+    log.info(f"{pipeline_file} - Processing environment '{environment_yaml['environment']}'")
+    pipeline_env = new_pipeline_env(pipeline_app, environment_yaml)
+    if pipeline_env.log_message:
+        return pipeline_env
+
+    # Read the org, space and app GUIDs for this environment
+    with timed("cf_resolution", pipeline_env):
+        setattr(pipeline_env, "cf_org_guid", cf_guids.org_guid(pipeline_env.cf_org_name))
+        setattr(pipeline_env, "cf_space_guid", cf_guids.space_guid(pipeline_env.cf_space_name, pipeline_env.cf_org_guid))
+        setattr(pipeline_env, "cf_app_guid", cf_apps.app_guid(pipeline_env.cf_org_guid, pipeline_env.cf_full_name))
+
+    if app_guid_missing(pipeline_env):
+        return pipeline_env
+
+    # Get app environment configuration
     try:
-        record.save()
+        with timed("env_fetch", pipeline_env):
+            cf_app_git_branch, cf_app_git_commit = cf_envs.git_env(pipeline_env.cf_app_guid)
+        setattr(pipeline_env, "cf_app_git_branch", cf_app_git_branch)
+        setattr(pipeline_env, "cf_app_git_commit", cf_app_git_commit)
     except:
-        error_message = f"Error saving record (pipeline={record.config_filename})"
-        raise Exception(error_message)
-    return record.id
+        pipeline_env.log_message = ("No SCM Branch or Commit Hash in app environmant")
+        log.error(pipeline_env.log_message)
+        return pipeline_env
 
+    if carry_forward_environment(previous_env, pipeline_env):
+        return pipeline_env
 
-def run_check():
-    scan_start_time = datetime.now()
+    # Bind the pipeline app SCM repo to this thread's Github client
+    pipeline_repo = get_github().get_repo(pipeline_app.config["scm"], lazy=True)
 
-    # Initialise Github object
-    g = Github(settings.GITHUB_TOKEN)
+    try:
+        # Get commit details of CF commit sha
+        with timed("commits", pipeline_env):
+            cf_commit = get_commit(pipeline_repo, pipeline_app.config["scm"], pipeline_env.cf_app_git_commit)
+        set_cf_commit(pipeline_env, cf_commit)
+    except:
+        pipeline_env.log_message = f"Cannot read commit {pipeline_env.cf_app_git_commit}"
+        log.error(pipeline_env.log_message)
+        return pipeline_env
+    set_simple_drift(pipeline_app, pipeline_env)
+
+    with timed("compare", pipeline_env):
+        cf_compare = compares.compare(pipeline_repo, pipeline_app.config["scm"], pipeline_app.scm_repo_primary_branch_head_commit_sha, pipeline_env.cf_app_git_commit)
+    cf_commit_count = set_compare(pipeline_app, pipeline_env, cf_compare)
+    if cf_commit.count is None:
+        write_commit_count(cf_commit, cf_commit_count)
+    setattr(pipeline_env, "cf_commit_count", cf_commit.count)
+    with timed("commits", pipeline_env):
+        merge_base_commit_date = read_commit_date(pipeline_repo, pipeline_app.config["scm"], pipeline_env.git_compare_merge_base_commit, compares.mirrors)
+    set_merge_base_drift(pipeline_app, pipeline_env, merge_base_commit_date)
+
+    return pipeline_env
+
+
+def read_head_commit(pipeline_app, pipeline_repo, compares):
+    # Read pipeline app SCM repo primary branch head commit
+    pipeline_repo_primary_branch_head_commit = get_commit(pipeline_repo, pipeline_app.config["scm"], pipeline_app.scm_repo_primary_branch_head_commit_sha)
+    set_head_commit(pipeline_app, pipeline_repo_primary_branch_head_commit)
+
+    # Count pipeline app SCM repo primary branch commits
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_count", get_commit_count(pipeline_repo, pipeline_repo_primary_branch_head_commit, compares, compares.mirrors))
+
+
+def new_pipeline_app(pipeline_file, scan_start_time, snapshot=None):
+    # With a config snapshot, the config is read from it - otherwise the engine reads it and calls set_config
+    log.info(f"{pipeline_file} - START Processing pipeline file")
+    pipeline_app = PipelineApp()
+    setattr(pipeline_app, "config_filename", pipeline_file)
+    setattr(pipeline_app, "scan_start_time", scan_start_time)
+    setattr(pipeline_app, "repo_scan_start_time", datetime.now())
+    if snapshot is not None:
+        set_config(pipeline_app, snapshot.config_sha(pipeline_file), snapshot.config(pipeline_file, get_app_config_yaml))
+    return pipeline_app
+
+
+def set_config(pipeline_app, config_sha, config):
+    setattr(pipeline_app, "config_sha", config_sha)
+    setattr(pipeline_app, "config", config)
+
+
+def read_pipeline_config(pipeline_file, scan_start_time, snapshot=None):
+    pipeline_app = new_pipeline_app(pipeline_file, scan_start_time, snapshot)
+    if snapshot is not None:
+        return pipeline_app
+
+    # Read config - this starts a new pipeline, so waits behind pipelines already in progress when the rate limit is low
+    # (with a config snapshot, the pipeline's first request is its repo read)
+    pipeline_config_repo = get_github().get_repo(settings.GIT_PIPELINE_REPO, lazy=True)
+    with low_priority(), timed("config_read", pipeline_app):
+        pipeline_config_contents = pipeline_config_repo.get_contents(pipeline_app.config_filename)
+    set_config(pipeline_app, pipeline_config_contents.sha, get_app_config_yaml(pipeline_config_contents.decoded_content.decode()))
+    return pipeline_app
+
+
+def read_pipeline_snapshot(scan):
+    # The whole config repo in one archive - on failure, configs are read one request each
+    if not settings.GITHUB_CONFIG_SNAPSHOT_ENABLED:
+        return None
+    try:
+        with timed("config_read"):
+            snapshot = read_config_snapshot()
+    except Exception as ex:
+        log.warning(f"Config repo snapshot failed, reading configs one by one: {type(ex).__name__} {ex.args!r}")
+        return None
+    setattr(scan, "config_commit_sha", snapshot.commit_sha)
+    return snapshot
 
-    # Initialise CloudFoundry object
-    cf_username = settings.CF_USERNAME
-    cf_password = settings.CF_PASSWORD
-    target_endpoint = settings.CF_ENDPOINT
-    cf = CloudFoundryClient(target_endpoint, proxy=dict(http=settings.CF_PROXY, https=settings.CF_PROXY))
-    cf.init_with_user_credentials(cf_username, cf_password)
 
-    # Read the pipeline configs
-    pipeline_config_repo = g.get_repo(settings.GIT_PIPELINE_REPO)
-    log.info(f"Config Repo: {pipeline_config_repo.name}")
-    pipeline_files = get_pipeline_configs(pipeline_config_repo)
-    log.debug(f"Pipelines: {pipeline_files}")
+def is_uktrade_pipeline(pipeline_app):
+    return "uktrade" in pipeline_app.config["scm"]
 
-    for pipeline_file in pipeline_files:
-        # Process pipelines
-        log.info(f"{pipeline_file} - START Processing pipeline file")
-        pipeline_app = PipelineApp()
-        setattr(pipeline_app, "config_filename", pipeline_file)
-        setattr(pipeline_app, "scan_start_time", scan_start_time)
-        setattr(pipeline_app, "repo_scan_start_time", datetime.now())
-
-        # Read config and check for a "uktrade" repo
-        setattr(pipeline_app, "config", get_app_config_yaml(pipeline_config_repo, pipeline_app.config_filename))
-        if "uktrade" not in pipeline_app.config["scm"]:
-            pipeline_env = PipelineEnv()
-            pipeline_env.log_message = (f"Not a UKTRADE repo: {pipeline_app.config['scm']}")
-            log.warning(pipeline_env.log_message)
-            write_record(pipeline_app)
-            continue
-
-        # Read pipeline app SCM repo
-        pipeline_repo = g.get_repo(pipeline_app.config["scm"])
-        setattr(pipeline_app, "scm_repo_name", pipeline_repo.name)
-        setattr(pipeline_app, "scm_repo_id", pipeline_repo.id)
-        setattr(pipeline_app, "scm_repo_private", pipeline_repo.private)
-        setattr(pipeline_app, "scm_repo_archived", pipeline_repo.archived)
 
+def set_repo(pipeline_app, name, repo_id, private, archived, default_branch):
+    setattr(pipeline_app, "scm_repo_name", name)
+    setattr(pipeline_app, "scm_repo_id", repo_id)
+    setattr(pipeline_app, "scm_repo_private", private)
+    setattr(pipeline_app, "scm_repo_archived", archived)
+    setattr(pipeline_app, "scm_repo_default_branch_name", default_branch)
+
+
+def read_repo(pipeline_app):
+    # Read pipeline app SCM repo - the first request of a pipeline whose config came from the snapshot, so it waits behind pipelines already in progress
+    with low_priority(), timed("repo_metadata", pipeline_app):
+        pipeline_repo = get_github().get_repo(pipeline_app.config["scm"])
+    set_repo(pipeline_app, pipeline_repo.name, pipeline_repo.id, pipeline_repo.private, pipeline_repo.archived, pipeline_repo.default_branch)
+    if settings.GITHUB_BRANCH_LIST_ENABLED:
         # Read branches and set branch to compare for code-drift calculations
-        pipeline_repo_branch_list = [ branch.name for branch in pipeline_repo.get_branches() ]
+        with timed("branches", pipeline_app):
+            pipeline_repo_branch_list = [ branch.name for branch in pipeline_repo.get_branches() ]
         setattr(pipeline_app, "scm_repo_branch_list", pipeline_repo_branch_list)
-        setattr(pipeline_app, "scm_repo_default_branch_name", pipeline_repo.default_branch)
-        # Override primary branch with "master" or "main" if they exist (prefer "main")
-        for branch_list in [pipeline_repo.default_branch, "master", "main"]:
-            if branch_list in pipeline_app.scm_repo_branch_list:
-                setattr(pipeline_app, "scm_repo_primary_branch_name", branch_list)
+        setattr(pipeline_app, "scm_repo_primary_branch_name", primary_branch_name(pipeline_app.scm_repo_branch_list, pipeline_repo.default_branch))
 
         # Read pipeline app SCM repo primary branch
-        pipeline_repo_primary_branch = pipeline_repo.get_branch(pipeline_app.scm_repo_primary_branch_name)
-        setattr(pipeline_app, "scm_repo_primary_branch_head_commit_sha", pipeline_repo_primary_branch.commit.sha)
-        
-        # Read pipeline app SCM repo primary branch commits
-        pipeline_repo_primary_branch_commits = pipeline_repo.get_commits(pipeline_app.scm_repo_primary_branch_name)
-        setattr(pipeline_app, "scm_repo_primary_branch_head_commit_count", pipeline_repo_primary_branch_commits.totalCount)
-
-        # Read pipeline app SCM repo primary branch head commit
-        pipeline_repo_primary_branch_head_commit = pipeline_repo.get_commit(pipeline_app.scm_repo_primary_branch_head_commit_sha)
-        setattr(pipeline_app, "scm_repo_primary_branch_head_commit_date", datetime.strptime(pipeline_repo_primary_branch_head_commit.last_modified, settings.GIT_RESPONSE_DATE_FORMAT))
+        with timed("branches", pipeline_app):
+            pipeline_repo_primary_branch = pipeline_repo.get_branch(pipeline_app.scm_repo_primary_branch_name)
+    else:
+        with timed("branches", pipeline_app):
+            pipeline_repo_primary_branch = read_primary_branch(pipeline_repo)
+        setattr(pipeline_app, "scm_repo_primary_branch_name", pipeline_repo_primary_branch.name)
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_sha", pipeline_repo_primary_branch.commit.sha)
+    return pipeline_repo
+
+
+def read_primary_branch(pipeline_repo):
+    # Tries only the candidate branches, most preferred first, so the cost does not grow with the number of branches
+    for branch_name in primary_branch_candidates(pipeline_repo.default_branch):
         try:
-            setattr(pipeline_app, "scm_repo_primary_branch_head_commit_author", pipeline_repo_primary_branch_head_commit.author.login)
-        except AttributeError:
-            setattr(pipeline_app, "scm_repo_primary_branch_head_commit_author", None)
-            log.warn("Author cannot be read")
+            return pipeline_repo.get_branch(branch_name)
+        except GithubException as ex:
+            # Github answers "Branch not found", which PyGithub does not map to UnknownObjectException
+            if ex.status != 404:
+                raise
+    raise ValueError(f"No primary branch in {pipeline_repo.full_name}")
+
+
+def set_repo_info(pipeline_app, repo_info):
+    # Same fields as read_repo and read_head_commit, from a batched Github GraphQL read
+    set_repo(pipeline_app, repo_info["name"], repo_info["id"], repo_info["private"], repo_info["archived"], repo_info["default_branch"])
+    setattr(pipeline_app, "scm_repo_branch_list", repo_info["branch_list"])
+    # The heads are only those of the candidate branches that exist
+    setattr(pipeline_app, "scm_repo_primary_branch_name", primary_branch_name(list(repo_info["heads"]), repo_info["default_branch"]))
+
+    head_commit = GitCommit(repo=pipeline_app.config["scm"], **repo_info["heads"][pipeline_app.scm_repo_primary_branch_name])
+    write_commit(head_commit)
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_sha", head_commit.sha)
+    set_head_commit(pipeline_app, head_commit)
+    setattr(pipeline_app, "scm_repo_primary_branch_head_commit_count", head_commit.count)
+
+
+def read_repo_infos(pipeline_apps):
+    # The SCM repos of every pipeline in batched Github GraphQL queries - repos it does not return are read with the REST API
+    if not settings.GITHUB_GRAPHQL_ENABLED:
+        return {}
+    try:
+        with low_priority(), timed("repo_metadata"):
+            return fetch_repos([pipeline_app.config["scm"] for pipeline_app in pipeline_apps if is_uktrade_pipeline(pipeline_app)])
+    except Exception as ex:
+        log.warning(f"Github GraphQL read failed, reading repos with the REST API: {type(ex).__name__} {ex.args!r}")
+        return {}
+
+
+def process_pipeline(cf_envs, cf_guids, cf_apps, compares, env_executor, pipeline_app, incremental, repo_info=None):
+    # Process pipelines, checking for a "uktrade" repo
+    pipeline_file = pipeline_app.config_filename
+    if not is_uktrade_pipeline(pipeline_app):
+        log.warning(f"Not a UKTRADE repo: {pipeline_app.config['scm']}")
+        return pipeline_app, []
+
+    if repo_info is not None:
+        set_repo_info(pipeline_app, repo_info)
+    else:
+        pipeline_repo = read_repo(pipeline_app)
+
+    previous_app = read_previous_pipeline(pipeline_file, pipeline_app.scan_start_time) if incremental else None
+    if carry_forward_pipeline(previous_app, pipeline_app):
+        previous_envs = {previous_env.config_env: previous_env for previous_env in previous_app.pipelineenv_set.all()}
+    else:
+        if repo_info is None:
+            with timed("commits", pipeline_app):
+                read_head_commit(pipeline_app, pipeline_repo, compares)
+        previous_envs = {}
+
+    # Process each environment in parallel, keeping the order from the pipeline config
+    env_futures = [
+        env_executor.submit(run_in_worker, process_environment, cf_envs, cf_guids, cf_apps, compares, pipeline_app, environment_yaml, previous_envs.get(environment_yaml["environment"]))
+        for environment_yaml in pipeline_app.config["environments"]
+    ]
+    pipeline_envs = [env_future.result() for env_future in env_futures]
+
+    for pipeline_env in pipeline_envs:
+        log.debug(f"{pipeline_file} - Environment '{pipeline_env.config_env}' phase times: {format_phase_times(pipeline_env)}")
+    return pipeline_app, pipeline_envs
+
+
+def start_scan(partial=False):
+    reset_scan_metrics()
+    scan = Scan.objects.create(start_time=datetime.now(), partial=partial)
+    log.info(f"Scan started (id={scan.id}, partial={partial})")
+    return scan
+
+
+def fail_scan(scan):
+    setattr(scan, "status", Scan.Status.FAILED)
+    setattr(scan, "end_time", datetime.now())
+    setattr(scan, "phase_times", scan_phase_times())
+    setattr(scan, "api_calls", scan_api_calls())
+    setattr(scan, "rate_limits", rate_limit_budgets())
+    try:
+        scan.save(update_fields=["status", "end_time", "phase_times", "api_calls", "rate_limits"])
+    except DatabaseError as ex:
+        log.warning(f"Could not mark scan {scan.id} failed: {ex}")
+
+
+def write_scan(scan, pipeline_results, failed_pipeline_count=0):
+    # The whole scan is written in one transaction, so the dashboard never sees a partly written scan
+    pipeline_apps = [pipeline_app for pipeline_app, pipeline_envs in pipeline_results]
+    try:
+        with transaction.atomic():
+            with timed("persist"):
+                link_blobs(pipeline_apps)
+                link_branch_lists(pipeline_apps)
+                for pipeline_app in pipeline_apps:
+                    setattr(pipeline_app, "scan_fk", scan)
+                PipelineApp.objects.bulk_create(pipeline_apps, batch_size=settings.CHECK_WRITE_BATCH_SIZE)
+                all_pipeline_envs = []
+                for pipeline_app, pipeline_envs in pipeline_results:
+                    for pipeline_env in pipeline_envs:
+                        # The app had no id when the env was created, so re-link it now it has been saved
+                        setattr(pipeline_env, "pipeline_app_fk", pipeline_app)
+                        setattr(pipeline_env, "scan_fk", scan)
+                        all_pipeline_envs.append(pipeline_env)
+                PipelineEnv.objects.bulk_create(all_pipeline_envs, batch_size=settings.CHECK_WRITE_BATCH_SIZE)
+
+            # The scan becomes visible to the dashboard in the same commit as its results
+            setattr(scan, "status", Scan.Status.COMPLETED)
+            setattr(scan, "end_time", datetime.now())
+            setattr(scan, "pipeline_count", len(pipeline_apps))
+            setattr(scan, "environment_count", len(all_pipeline_envs))
+            setattr(scan, "failed_pipeline_count", failed_pipeline_count)
+            setattr(scan, "phase_times", scan_phase_times())
+            setattr(scan, "api_calls", scan_api_calls())
+            setattr(scan, "rate_limits", rate_limit_budgets())
+            scan.save()
+    except DatabaseError as ex:
+        error_message = f"Error saving scan results ({len(pipeline_apps)} pipelines): {ex}"
+        raise Exception(error_message)
+
+    for pipeline_app, pipeline_envs in pipeline_results:
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(record_json(pipeline_app))
+            for pipeline_env in pipeline_envs:
+                log.debug(record_json(pipeline_env))
+        log.info(f"{pipeline_app.config_filename} - DONE Processing pipeline file (id={pipeline_app.id}, environments={len(pipeline_envs)}) [{format_phase_times(pipeline_app)}]")
+    log.info(f"Scan completed (id={scan.id}, pipelines={scan.pipeline_count}, environments={scan.environment_count}, failed={scan.failed_pipeline_count})")
+    log.info(f"Scan phase times: {scan.phase_times}, API calls: {scan.api_calls}")
+
+
+def run_check(workers=None, incremental=None):
+    scan = start_scan()
+    try:
+        check_pipelines(scan, workers, incremental)
+    except BaseException:
+        fail_scan(scan)
+        raise
+    log_rate_limit_budgets()
+
+    if settings.GITHUB_CACHE_ENABLED:
+        prune_github_cache()
+
+    exit()
+
+
+def check_pipelines(scan, workers, incremental):
+    if workers is None:
+        workers = settings.CHECK_WORKERS
+    if incremental is None:
+        incremental = settings.CHECK_INCREMENTAL
+
+    cf = cf_login()
+    compares = CompareCache(GitMirrors() if settings.GIT_MIRROR_ENABLED else None)
+
+    # Pipelines and environments use separate pools so a pipeline waiting on its environments cannot starve them
+    log.info(f"Processing pipelines with {workers} workers")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as env_executor, ThreadPoolExecutor(max_workers=workers) as pipeline_executor:
+            scan_pipelines(scan, incremental, cf, CfGuidCache(cf), CfAppIndex(cf), compares, env_executor, pipeline_executor)
+    finally:
+        close_worker_connections()
+
+
+def cf_login():
+    # Initialise CloudFoundry object
+    cf = SharedTokenCloudFoundryClient(settings.CF_ENDPOINT, proxy=dict(http=settings.CF_PROXY, https=settings.CF_PROXY))
+    cf.init_with_user_credentials(settings.CF_USERNAME, settings.CF_PASSWORD)
+    return cf
+
+
+def scan_pipelines(scan, incremental, cf, cf_guids, cf_apps, compares, env_executor, pipeline_executor, rescan_files=None):
+    # The clients, caches and pools are passed in, so the resident scanner can keep them between scans
+    scan_start_time = scan.start_time
+
+    # Read the pipeline configs
+    snapshot = read_pipeline_snapshot(scan)
+    if snapshot is not None:
+        pipeline_files = snapshot.pipeline_files()
+    else:
+        pipeline_config_repo = get_github().get_repo(settings.GIT_PIPELINE_REPO)
+        log.info(f"Config Repo: {pipeline_config_repo.name}")
+        pipeline_files = get_pipeline_configs(pipeline_config_repo)
+    log.debug(f"Pipelines: {pipeline_files}")
+
+    # A partial scan writes only rescan_files, and every other pipeline is read from the full scan it builds on
+    if rescan_files is not None:
+        base_scan = read_base_scan(scan_start_time, pipeline_files, rescan_files)
+        if base_scan is None:
+            log.info("No full scan to build a partial scan on, rescanning every pipeline")
+            setattr(scan, "partial", False)
+        else:
+            log.info(f"Rescanning {len(rescan_files)} pipelines over scan {base_scan.id}")
+            setattr(scan, "base_scan_fk", base_scan)
+            pipeline_files = [pipeline_file for pipeline_file in pipeline_files if pipeline_file in rescan_files]
+    cf_envs = read_cf_app_changes(cf, scan)
+
+    log.info(f"Processing {len(pipeline_files)} pipelines")
+    # Every config is read first, so the SCM repos can be read together
+    config_futures = [
+        pipeline_executor.submit(run_in_worker, read_pipeline_config, pipeline_file, scan_start_time, snapshot)
+        for pipeline_file in pipeline_files
+    ]
+    pipeline_apps = []
+    failed_pipeline_count = 0
+    for pipeline_file, config_future in zip(pipeline_files, config_futures):
+        try:
+            pipeline_apps.append(config_future.result())
         except Exception as ex:
-            setattr(pipeline_app, "scm_repo_primary_branch_head_commit_author", None)
-            log.error("Exception: {0} {1!r}".format(type(ex).__name__, ex.args))
+            failed_pipeline_count += 1
+            log.error(f"{pipeline_file} - FAILED Processing pipeline file: {type(ex).__name__} {ex.args!r}")
+
+    repo_infos = read_repo_infos(pipeline_apps)
+    pipeline_futures = [
+        pipeline_executor.submit(run_in_worker, process_pipeline, cf_envs, cf_guids, cf_apps, compares, env_executor, pipeline_app, incremental, repo_infos.get(pipeline_app.config["scm"]))
+        for pipeline_app in pipeline_apps
+    ]
+    # Results are collected in pipeline file order so the final state does not depend on thread scheduling
+    pipeline_results = []
+    for pipeline_app, pipeline_future in zip(pipeline_apps, pipeline_futures):
         try:
-            setattr(pipeline_app, "scm_repo_primary_branch_head_commit_committer", pipeline_repo_primary_branch_head_commit.committer.login)
-        except AttributeError:
-            setattr(pipeline_app, "scm_repo_primary_branch_head_commit_committer", None)
-            log.warn("Committer cannot be read")
+            pipeline_results.append(pipeline_future.result())
         except Exception as ex:
-            setattr(pipeline_app, "scm_repo_primary_branch_head_commit_committer", None)
-            log.error("Exception: {0} {1!r}".format(type(ex).__name__, ex.args))
-
-        write_record(pipeline_app)
-
-        # Process each environment
-        for environment_yaml in pipeline_app.config["environments"]:
-            log.info(f"{pipeline_file} - Processing environment '{environment_yaml['environment']}'")
-            pipeline_env = PipelineEnv()
-            setattr(pipeline_env, "pipeline_app_fk", pipeline_app)
-            setattr(pipeline_env, "config_env", environment_yaml["environment"])
-            setattr(pipeline_env, "cf_app_type", environment_yaml["type"])
-            if pipeline_env.cf_app_type != "gds":
-                pipeline_env.log_message = f"App type is '{pipeline_env.cf_app_type}'. Only processing 'gds' type apps here."
-                log.warning(pipeline_env.log_message)
-                write_record(pipeline_env)
-                continue
-
-            # Read the CF path from the pipeline yaml
-            setattr(pipeline_env, "cf_full_name", environment_yaml["app"])
-
-            # Check CF application path has exactly 2 "/" characters - i.e. "org/spoace/app"
-            if pipeline_env.cf_full_name.count("/") != 2:
-                pipeline_env.log_message = f"Invalid app path: {pipeline_env.cf_full_name}"
-                log.error(pipeline_env.log_message)
-                write_record(pipeline_env)
-                continue
-
-            # Read the org, space and app for this environment
-            # Read the org
-            setattr(pipeline_env, "cf_org_name", pipeline_env.cf_full_name.split("/")[0])
-            for cf_orgs in cf.v3.organizations.list(names=pipeline_env.cf_org_name):
-                setattr(pipeline_env, "cf_org_guid", cf_orgs["guid"])
-            # Read the space
-            setattr(pipeline_env, "cf_space_name", pipeline_env.cf_full_name.split("/")[1])
-            for cf_spaces in cf.v3.spaces.list(names=pipeline_env.cf_space_name, organization_guids=pipeline_env.cf_org_guid):
-                setattr(pipeline_env, "cf_space_guid", cf_spaces["guid"])
-            # Read the app
-            setattr(pipeline_env, "cf_app_name", pipeline_env.cf_full_name.split("/")[2])
-            for cf_apps in cf.v3.apps.list(names=pipeline_env.cf_app_name, space_guids=pipeline_env.cf_space_guid, organization_guids=pipeline_env.cf_org_guid):
-                setattr(pipeline_env, "cf_app_guid", cf_apps["guid"])
-
-            # App GUID validation
-            if not pipeline_env.cf_app_guid:
-                pipeline_env.log_message = f"Cannot read app '{pipeline_env.cf_app_name}' with guid '{pipeline_env.cf_app_guid}'"
-                log.error(pipeline_env.log_message)
-                write_record(pipeline_env)
-                continue
-
-            # Get app environment configuration
-            cf_app_env = cf.v3.apps.get_env(application_guid=pipeline_env.cf_app_guid)
-            try:
-                setattr(pipeline_env, "cf_app_git_branch", cf_app_env["environment_variables"]["GIT_BRANCH"])
-                setattr(pipeline_env, "cf_app_git_commit", cf_app_env["environment_variables"]["GIT_COMMIT"])
-            except:
-                pipeline_env.log_message = ("No SCM Branch or Commit Hash in app environmant")
-                log.error(pipeline_env.log_message)
-                write_record(pipeline_env)
-                continue
-
-            try:
-                # Get commit details of CF commit sha
-                cf_commit = pipeline_repo.get_commit(pipeline_env.cf_app_git_commit)
-                setattr(pipeline_env, "cf_commit_date", datetime.strptime(cf_commit.last_modified, settings.GIT_RESPONSE_DATE_FORMAT))
-                setattr(pipeline_env, "cf_commit_author", cf_commit.author.login)
-                setattr(pipeline_env, "cf_commit_count", pipeline_repo.get_commits(pipeline_env.cf_app_git_commit).totalCount)
-            except:
-                pipeline_env.log_message = f"Cannot read commit {pipeline_env.cf_app_git_commit}"
-                log.error(pipeline_env.log_message)
-                write_record(pipeline_env)
-                continue
-
-            # Calculate "simple" drift days - between head commit date and CF commit date
-            drift_time_simple = pipeline_env.cf_commit_date - pipeline_app.scm_repo_primary_branch_head_commit_date
-            setattr(pipeline_env, "drift_time_simple", drift_time_simple)
-
-            # Calculate merge-base drift days - between primary branch head commit date and date of last common ancestor (head and cf)
-            cf_compare = pipeline_repo.compare(pipeline_repo_primary_branch.commit.sha, pipeline_env.cf_app_git_commit)
-            setattr(pipeline_env, "git_compare_ahead_by", cf_compare.ahead_by)
-            setattr(pipeline_env, "git_compare_behind_by", cf_compare.behind_by)
-            setattr(pipeline_env, "git_compare_merge_base_commit", cf_compare.merge_base_commit.sha)
-            merge_base_commit = pipeline_repo.get_commit(pipeline_env.git_compare_merge_base_commit)
-            setattr(pipeline_env, "git_compare_merge_base_commit_date", datetime.strptime(merge_base_commit.last_modified, settings.GIT_RESPONSE_DATE_FORMAT))
-            drift_time_merge_base = pipeline_env.git_compare_merge_base_commit_date - pipeline_app.scm_repo_primary_branch_head_commit_date
-            setattr(pipeline_env, "drift_time_merge_base", drift_time_merge_base)
-
-            # Write completed record
-            write_record(pipeline_env)
-            log.info(f"{pipeline_app.config_filename} - Done (id={pipeline_env.id})")
-
-        log.info(f"{pipeline_app.config_filename} - DONE Processing pipeline file (id={pipeline_app.id})")
+            failed_pipeline_count += 1
+            log.error(f"{pipeline_app.config_filename} - FAILED Processing pipeline file: {type(ex).__name__} {ex.args!r}")
 
-    exit()
+    write_scan(scan, pipeline_results, failed_pipeline_count)
@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.db import DatabaseError
+
+from github import GithubException
+from datetime import datetime
+import threading
+from .models import GitCommit, GitCompare
+from .git_mirror import GitMirrorError, is_full_sha
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def user_login(user):
+    # Commits made by an email address with no Github account have no author/committer user
+    return user.login if user is not None else None
+
+
+# Commits are immutable, so a stored commit never needs to be fetched from Github again
+def read_commit(repo_name, sha):
+    try:
+        return GitCommit.objects.filter(repo=repo_name, sha=sha).first()
+    except DatabaseError as ex:
+        log.warning(f"Commit store read failed ({repo_name} {sha}): {ex}")
+        return None
+
+
+def write_commit(git_commit):
+    defaults = {"date": git_commit.date, "author": git_commit.author, "committer": git_commit.committer}
+    # Don't clear a count already worked out for this commit
+    if git_commit.count is not None:
+        defaults["count"] = git_commit.count
+    try:
+        GitCommit.objects.update_or_create(repo=git_commit.repo, sha=git_commit.sha, defaults=defaults)
+    except DatabaseError as ex:
+        log.warning(f"Commit store write failed ({git_commit.repo} {git_commit.sha}): {ex}")
+
+
+def get_commit(repo, repo_name, sha):
+    git_commit = read_commit(repo_name, sha)
+    if git_commit is not None:
+        return git_commit
+
+    commit = repo.get_commit(sha)
+    git_commit = GitCommit(
+        repo=repo_name,
+        sha=commit.sha,
+        date=datetime.strptime(commit.last_modified, settings.GIT_RESPONSE_DATE_FORMAT),
+        author=user_login(commit.author),
+        committer=user_login(commit.committer),
+    )
+    write_commit(git_commit)
+    return git_commit
+
+
+def write_commit_count(git_commit, count):
+    git_commit.count = count
+    try:
+        GitCommit.objects.filter(repo=git_commit.repo, sha=git_commit.sha).update(count=count)
+    except DatabaseError as ex:
+        log.warning(f"Commit store count write failed ({git_commit.repo} {git_commit.sha}): {ex}")
+
+
+def read_count_anchor(git_commit):
+    # The newest counted commit in the repo, usually the previous scan's primary branch head
+    try:
+        return GitCommit.objects.filter(repo=git_commit.repo, count__isnull=False).exclude(sha=git_commit.sha).order_by("-date").first()
+    except DatabaseError as ex:
+        log.warning(f"Commit store anchor read failed ({git_commit.repo}): {ex}")
+        return None
+
+
+def count_from_compare(base_count, git_compare):
+    # The commits in the base's history, less the commits only the base has, plus the commits only the head has
+    return base_count - git_compare.behind_by + git_compare.ahead_by
+
+
+def get_commit_count(repo, git_commit, compares, mirrors=None):
+    # The number of commits in the history of a commit never changes, so it is only worked out once
+    if git_commit.count is not None:
+        return git_commit.count
+
+    count = None
+    if mirrors is not None:
+        try:
+            count = mirrors.get(git_commit.repo).commit_count(git_commit.sha)
+        except GitMirrorError as ex:
+            log.debug(f"Cannot count commits in git mirror: {ex}")
+    anchor = read_count_anchor(git_commit) if count is None else None
+    if anchor is not None:
+        try:
+            anchor_compare = compares.compare(repo, git_commit.repo, anchor.sha, git_commit.sha)
+            count = count_from_compare(anchor.count, anchor_compare)
+        except GithubException as ex:
+            log.warning(f"Cannot compare with anchor commit {anchor.sha} ({git_commit.repo}): {ex}")
+    if count is None:
+        # No usable anchor, so fall back to having Github walk the history
+        count = repo.get_commits(git_commit.sha).totalCount
+    write_commit_count(git_commit, count)
+    return count
+
+
+# Comparing two commits always gives the same answer, so only compares between full SHAs are stored - not branches or short SHAs
+def read_compare(repo_name, base_sha, head_sha):
+    if not (is_full_sha(base_sha) and is_full_sha(head_sha)):
+        return None
+    try:
+        return GitCompare.objects.filter(repo=repo_name, base_sha=base_sha, head_sha=head_sha).first()
+    except DatabaseError as ex:
+        log.warning(f"Compare store read failed ({repo_name} {base_sha}...{head_sha}): {ex}")
+        return None
+
+
+def write_compare(git_compare):
+    if not (is_full_sha(git_compare.base_sha) and is_full_sha(git_compare.head_sha)):
+        return
+    try:
+        GitCompare.objects.update_or_create(
+            repo=git_compare.repo,
+            base_sha=git_compare.base_sha,
+            head_sha=git_compare.head_sha,
+            defaults={"ahead_by": git_compare.ahead_by, "behind_by": git_compare.behind_by, "merge_base_sha": git_compare.merge_base_sha},
+        )
+    except DatabaseError as ex:
+        log.warning(f"Compare store write failed ({git_compare.repo} {git_compare.base_sha}...{git_compare.head_sha}): {ex}")
+
+
+class CompareCache:
+    # Compares each (repo, base, head) once per scan, e.g. for environments deploying the same commit, and reuses stored compares across scans
+    # With git mirrors, compares are worked out locally and only fall back to the store and Github for commits the mirror lacks
+    def __init__(self, mirrors=None):
+        self.mirrors = mirrors
+        self.compares = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def compare(self, repo, repo_name, base_sha, head_sha):
+        # Branch names and short SHAs can point at new commits by the next scan, which would reuse this cache
+        if not (is_full_sha(base_sha) and is_full_sha(head_sha)):
+            return self.local_compare(repo_name, base_sha, head_sha) or self.github_compare(repo, repo_name, base_sha, head_sha)
+        key = (repo_name, base_sha, head_sha)
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.compares:
+                git_compare = self.local_compare(repo_name, base_sha, head_sha)
+                if git_compare is None:
+                    git_compare = read_compare(repo_name, base_sha, head_sha)
+                if git_compare is None:
+                    git_compare = self.github_compare(repo, repo_name, base_sha, head_sha)
+                    write_compare(git_compare)
+                self.compares[key] = git_compare
+        return self.compares[key]
+
+    def github_compare(self, repo, repo_name, base_sha, head_sha):
+        github_compare = repo.compare(base_sha, head_sha)
+        return GitCompare(
+            repo=repo_name,
+            base_sha=base_sha,
+            head_sha=head_sha,
+            ahead_by=github_compare.ahead_by,
+            behind_by=github_compare.behind_by,
+            merge_base_sha=github_compare.merge_base_commit.sha,
+        )
+
+    def local_compare(self, repo_name, base_sha, head_sha):
+        if self.mirrors is None:
+            return None
+        try:
+            mirror = self.mirrors.get(repo_name)
+            ahead_by, behind_by = mirror.ahead_behind(base_sha, head_sha)
+            merge_base_sha = mirror.merge_base(base_sha, head_sha)
+        except GitMirrorError as ex:
+            log.debug(f"Cannot compare in git mirror: {ex}")
+            return None
+        return GitCompare(repo=repo_name, base_sha=base_sha, head_sha=head_sha, ahead_by=ahead_by, behind_by=behind_by, merge_base_sha=merge_base_sha)
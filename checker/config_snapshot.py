@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db import DatabaseError
+
+from datetime import datetime
+import copy
+import hashlib
+import io
+import requests
+import tarfile
+import threading
+from .models import PipelineConfigSnapshot
+from .rate_limit import get_limiter
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def git_blob_sha(data):
+    # The sha Github gives a file's contents, so config_sha is the same as when each config was read on its own
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def github_get(session, path, **kwargs):
+    limiter = get_limiter("github")
+    limiter.acquire()
+    response = session.get(f"{settings.GITHUB_API_URL}{path}", **kwargs)
+    limiter.update(response.headers)
+    response.raise_for_status()
+    return response
+
+
+def read_head_sha(session):
+    # Just the sha of the config repo's default branch head
+    response = github_get(session, f"/repos/{settings.GIT_PIPELINE_REPO}/commits/HEAD", headers={"Accept": "application/vnd.github.sha"})
+    return response.text.strip()
+
+
+def fetch_config_files(session, commit_sha):
+    # The configs are the .yaml files at the top of the repo, each archive entry is under a "{owner}-{repo}-{sha}/" directory
+    response = github_get(session, f"/repos/{settings.GIT_PIPELINE_REPO}/tarball/{commit_sha}")
+    config_files = {}
+    with tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz") as archive:
+        for member in archive.getmembers():
+            path = member.name.split("/", 1)[-1]
+            if member.isfile() and "/" not in path and ".yaml" in path:
+                config_files[path] = archive.extractfile(member).read().decode()
+    return config_files
+
+
+class ConfigSnapshot:
+    # The pipeline configs at one commit of the config repo, each parsed once however many scans read it
+    def __init__(self, commit_sha, config_files):
+        self.commit_sha = commit_sha
+        self.config_files = config_files
+        self.configs = {}
+        self.lock = threading.Lock()
+
+    def pipeline_files(self):
+        return sorted(self.config_files)
+
+    def config_sha(self, pipeline_file):
+        return git_blob_sha(self.config_files[pipeline_file].encode())
+
+    def config(self, pipeline_file, parse):
+        with self.lock:
+            if pipeline_file not in self.configs:
+                self.configs[pipeline_file] = parse(self.config_files[pipeline_file])
+        # A copy, so a scan cannot change the config the next scan reuses
+        return copy.deepcopy(self.configs[pipeline_file])
+
+
+snapshots = {}
+snapshots_lock = threading.Lock()
+
+
+def read_stored_config_files(commit_sha):
+    try:
+        stored = PipelineConfigSnapshot.objects.filter(commit_sha=commit_sha).first()
+    except DatabaseError as ex:
+        log.warning(f"Config snapshot read failed ({commit_sha}): {ex}")
+        return None
+    return stored.config_files if stored else None
+
+
+def store_config_files(commit_sha, config_files):
+    # Only the latest snapshot is kept
+    try:
+        PipelineConfigSnapshot.objects.update_or_create(commit_sha=commit_sha, defaults={"config_files": config_files, "fetched_time": datetime.now()})
+        PipelineConfigSnapshot.objects.exclude(commit_sha=commit_sha).delete()
+    except DatabaseError as ex:
+        log.warning(f"Config snapshot write failed ({commit_sha}): {ex}")
+
+
+def read_config_snapshot():
+    # One request for the head sha, and one for the archive unless that commit has been read before
+    with requests.Session() as session:
+        session.headers["Authorization"] = f"token {settings.GITHUB_TOKEN}"
+        commit_sha = read_head_sha(session)
+        with snapshots_lock:
+            if commit_sha in snapshots:
+                log.info(f"Config repo unchanged at {commit_sha}")
+                return snapshots[commit_sha]
+
+        config_files = read_stored_config_files(commit_sha)
+        if config_files is None:
+            config_files = fetch_config_files(session, commit_sha)
+            store_config_files(commit_sha, config_files)
+    log.info(f"Config repo snapshot at {commit_sha} - {len(config_files)} pipeline configs")
+
+    snapshot = ConfigSnapshot(commit_sha, config_files)
+    with snapshots_lock:
+        snapshots.clear()
+        snapshots[commit_sha] = snapshot
+    return snapshot
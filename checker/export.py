@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.utils.dateparse import parse_datetime, parse_date
+
+from datetime import datetime, timedelta
+import csv
+import json
+from .models import Scan, PipelineEnv
+
+# Export column name and the PipelineEnv lookup it is read from
+EXPORT_COLUMNS = [
+    ("scan_id", "scan_fk_id"),
+    ("scan_start_time", "pipeline_app_fk__scan_start_time"),
+    ("config_filename", "pipeline_app_fk__config_filename"),
+    ("scm_repo_name", "pipeline_app_fk__scm_repo_name"),
+    ("scm_repo_primary_branch_name", "pipeline_app_fk__scm_repo_primary_branch_name"),
+    ("scm_repo_primary_branch_head_commit_sha", "pipeline_app_fk__scm_repo_primary_branch_head_commit_sha"),
+    ("scm_repo_primary_branch_head_commit_date", "pipeline_app_fk__scm_repo_primary_branch_head_commit_date"),
+    ("pipeline_env_id", "id"),
+    ("config_env", "config_env"),
+    ("cf_full_name", "cf_full_name"),
+    ("cf_app_type", "cf_app_type"),
+    ("cf_app_git_branch", "cf_app_git_branch"),
+    ("cf_app_git_commit", "cf_app_git_commit"),
+    ("cf_commit_date", "cf_commit_date"),
+    ("cf_commit_author", "cf_commit_author"),
+    ("git_compare_ahead_by", "git_compare_ahead_by"),
+    ("git_compare_behind_by", "git_compare_behind_by"),
+    ("git_compare_merge_base_commit", "git_compare_merge_base_commit"),
+    ("drift_time_simple", "drift_time_simple"),
+    ("drift_time_merge_base", "drift_time_merge_base"),
+    ("log_message", "log_message"),
+]
+EXPORT_FORMATS = ["csv", "json"]
+
+
+def parse_time(value):
+    # A full timestamp, or a date meaning its midnight
+    if not value:
+        return None
+    try:
+        time = parse_datetime(value)
+        if time is None:
+            date = parse_date(value)
+            time = datetime(date.year, date.month, date.day) if date else None
+    except ValueError:
+        time = None
+    if time is None:
+        raise ValueError(f"Not a date or time: {value}")
+    return time
+
+
+def export_rows(scan_id=None, since=None, until=None):
+    # One scan, or the rows written by every completed scan started in [since, until); the latest completed scan by default
+    # A partial scan exports as the dashboard shows it, with the pipelines it did not rescan from the scans it builds on
+    pipeline_envs = PipelineEnv.objects.all()
+    if scan_id is not None:
+        scan = Scan.objects.filter(id=scan_id).first()
+        pipeline_envs = scan.pipeline_envs() if scan else pipeline_envs.none()
+    elif since is not None or until is not None:
+        pipeline_envs = pipeline_envs.filter(scan_fk__status=Scan.Status.COMPLETED)
+        if since is not None:
+            pipeline_envs = pipeline_envs.filter(scan_fk__start_time__gte=since)
+        if until is not None:
+            pipeline_envs = pipeline_envs.filter(scan_fk__start_time__lt=until)
+    else:
+        last_scan = Scan.objects.filter(status=Scan.Status.COMPLETED).order_by("-start_time").first()
+        pipeline_envs = last_scan.pipeline_envs() if last_scan else pipeline_envs.none()
+
+    # iterator() reads through a server-side cursor (on PostgreSQL) in chunks, instead of loading every row
+    return pipeline_envs.order_by("scan_fk_id", "id").values_list(*[lookup for name, lookup in EXPORT_COLUMNS]).iterator(
+        chunk_size=settings.EXPORT_CHUNK_SIZE
+    )
+
+
+def export_value(value):
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+class LineBuffer:
+    # csv.writer writes each row to a file object, this one hands the formatted line back instead
+    def write(self, value):
+        return value
+
+
+def export_csv(rows):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow([name for name, lookup in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow([export_value(value) for value in row])
+
+
+def export_json(rows):
+    # JSON lines, one object per PipelineEnv
+    names = [name for name, lookup in EXPORT_COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(names, [export_value(value) for value in row]))) + "\n"
+
+
+def export_lines(export_format, rows):
+    return export_csv(rows) if export_format == "csv" else export_json(rows)
@@ -0,0 +1,190 @@
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Sum
+
+from github.Requester import Requester, RequestsResponse
+from datetime import datetime
+import hashlib
+import re
+import threading
+import requests
+from .models import GithubCacheEntry
+from .rate_limit import get_limiter
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# One keep-alive session per thread, shared by every connection that thread creates
+thread_local = threading.local()
+
+
+def get_session(protocol, retry, pool_size):
+    if not hasattr(thread_local, "sessions"):
+        thread_local.sessions = {}
+    if protocol not in thread_local.sessions:
+        adapter = requests.adapters.HTTPAdapter(
+            max_retries=requests.adapters.DEFAULT_RETRIES if retry is None else retry,
+            pool_connections=requests.adapters.DEFAULT_POOLSIZE if pool_size is None else pool_size,
+            pool_maxsize=requests.adapters.DEFAULT_POOLSIZE if pool_size is None else pool_size,
+        )
+        session = requests.Session()
+        session.mount(f"{protocol}://", adapter)
+        thread_local.sessions[protocol] = session
+    return thread_local.sessions[protocol]
+
+
+# Commits and compares of SHAs never change, and are kept in the commit and compare stores, so caching their responses as well only fills the cache
+IMMUTABLE_PATH = re.compile(r"^/(?:api/v3/)?repos/[^/]+/[^/]+/(?:commits|compare)(?:/|\?|$)")
+
+
+def is_cacheable(url):
+    return IMMUTABLE_PATH.match(url) is None
+
+
+def cache_key(host, url, accept):
+    # The same path can be on more than one Github host, and the Accept header picks the representation returned
+    return hashlib.sha256(f"{host}\n{url}\n{accept or ''}".encode()).hexdigest()
+
+
+# The cache is best effort - a database error only costs an unconditional request
+def read_entry(key, url):
+    try:
+        return GithubCacheEntry.objects.filter(key=key).first()
+    except DatabaseError as ex:
+        log.warning(f"Github cache read failed ({url}): {ex}")
+        return None
+
+
+def touch_entry(entry):
+    try:
+        GithubCacheEntry.objects.filter(id=entry.id).update(accessed_time=datetime.now())
+    except DatabaseError as ex:
+        log.warning(f"Github cache update failed ({entry.url}): {ex}")
+
+
+def write_entry(key, url, headers, body):
+    try:
+        GithubCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={
+                "url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "headers": dict(headers),
+                "body": body,
+                "size": len(body.encode()),
+                "accessed_time": datetime.now(),
+            },
+        )
+    except DatabaseError as ex:
+        log.warning(f"Github cache write failed ({url}): {ex}")
+
+
+class CachedResponse:
+    # mimic the httplib response object, built from a stored GithubCacheEntry
+    def __init__(self, entry, response_headers):
+        self.status = 200
+        self.headers = dict(entry.headers)
+        # Rate limit headers etc. come from the 304 response, everything else from the cache
+        self.headers.update(response_headers)
+        self.text = entry.body
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self):
+        return self.text
+
+
+class CachingConnectionClass:
+    # mimic the httplib connection object, pacing requests to the rate limit, sending conditional GETs and answering 304s from the cache
+    protocol = None
+    default_port = None
+
+    def __init__(self, host, port=None, strict=False, timeout=None, retry=None, pool_size=None, **kwargs):
+        self.port = port if port else self.default_port
+        self.host = host
+        self.timeout = timeout
+        self.verify = kwargs.get("verify", True)
+        self.session = get_session(self.protocol, retry, pool_size)
+
+    def request(self, verb, url, input, headers):
+        self.verb = verb
+        self.url = url
+        self.input = input
+        self.headers = headers
+
+    def getresponse(self):
+        headers = dict(self.headers)
+        entry = None
+        use_cache = self.verb == "GET" and settings.GITHUB_CACHE_ENABLED and is_cacheable(self.url)
+        if use_cache:
+            key = cache_key(f"{self.host}:{self.port}", self.url, headers.get("Accept"))
+            entry = read_entry(key, self.url)
+            if entry is not None:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+        limiter = get_limiter("github")
+        limiter.acquire()
+        verb = getattr(self.session, self.verb.lower())
+        r = verb(
+            f"{self.protocol}://{self.host}:{self.port}{self.url}",
+            headers=headers,
+            data=self.input,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+        )
+        limiter.update(r.headers)
+
+        if r.status_code == 304 and entry is not None:
+            log.debug(f"Github cache hit: {self.url}")
+            touch_entry(entry)
+            return CachedResponse(entry, r.headers)
+
+        if use_cache and r.status_code == 200 and ("ETag" in r.headers or "Last-Modified" in r.headers):
+            write_entry(key, self.url, r.headers, r.text)
+        return RequestsResponse(r)
+
+    def close(self):
+        return
+
+
+class HTTPCachingConnectionClass(CachingConnectionClass):
+    protocol = "http"
+    default_port = 80
+
+
+class HTTPSCachingConnectionClass(CachingConnectionClass):
+    protocol = "https"
+    default_port = 443
+
+
+def install_github_cache():
+    # Must run before a Github object is created, as the Requester picks its connection class on creation
+    # The connection class is always used for rate limiting, and only caches when GITHUB_CACHE_ENABLED is set
+    Requester.injectConnectionClasses(HTTPCachingConnectionClass, HTTPSCachingConnectionClass)
+
+
+def prune_github_cache(max_size=None):
+    if max_size is None:
+        max_size = settings.GITHUB_CACHE_MAX_SIZE
+    cache_size = GithubCacheEntry.objects.aggregate(Sum("size"))["size__sum"] or 0
+    if cache_size <= max_size:
+        return 0
+
+    # Evict least recently used entries until the cache fits
+    evict_ids = []
+    for entry_id, entry_size in GithubCacheEntry.objects.order_by("accessed_time").values_list("id", "size").iterator():
+        if cache_size <= max_size:
+            break
+        evict_ids.append(entry_id)
+        cache_size -= entry_size
+    for i in range(0, len(evict_ids), 500):
+        GithubCacheEntry.objects.filter(id__in=evict_ids[i:i + 500]).delete()
+    log.info(f"Github cache pruned {len(evict_ids)} entries")
+    return len(evict_ids)
@@ -0,0 +1,117 @@
+from django.conf import settings
+
+from datetime import datetime
+import json
+import requests
+from .rate_limit import get_limiter
+
+import logging
+
+log = logging.getLogger(__name__)
+
+COMMIT_FIELDS = "... on Commit { oid committedDate author { user { login } } committer { user { login } } history { totalCount } }"
+BRANCH_PAGE_SIZE = 100
+
+BRANCH_LIST_FIELDS = f"""refs(refPrefix: "refs/heads/", first: {BRANCH_PAGE_SIZE}) {{ pageInfo {{ hasNextPage endCursor }} nodes {{ name }} }}"""
+
+
+def repo_fragment(branch_list):
+    # The primary branch is the default branch, "master" or "main", so the head commit of all three is fetched up front
+    return f"""
+fragment RepoFields on Repository {{
+  name
+  databaseId
+  isPrivate
+  isArchived
+  defaultBranchRef {{ name target {{ {COMMIT_FIELDS} }} }}
+  master: ref(qualifiedName: "refs/heads/master") {{ name target {{ {COMMIT_FIELDS} }} }}
+  main: ref(qualifiedName: "refs/heads/main") {{ name target {{ {COMMIT_FIELDS} }} }}
+  {BRANCH_LIST_FIELDS if branch_list else ""}
+}}
+"""
+
+BRANCH_PAGE_QUERY = f"""
+query($owner: String!, $name: String!, $cursor: String!) {{
+  repository(owner: $owner, name: $name) {{
+    refs(refPrefix: "refs/heads/", first: {BRANCH_PAGE_SIZE}, after: $cursor) {{ pageInfo {{ hasNextPage endCursor }} nodes {{ name }} }}
+  }}
+}}
+"""
+
+
+def run_query(session, query, variables=None):
+    limiter = get_limiter("github_graphql")
+    limiter.acquire()
+    response = session.post(
+        settings.GITHUB_GRAPHQL_URL,
+        json={"query": query, "variables": variables or {}},
+        headers={"Authorization": f"bearer {settings.GITHUB_TOKEN}"},
+    )
+    limiter.update(response.headers)
+    response.raise_for_status()
+    result = response.json()
+    # Partial results are normal, e.g. one repo in the batch has been renamed or deleted
+    for error in result.get("errors", []):
+        log.warning(f"Github GraphQL error: {error.get('message')}")
+    return result.get("data") or {}
+
+
+def read_commit(ref):
+    commit = ref["target"]
+    return {
+        "sha": commit["oid"],
+        "date": datetime.strptime(commit["committedDate"], settings.GIT_GRAPHQL_DATE_FORMAT),
+        "author": ((commit["author"] or {}).get("user") or {}).get("login"),
+        "committer": ((commit["committer"] or {}).get("user") or {}).get("login"),
+        "count": commit["history"]["totalCount"],
+    }
+
+
+def read_branch_list(session, repo_name, refs):
+    branch_list = [branch["name"] for branch in refs["nodes"]]
+    owner, name = repo_name.split("/", 1)
+    while refs["pageInfo"]["hasNextPage"]:
+        data = run_query(session, BRANCH_PAGE_QUERY, {"owner": owner, "name": name, "cursor": refs["pageInfo"]["endCursor"]})
+        refs = data["repository"]["refs"]
+        branch_list.extend(branch["name"] for branch in refs["nodes"])
+    return branch_list
+
+
+def read_repo_info(session, repo_name, repository):
+    heads = {}
+    for ref in [repository["defaultBranchRef"], repository["master"], repository["main"]]:
+        if ref is not None:
+            heads[ref["name"]] = read_commit(ref)
+    return {
+        "name": repository["name"],
+        "id": repository["databaseId"],
+        "private": repository["isPrivate"],
+        "archived": repository["isArchived"],
+        "default_branch": repository["defaultBranchRef"]["name"] if repository["defaultBranchRef"] else None,
+        "branch_list": read_branch_list(session, repo_name, repository["refs"]) if "refs" in repository else None,
+        "heads": heads,
+    }
+
+
+def fetch_repos(repo_names, batch_size=None):
+    # Reads the metadata and candidate primary branch head commits (and optionally the branches) of many repos in one query per batch
+    if batch_size is None:
+        batch_size = settings.GITHUB_GRAPHQL_BATCH_SIZE
+    repo_names = sorted(set(repo_names))
+    fragment = repo_fragment(settings.GITHUB_BRANCH_LIST_ENABLED)
+    repo_infos = {}
+    with requests.Session() as session:
+        for i in range(0, len(repo_names), batch_size):
+            batch = repo_names[i:i + batch_size]
+            repo_queries = []
+            for j, repo_name in enumerate(batch):
+                owner, name = repo_name.split("/", 1)
+                repo_queries.append(f"r{j}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ ...RepoFields }}")
+            data = run_query(session, "query {\n" + "\n".join(repo_queries) + "\n}\n" + fragment)
+            for j, repo_name in enumerate(batch):
+                repository = data.get(f"r{j}")
+                # Repos missing from the result are read with the REST API instead
+                if repository is not None:
+                    repo_infos[repo_name] = read_repo_info(session, repo_name, repository)
+    log.info(f"Read {len(repo_infos)} of {len(repo_names)} repos with Github GraphQL")
+    return repo_infos
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+import json
+from checker.benchmark import Fleet, run_benchmark_process
+
+
+class Command(BaseCommand):
+    help = "Time full scans of synthetic fleets against local Github and CF stand-ins, in a throwaway test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pipelines", default="10,100,1000", help="Comma separated fleet sizes, one scan each")
+        parser.add_argument("--environments", type=int, default=2, help="Environments (CF apps) per pipeline")
+        parser.add_argument("--branches", type=int, default=20, help="Branches per repo, which scans only list with --branch-lists")
+        parser.add_argument("--commits", type=int, default=500, help="Commits on each primary branch")
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every fake API response")
+        parser.add_argument("--engine", choices=["threads", "async"], default=settings.CHECK_ENGINE)
+        parser.add_argument("--workers", type=int, default=settings.CHECK_WORKERS)
+        parser.add_argument("--graphql", action="store_true", help="Read repos with the batched Github GraphQL query")
+        parser.add_argument(
+            "--branch-lists", action="store_true", help="List every branch of each repo in the scan (GITHUB_BRANCH_LIST_ENABLED), instead of only the primary branch candidates"
+        )
+        parser.add_argument("--request-rate", type=float, default=0, help="Requests per second per API (0 = unpaced)")
+        parser.add_argument(
+            "--deploys", type=int, help="Scan each fleet once, deploy new commits to this many apps, then time an incremental scan with CF audit events"
+        )
+        parser.add_argument("--trace-memory", action="store_true", help="Report the traced Python memory peak of each scan (slows the scan)")
+        parser.add_argument("--output", help="Also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        # The scans write to a fresh test database, never the configured one
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        results = []
+        try:
+            for pipelines in [int(size) for size in options["pipelines"].split(",")]:
+                fleet = Fleet(pipelines, options["environments"], options["branches"], options["commits"])
+                result = run_benchmark_process(
+                    fleet,
+                    engine=options["engine"],
+                    workers=options["workers"],
+                    latency=options["latency"],
+                    graphql=options["graphql"],
+                    branch_lists=options["branch_lists"],
+                    request_rate=options["request_rate"],
+                    trace_memory=options["trace_memory"],
+                    deploys=options["deploys"],
+                )
+                results.append(result)
+                self.report(result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+
+    def report(self, result):
+        self.stdout.write(
+            f"{result['pipelines']} pipelines / {result['environments']} environments ({result['engine']}, scan {result['status']}"
+            + (f" after {result['deploys']} deploys" if result["deploys"] is not None else "")
+            + "): "
+            f"{result['wall_time']}s, {result['api_calls']} API calls, {result['db_queries']} DB queries, "
+            f"max RSS of its process {result['max_rss_kb'] // 1024} MB"
+            + (f", traced peak {result['traced_memory_peak'] // (1024 * 1024)} MB" if result["traced_memory_peak"] is not None else "")
+        )
+        for endpoint, count in result["api_calls_by_endpoint"].items():
+            self.stdout.write(f"    {count:>8}  {endpoint}")
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from checker.branch_lists import capture_branch_lists
+from checker.check import get_github
+
+
+class Command(BaseCommand):
+    help = "List every branch of the scanned repos, for scans that only check the primary branch candidates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-age-hours", type=int, default=settings.BRANCH_LIST_MAX_AGE_HOURS, help="Skip repos captured more recently than this")
+
+    def handle(self, *args, **options):
+        capture_branch_lists(get_github(), max_age_hours=options["max_age_hours"])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from checker.export import EXPORT_FORMATS, export_rows, export_lines, parse_time
+
+
+class Command(BaseCommand):
+    help = "Stream scan results (PipelineEnv rows with their PipelineApp) as CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv", help="CSV, or one JSON object per line")
+        parser.add_argument("--scan", type=int, help="Export this scan id (default: the latest completed scan)")
+        parser.add_argument("--since", help="Export completed scans started at or after this date/time")
+        parser.add_argument("--until", help="Export completed scans started before this date/time")
+        parser.add_argument("--output", help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_time(options["since"])
+            until = parse_time(options["until"])
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        rows = export_rows(scan_id=options["scan"], since=since, until=until)
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(export_lines(options["format"], rows))
+        else:
+            for line in export_lines(options["format"], rows):
+                self.stdout.write(line, ending="")
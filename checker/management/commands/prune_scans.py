@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from checker.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = "Roll up scans older than the retention window into daily drift summaries, then delete them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.RETENTION_DAYS, help="Days of scans kept at full resolution")
+        parser.add_argument("--batch-size", type=int, default=settings.RETENTION_BATCH_SIZE, help="Rows deleted per transaction")
+
+    def handle(self, *args, **options):
+        apply_retention(days=options["days"], batch_size=options["batch_size"])
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import hashlib
+import hmac
+import requests
+import uuid
+
+
+class Command(BaseCommand):
+    help = "Sign a recorded Github webhook payload with GITHUB_WEBHOOK_SECRET and send it to the webhook endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("payload", help="File holding the JSON body of a recorded delivery")
+        parser.add_argument("--event", default="push", help="Github event name sent in X-GitHub-Event")
+        parser.add_argument("--url", default="http://localhost:8000/webhooks/github", help="Webhook endpoint to send to")
+
+    def handle(self, *args, **options):
+        with open(options["payload"], "rb") as payload_file:
+            body = payload_file.read()
+        signature = "sha256=" + hmac.new(settings.GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        response = requests.post(options["url"], data=body, headers={
+            "Content-Type": "application/json",
+            "X-GitHub-Event": options["event"],
+            "X-GitHub-Delivery": str(uuid.uuid4()),
+            "X-Hub-Signature-256": signature,
+        })
+        self.stdout.write(f"{response.status_code} {response.text}")
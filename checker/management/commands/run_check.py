@@ -1,8 +1,19 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
+import argparse
 from checker.check import run_check
+from checker.async_check import run_check_async
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument("--engine", choices=["threads", "async"], default=settings.CHECK_ENGINE, help="Scan with worker threads (PyGithub/cloudfoundry_client) or asyncio (aiohttp)")
+        parser.add_argument("--workers", type=int, default=settings.CHECK_WORKERS, help="Number of pipelines (and environments) processed concurrently")
+        parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=settings.CHECK_INCREMENTAL, help="Reuse the previous scan's commit and drift results for unchanged pipelines and environments (--no-incremental to scan everything when CHECK_INCREMENTAL is set)")
+
     def handle(self, *args, **options):
-        run_check()
+        if options["engine"] == "async":
+            run_check_async(incremental=options["incremental"])
+        else:
+            run_check(workers=options["workers"], incremental=options["incremental"])
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import argparse
+import signal
+from checker.scanner import Scanner
+
+
+class Command(BaseCommand):
+    help = "Keep scanning on a schedule in one process, reusing the Github and CF sessions and caches between scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.CHECK_WORKERS, help="Number of pipelines (and environments) processed concurrently")
+        parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=settings.CHECK_INCREMENTAL, help="Reuse the previous scan's commit and drift results for unchanged pipelines and environments (--no-incremental to scan everything when CHECK_INCREMENTAL is set)")
+        parser.add_argument("--interval", type=int, default=settings.SCANNER_INTERVAL, help="Seconds from the start of one scan to the start of the next")
+        parser.add_argument("--rescan-poll", type=int, default=settings.SCANNER_RESCAN_POLL, help="Seconds between checks for pipelines queued for rescan by Github webhooks")
+        parser.add_argument("--max-scans", type=int, default=0, help="Stop after this many scans (0 runs until stopped)")
+
+    def handle(self, *args, **options):
+        scanner = Scanner(workers=options["workers"], incremental=options["incremental"], interval=options["interval"], rescan_poll=options["rescan_poll"])
+        # Cloud Foundry stops an app with SIGTERM
+        signal.signal(signal.SIGTERM, scanner.stop)
+        scanner.run(max_scans=options["max_scans"])
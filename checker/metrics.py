@@ -0,0 +1,87 @@
+from collections import Counter
+from contextlib import contextmanager
+import threading
+import time
+
+import logging
+
+log = logging.getLogger(__name__)
+
+PHASES = ["config_read", "repo_metadata", "branches", "commits", "cf_resolution", "cf_changes", "env_fetch", "compare", "persist"]
+
+
+class ScanMetrics:
+    # Phase times (summed across workers, so they can add up to more than the scan's wall time) and API calls for one scan
+    def __init__(self):
+        self.phase_times = Counter()
+        self.api_calls = Counter()
+        self.lock = threading.Lock()
+
+    def add_phase_time(self, phase, seconds):
+        with self.lock:
+            self.phase_times[phase] += seconds
+
+    def count_api_call(self, backend):
+        with self.lock:
+            self.api_calls[backend] += 1
+
+    def phase_times_dict(self):
+        with self.lock:
+            return {phase: round(self.phase_times[phase], 3) for phase in PHASES if phase in self.phase_times}
+
+    def api_calls_dict(self):
+        with self.lock:
+            return dict(self.api_calls)
+
+
+scan_metrics = ScanMetrics()
+
+
+def reset_scan_metrics():
+    global scan_metrics
+    scan_metrics = ScanMetrics()
+    return scan_metrics
+
+
+def count_api_call(backend):
+    scan_metrics.count_api_call(backend)
+
+
+def scan_phase_times():
+    return scan_metrics.phase_times_dict()
+
+
+def scan_api_calls():
+    return scan_metrics.api_calls_dict()
+
+
+def record_phase_times(record):
+    if not hasattr(record, "phase_times"):
+        setattr(record, "phase_times", Counter())
+    return record.phase_times
+
+
+def format_phase_times(record):
+    return ", ".join(f"{phase}={record_phase_times(record)[phase]:.2f}s" for phase in PHASES if phase in record_phase_times(record))
+
+
+@contextmanager
+def timed(phase, *records):
+    # Adds the time spent in the block to the scan's phase total and to each pipeline app or env it was spent on
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        scan_metrics.add_phase_time(phase, elapsed)
+        for record in records:
+            record_phase_times(record)[phase] += elapsed
+
+
+def prometheus_metric(lines, name, help_text, samples, metric_type="gauge"):
+    # samples is a list of (labels dict, value)
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
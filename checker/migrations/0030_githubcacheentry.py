@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-17 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0029_alter_pipelineapp_scm_repo_branch_list_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GithubCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('url', models.TextField()),
+                ('etag', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=64, null=True)),
+                ('headers', models.JSONField()),
+                ('body', models.TextField()),
+                ('size', models.PositiveIntegerField()),
+                ('accessed_time', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
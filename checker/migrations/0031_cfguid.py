@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-17 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0030_githubcacheentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CfGuid',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=16)),
+                ('name', models.CharField(max_length=64)),
+                ('parent_guid', models.CharField(blank=True, max_length=64)),
+                ('guid', models.CharField(max_length=64)),
+                ('resolved_time', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('kind', 'name', 'parent_guid')},
+            },
+        ),
+    ]
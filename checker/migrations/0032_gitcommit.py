@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0031_cfguid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitCommit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('repo', models.CharField(max_length=128)),
+                ('sha', models.CharField(max_length=64)),
+                ('date', models.DateTimeField()),
+                ('author', models.CharField(blank=True, max_length=64, null=True)),
+                ('committer', models.CharField(blank=True, max_length=64, null=True)),
+            ],
+            options={
+                'unique_together': {('repo', 'sha')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0032_gitcommit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitcommit',
+            name='count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
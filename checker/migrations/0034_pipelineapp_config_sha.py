@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0033_gitcommit_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelineapp',
+            name='config_sha',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0034_pipelineapp_config_sha'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitCompare',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('repo', models.CharField(max_length=128)),
+                ('base_sha', models.CharField(max_length=64)),
+                ('head_sha', models.CharField(max_length=64)),
+                ('ahead_by', models.PositiveIntegerField()),
+                ('behind_by', models.PositiveIntegerField()),
+                ('merge_base_sha', models.CharField(max_length=64)),
+            ],
+            options={
+                'unique_together': {('repo', 'base_sha', 'head_sha')},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0035_gitcompare'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=16)),
+                ('pipeline_count', models.PositiveIntegerField(default=0)),
+                ('environment_count', models.PositiveIntegerField(default=0)),
+                ('failed_pipeline_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pipelineapp',
+            index=models.Index(fields=['config_filename', '-scan_start_time'], name='checker_pip_config__966748_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['status', '-start_time'], name='checker_sca_status_753602_idx'),
+        ),
+        migrations.AddField(
+            model_name='pipelineapp',
+            name='scan_fk',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='checker.scan'),
+        ),
+        migrations.AddField(
+            model_name='pipelineenv',
+            name='scan_fk',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='checker.scan'),
+        ),
+        migrations.AddIndex(
+            model_name='pipelineenv',
+            index=models.Index(fields=['scan_fk', 'id'], name='checker_pip_scan_fk_051ec5_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def backfill_scans(apps, schema_editor):
+    # Every existing scan_start_time becomes a completed Scan, linked to its apps and envs
+    Scan = apps.get_model("checker", "Scan")
+    PipelineApp = apps.get_model("checker", "PipelineApp")
+    PipelineEnv = apps.get_model("checker", "PipelineEnv")
+    scan_times = PipelineApp.objects.values("scan_start_time").annotate(pipeline_count=Count("id"), end_time=Max("repo_scan_start_time")).order_by("scan_start_time")
+    for scan_time in scan_times:
+        scan = Scan.objects.create(
+            start_time=scan_time["scan_start_time"],
+            end_time=scan_time["end_time"],
+            status="completed",
+            pipeline_count=scan_time["pipeline_count"],
+            environment_count=PipelineEnv.objects.filter(pipeline_app_fk__scan_start_time=scan_time["scan_start_time"]).count(),
+        )
+        PipelineApp.objects.filter(scan_start_time=scan_time["scan_start_time"]).update(scan_fk=scan)
+        PipelineEnv.objects.filter(pipeline_app_fk__scan_start_time=scan_time["scan_start_time"]).update(scan_fk=scan)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0036_scan'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_scans, migrations.RunPython.noop),
+    ]
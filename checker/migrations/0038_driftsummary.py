@@ -0,0 +1,31 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0037_backfill_scans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriftSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('config_filename', models.CharField(max_length=64)),
+                ('config_env', models.CharField(max_length=64)),
+                ('cf_full_name', models.CharField(max_length=255)),
+                ('scan_count', models.PositiveIntegerField()),
+                ('max_git_compare_ahead_by', models.PositiveIntegerField(blank=True, null=True)),
+                ('max_git_compare_behind_by', models.PositiveIntegerField(blank=True, null=True)),
+                ('max_drift_time_simple', models.DurationField(blank=True, null=True)),
+                ('max_drift_time_merge_base', models.DurationField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('date', 'config_filename', 'config_env')},
+            },
+        ),
+    ]
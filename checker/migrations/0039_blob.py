@@ -0,0 +1,33 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0038_driftsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('content', models.JSONField()),
+                ('stored_time', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pipelineapp',
+            name='config_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='config_pipeline_apps', to='checker.blob'),
+        ),
+        migrations.AddField(
+            model_name='pipelineapp',
+            name='scm_repo_branch_list_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='branch_list_pipeline_apps', to='checker.blob'),
+        ),
+    ]
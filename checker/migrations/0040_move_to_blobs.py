@@ -0,0 +1,79 @@
+from django.db import migrations
+from datetime import datetime
+import ast
+import hashlib
+import json
+
+BATCH_SIZE = 2000
+
+
+def content_hash(content):
+    return hashlib.sha256(json.dumps(content, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def parse_branch_list(branch_lists, branch_list):
+    # Stored as str() of a Python list, and most repos' lists repeat across scans, so each distinct string is parsed once
+    if branch_list is None:
+        return None
+    if branch_list not in branch_lists:
+        try:
+            branch_lists[branch_list] = ast.literal_eval(branch_list)
+        except (ValueError, SyntaxError):
+            branch_lists[branch_list] = branch_list
+    return branch_lists[branch_list]
+
+
+def store_blobs(Blob, blob_ids, contents):
+    # Writes the batch's new contents in one insert, and adds their ids to blob_ids by sha256
+    new_blobs = {}
+    for content in contents:
+        if content is not None:
+            sha256 = content_hash(content)
+            if sha256 not in blob_ids:
+                new_blobs[sha256] = content
+    if not new_blobs:
+        return
+    stored_time = datetime.now()
+    Blob.objects.bulk_create([Blob(sha256=sha256, content=content, stored_time=stored_time) for sha256, content in new_blobs.items()], ignore_conflicts=True)
+    blob_ids.update(Blob.objects.filter(sha256__in=list(new_blobs)).values_list("sha256", "id"))
+
+
+def move_batch(Blob, PipelineApp, blob_ids, branch_lists, pipeline_apps):
+    contents = []
+    for pipeline_app in pipeline_apps:
+        pipeline_app.scm_repo_branch_list = parse_branch_list(branch_lists, pipeline_app.scm_repo_branch_list)
+        contents += [pipeline_app.config, pipeline_app.scm_repo_branch_list]
+    store_blobs(Blob, blob_ids, contents)
+    for pipeline_app in pipeline_apps:
+        if pipeline_app.config is not None:
+            pipeline_app.config_blob_id = blob_ids[content_hash(pipeline_app.config)]
+        if pipeline_app.scm_repo_branch_list is not None:
+            pipeline_app.scm_repo_branch_list_blob_id = blob_ids[content_hash(pipeline_app.scm_repo_branch_list)]
+    PipelineApp.objects.bulk_update(pipeline_apps, ["config_blob", "scm_repo_branch_list_blob"])
+
+
+def move_to_blobs(apps, schema_editor):
+    # Each distinct config and branch list becomes one blob shared by every app row that had it, written and linked a batch of rows at a time
+    Blob = apps.get_model("checker", "Blob")
+    PipelineApp = apps.get_model("checker", "PipelineApp")
+    blob_ids = {}
+    branch_lists = {}
+    pipeline_apps = []
+    for pipeline_app in PipelineApp.objects.only("id", "config", "scm_repo_branch_list").iterator(chunk_size=BATCH_SIZE):
+        pipeline_apps.append(pipeline_app)
+        if len(pipeline_apps) == BATCH_SIZE:
+            move_batch(Blob, PipelineApp, blob_ids, branch_lists, pipeline_apps)
+            pipeline_apps = []
+    if pipeline_apps:
+        move_batch(Blob, PipelineApp, blob_ids, branch_lists, pipeline_apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0039_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_blobs, migrations.RunPython.noop),
+    ]
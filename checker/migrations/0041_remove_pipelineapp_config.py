@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0040_move_to_blobs'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='pipelineapp',
+            name='config',
+        ),
+        migrations.RemoveField(
+            model_name='pipelineapp',
+            name='scm_repo_branch_list',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0041_remove_pipelineapp_config'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='api_calls',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='phase_times',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0042_scan_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineConfigSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('commit_sha', models.CharField(max_length=64, unique=True)),
+                ('config_files', models.JSONField()),
+                ('fetched_time', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='config_commit_sha',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
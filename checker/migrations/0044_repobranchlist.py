@@ -0,0 +1,23 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0043_pipelineconfigsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepoBranchList',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('repo', models.CharField(max_length=128, unique=True)),
+                ('captured_time', models.DateTimeField()),
+                ('branch_list_blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='repo_branch_lists', to='checker.blob')),
+            ],
+        ),
+    ]
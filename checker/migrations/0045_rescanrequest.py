@@ -0,0 +1,39 @@
+# Generated by Django 4.2.8 on 2026-10-17 18:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0044_repobranchlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='partial',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='scan',
+            name='base_scan_fk',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='partial_scans', to='checker.scan'),
+        ),
+        migrations.CreateModel(
+            name='RescanRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('config_filename', models.CharField(max_length=64)),
+                ('reason', models.CharField(max_length=255)),
+                ('delivery_id', models.CharField(blank=True, max_length=64)),
+                ('requested_time', models.DateTimeField()),
+                ('processed_time', models.DateTimeField(blank=True, null=True)),
+                ('scan_fk', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='checker.scan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_time', 'requested_time'], name='checker_res_process_b8ebb2_idx')],
+            },
+        ),
+    ]
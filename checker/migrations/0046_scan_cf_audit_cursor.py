@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0045_rescanrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='cf_audit_cursor',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checker', '0046_scan_cf_audit_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scan',
+            name='rate_limits',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -4,16 +4,75 @@ import logging
 
 log = logging.getLogger(__name__)
 
+class Scan(models.Model):
+    class Status(models.TextChoices):
+        RUNNING = "running"
+        COMPLETED = "completed"
+        FAILED = "failed"
+
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.RUNNING)
+    pipeline_count = models.PositiveIntegerField(default=0)
+    environment_count = models.PositiveIntegerField(default=0)
+    failed_pipeline_count = models.PositiveIntegerField(default=0)
+    # A partial scan wrote only the pipelines queued by webhooks, and every other pipeline is read from its base (full) scan
+    partial = models.BooleanField(default=False)
+    base_scan_fk = models.ForeignKey("self", null=True, blank=True, on_delete=models.SET_NULL, related_name="partial_scans")
+    config_commit_sha = models.CharField(max_length=64, null=True, blank=True)
+    # created_at of the newest CF audit event this scan had seen, where the next scan's change detection starts
+    cf_audit_cursor = models.CharField(max_length=32, null=True, blank=True)
+    phase_times = models.JSONField(default=dict, blank=True)
+    api_calls = models.JSONField(default=dict, blank=True)
+    # X-RateLimit budget of each API when the scan finished, by limiter name
+    rate_limits = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "-start_time"])]
+
+    def view_scan_ids(self):
+        # A partial scan is its base scan with each completed partial scan of that base, up to and including this one, laid over it
+        if not self.partial or self.base_scan_fk_id is None:
+            return [self.id]
+        partial_scans = Scan.objects.filter(base_scan_fk_id=self.base_scan_fk_id, status=Scan.Status.COMPLETED, start_time__lte=self.start_time)
+        return [self.base_scan_fk_id] + sorted(set(partial_scans.values_list("id", flat=True)) | {self.id})
+
+    def pipeline_apps(self):
+        # Each pipeline from the latest of the view's scans that wrote it
+        scan_ids = self.view_scan_ids()
+        if len(scan_ids) == 1:
+            return PipelineApp.objects.filter(scan_fk_id=self.id)
+        later_apps = PipelineApp.objects.filter(
+            scan_fk_id__in=scan_ids, config_filename=models.OuterRef("config_filename"), scan_start_time__gt=models.OuterRef("scan_start_time")
+        )
+        return PipelineApp.objects.filter(scan_fk_id__in=scan_ids).exclude(models.Exists(later_apps))
+
+    def pipeline_envs(self):
+        if len(self.view_scan_ids()) == 1:
+            return PipelineEnv.objects.filter(scan_fk_id=self.id)
+        return PipelineEnv.objects.filter(pipeline_app_fk__in=self.pipeline_apps())
+
+
+class Blob(models.Model):
+    # Content-addressed JSON, stored once however many scans refer to it
+    sha256 = models.CharField(max_length=64, unique=True)
+    content = models.JSONField()
+    # Set again whenever a scan stores the same content, so the prune leaves blobs a running scan is about to refer to
+    stored_time = models.DateTimeField(db_index=True)
+
+
 class PipelineApp(models.Model):
+    scan_fk = models.ForeignKey(Scan, null=True, blank=True, on_delete=models.CASCADE)
     scan_start_time = models.DateTimeField()
     repo_scan_start_time = models.DateTimeField()
     config_filename = models.CharField(max_length=64)
-    config = models.JSONField(null=True, blank=True)
+    config_blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name="config_pipeline_apps")
+    config_sha = models.CharField(max_length=64, null=True, blank=True)
     scm_repo_name = models.CharField(max_length=64)
     scm_repo_id = models.CharField(max_length=16)
     scm_repo_private = models.BooleanField(null=True, blank=True)
     scm_repo_archived = models.BooleanField(null=True, blank=True)
-    scm_repo_branch_list = models.TextField(null=True, blank=True)
+    scm_repo_branch_list_blob = models.ForeignKey(Blob, null=True, blank=True, on_delete=models.PROTECT, related_name="branch_list_pipeline_apps")
     scm_repo_default_branch_name = models.CharField(max_length=64, null=True, blank=True)
     scm_repo_primary_branch_name = models.CharField(max_length=64, null=True, blank=True)
     scm_repo_primary_branch_head_commit_sha = models.CharField(max_length=64, null=True, blank=True)
@@ -22,9 +81,34 @@ class PipelineApp(models.Model):
     scm_repo_primary_branch_head_commit_author = models.CharField(max_length=64, null=True, blank=True)
     scm_repo_primary_branch_head_commit_committer = models.CharField(max_length=64, null=True, blank=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["config_filename", "-scan_start_time"])]
+
+    # The parsed config and branch list are held on the instance while scanning, and stored as blobs by write_scan
+    @property
+    def config(self):
+        if not hasattr(self, "_config"):
+            self._config = self.config_blob.content if self.config_blob_id else None
+        return self._config
+
+    @config.setter
+    def config(self, value):
+        self._config = value
+
+    @property
+    def scm_repo_branch_list(self):
+        if not hasattr(self, "_scm_repo_branch_list"):
+            self._scm_repo_branch_list = self.scm_repo_branch_list_blob.content if self.scm_repo_branch_list_blob_id else None
+        return self._scm_repo_branch_list
+
+    @scm_repo_branch_list.setter
+    def scm_repo_branch_list(self, value):
+        self._scm_repo_branch_list = value
+
 
 class PipelineEnv(models.Model):
     pipeline_app_fk = models.ForeignKey(PipelineApp, to_field='id', on_delete=models.CASCADE)
+    scan_fk = models.ForeignKey(Scan, null=True, blank=True, on_delete=models.CASCADE)
     config_env = models.CharField(max_length=64)
     cf_full_name = models.CharField(max_length=255)
     cf_app_type = models.CharField(max_length=32)
@@ -46,3 +130,95 @@ class PipelineEnv(models.Model):
     git_compare_merge_base_commit_date = models.DateTimeField(null=True, blank=True)
     drift_time_merge_base = models.DurationField(null=True, blank=True)
     log_message = models.CharField(max_length=255)
+
+    class Meta:
+        indexes = [models.Index(fields=["scan_fk", "id"])]
+
+
+class GithubCacheEntry(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    url = models.TextField()
+    etag = models.CharField(max_length=255, null=True, blank=True)
+    last_modified = models.CharField(max_length=64, null=True, blank=True)
+    headers = models.JSONField()
+    body = models.TextField()
+    size = models.PositiveIntegerField()
+    accessed_time = models.DateTimeField(db_index=True)
+
+
+class CfGuid(models.Model):
+    kind = models.CharField(max_length=16)
+    name = models.CharField(max_length=64)
+    parent_guid = models.CharField(max_length=64, blank=True)
+    guid = models.CharField(max_length=64)
+    resolved_time = models.DateTimeField()
+
+    class Meta:
+        unique_together = [["kind", "name", "parent_guid"]]
+
+
+class GitCommit(models.Model):
+    repo = models.CharField(max_length=128)
+    sha = models.CharField(max_length=64)
+    date = models.DateTimeField()
+    author = models.CharField(max_length=64, null=True, blank=True)
+    committer = models.CharField(max_length=64, null=True, blank=True)
+    count = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [["repo", "sha"]]
+
+
+class GitCompare(models.Model):
+    repo = models.CharField(max_length=128)
+    base_sha = models.CharField(max_length=64)
+    head_sha = models.CharField(max_length=64)
+    ahead_by = models.PositiveIntegerField()
+    behind_by = models.PositiveIntegerField()
+    merge_base_sha = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = [["repo", "base_sha", "head_sha"]]
+
+
+class DriftSummary(models.Model):
+    # One day of an environment's results, kept after the day's scans are pruned
+    date = models.DateField()
+    config_filename = models.CharField(max_length=64)
+    config_env = models.CharField(max_length=64)
+    cf_full_name = models.CharField(max_length=255)
+    scan_count = models.PositiveIntegerField()
+    max_git_compare_ahead_by = models.PositiveIntegerField(null=True, blank=True)
+    max_git_compare_behind_by = models.PositiveIntegerField(null=True, blank=True)
+    max_drift_time_simple = models.DurationField(null=True, blank=True)
+    max_drift_time_merge_base = models.DurationField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [["date", "config_filename", "config_env"]]
+
+
+class PipelineConfigSnapshot(models.Model):
+    # The pipeline config files at one commit of the config repo
+    commit_sha = models.CharField(max_length=64, unique=True)
+    config_files = models.JSONField()
+    fetched_time = models.DateTimeField()
+
+
+class RepoBranchList(models.Model):
+    # A repo's full branch list, captured by its own job instead of on every scan
+    repo = models.CharField(max_length=128, unique=True)
+    branch_list_blob = models.ForeignKey(Blob, on_delete=models.PROTECT, related_name="repo_branch_lists")
+    captured_time = models.DateTimeField()
+
+
+class RescanRequest(models.Model):
+    # A pipeline queued for rescan by a Github push, done by the next scan of the resident scanner
+    config_filename = models.CharField(max_length=64)
+    reason = models.CharField(max_length=255)
+    delivery_id = models.CharField(max_length=64, blank=True)
+    requested_time = models.DateTimeField()
+    processed_time = models.DateTimeField(null=True, blank=True)
+    scan_fk = models.ForeignKey(Scan, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [models.Index(fields=["processed_time", "requested_time"])]
@@ -0,0 +1,132 @@
+from django.conf import settings
+
+from cloudfoundry_client.client import CloudFoundryClient
+from contextlib import contextmanager
+import asyncio
+import contextvars
+import threading
+import time
+from .metrics import count_api_call
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Calls that finish a pipeline already in progress go ahead of calls that start a new one
+HIGH = 0
+LOW = 1
+request_priority = contextvars.ContextVar("request_priority", default=HIGH)
+
+
+@contextmanager
+def low_priority():
+    token = request_priority.set(LOW)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class RateLimiter:
+    # Paces requests to one API with a token bucket, and stops them when the X-RateLimit budget runs out until it resets
+    def __init__(self, name, rate, reserve, clock=time.monotonic, wall_clock=time.time):
+        self.name = name
+        # The token bucket runs on a monotonic clock, and X-RateLimit-Reset is compared with the wall clock
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.rate = rate
+        self.burst = max(rate, 1)
+        # Budget held back for in-flight pipelines, which new pipelines cannot use
+        self.reserve = reserve
+        self.tokens = self.burst
+        self.updated = clock()
+        self.remaining = None
+        self.limit = None
+        self.reset_time = None
+        self.lock = threading.Lock()
+
+    def schedule(self, priority):
+        # Returns how long the caller must wait before sending its request
+        count_api_call(self.name)
+        with self.lock:
+            wait = 0
+            if self.reset_time is not None and self.wall_clock() >= self.reset_time:
+                self.remaining = None
+                self.reset_time = None
+            if self.remaining is not None:
+                floor = self.reserve if priority == LOW else 0
+                if self.remaining <= floor:
+                    wait = self.reset_time - self.wall_clock()
+                else:
+                    # Count this request now, so concurrent callers see the budget it uses
+                    self.remaining -= 1
+
+            if self.rate > 0:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def acquire(self):
+        wait = self.schedule(request_priority.get())
+        if wait > 0:
+            log.debug(f"{self.name} rate limit - waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.schedule(request_priority.get())
+        if wait > 0:
+            log.debug(f"{self.name} rate limit - waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_time = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset_time is None:
+            return
+        with self.lock:
+            self.remaining = int(remaining)
+            self.reset_time = float(reset_time)
+            self.limit = int(headers.get("X-RateLimit-Limit", 0)) or self.limit
+        if self.remaining <= self.reserve:
+            log.warning(f"{self.name} rate limit - {self.remaining} requests left until {time.ctime(self.reset_time)}")
+
+    def budget(self):
+        with self.lock:
+            return {"remaining": self.remaining, "limit": self.limit, "reset_time": self.reset_time}
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+
+def get_limiter(name):
+    with limiters_lock:
+        if name not in limiters:
+            rate = settings.CF_REQUEST_RATE if name == "cf" else settings.GITHUB_REQUEST_RATE
+            limiters[name] = RateLimiter(name, rate, settings.RATE_LIMIT_RESERVE)
+        return limiters[name]
+
+
+def rate_limit_budgets():
+    with limiters_lock:
+        return {name: limiter.budget() for name, limiter in limiters.items()}
+
+
+def log_rate_limit_budgets():
+    for name, budget in rate_limit_budgets().items():
+        if budget["remaining"] is not None:
+            log.info(f"{name} rate limit - {budget['remaining']} of {budget['limit']} requests left, resets {time.ctime(budget['reset_time'])}")
+
+
+class RateLimitedCloudFoundryClient(CloudFoundryClient):
+    # Every CF API read goes through get, so pacing it covers the whole client
+    def get(self, url, params=None, **kwargs):
+        limiter = get_limiter("cf")
+        limiter.acquire()
+        response = super().get(url, params, **kwargs)
+        limiter.update(response.headers)
+        return response
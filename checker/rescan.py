@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.db import DatabaseError
+
+from datetime import datetime
+import hashlib
+import hmac
+from .models import Scan, RescanRequest
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def verify_signature(body, signature, secret=None):
+    # Github signs the raw request body with the webhook secret and sends it as "sha256=<hex>" in X-Hub-Signature-256
+    if secret is None:
+        secret = settings.GITHUB_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def pushed_branch(payload):
+    ref = payload.get("ref", "")
+    return ref[len("refs/heads/"):] if ref.startswith("refs/heads/") else None
+
+
+def changed_config_files(payload):
+    # The configs are the .yaml files at the top of the config repo, and a removed one is rescanned to drop it
+    config_files = set()
+    for commit in payload.get("commits", []):
+        for path in commit.get("added", []) + commit.get("modified", []) + commit.get("removed", []):
+            if "/" not in path and ".yaml" in path:
+                config_files.add(path)
+    return sorted(config_files)
+
+
+def affected_pipelines(payload):
+    # A push to an app repo changes drift only on the primary branch the latest scan compared against
+    repo_name = payload["repository"]["full_name"]
+    branch = pushed_branch(payload)
+    if branch is None or payload.get("deleted"):
+        return []
+    if repo_name.lower() == settings.GIT_PIPELINE_REPO.lower():
+        if branch != payload["repository"].get("default_branch"):
+            return []
+        return changed_config_files(payload)
+
+    last_scan = Scan.objects.filter(status=Scan.Status.COMPLETED).order_by("-start_time").first()
+    if last_scan is None:
+        return []
+    pipeline_apps = last_scan.pipeline_apps().filter(config_blob__content__scm__iexact=repo_name, scm_repo_primary_branch_name=branch)
+    return sorted(set(pipeline_apps.values_list("config_filename", flat=True)))
+
+
+def handle_push(payload, delivery_id=""):
+    config_filenames = affected_pipelines(payload)
+    if not config_filenames:
+        return []
+    reason = f"push {payload['repository']['full_name']}@{pushed_branch(payload)} {payload.get('after', '')[:12]}"
+    requested_time = datetime.now()
+    RescanRequest.objects.bulk_create([
+        RescanRequest(config_filename=config_filename, reason=reason[:255], delivery_id=delivery_id, requested_time=requested_time)
+        for config_filename in config_filenames
+    ])
+    log.info(f"Queued rescan of {', '.join(config_filenames)} ({reason})")
+    return config_filenames
+
+
+def queued_rescans():
+    return list(RescanRequest.objects.filter(processed_time__isnull=True).order_by("requested_time"))
+
+
+def complete_rescans(scan, rescan_requests=None):
+    # A full scan also covers every request queued before it started. Requests are completed even by a failed scan,
+    # so a pipeline that cannot be scanned is not retried on every poll - the next full scan picks it up
+    if rescan_requests is None:
+        queryset = RescanRequest.objects.filter(processed_time__isnull=True, requested_time__lte=scan.start_time)
+    else:
+        queryset = RescanRequest.objects.filter(id__in=[rescan_request.id for rescan_request in rescan_requests])
+    try:
+        return queryset.update(processed_time=datetime.now(), scan_fk=scan)
+    except DatabaseError as ex:
+        log.warning(f"Could not complete rescan requests for scan {scan.id}: {ex}")
+        return 0
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from datetime import datetime, time, timedelta
+from .models import Scan, PipelineApp, PipelineEnv, DriftSummary, Blob, RescanRequest
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def day_scans(day):
+    day_start = datetime.combine(day, time.min)
+    return Scan.objects.filter(start_time__gte=day_start, start_time__lt=day_start + timedelta(days=1))
+
+
+def rollup_day(day):
+    # Worst drift per environment across the day's completed scans
+    summaries = (
+        PipelineEnv.objects.filter(scan_fk__in=day_scans(day).filter(status=Scan.Status.COMPLETED))
+        .values("pipeline_app_fk__config_filename", "config_env")
+        .annotate(
+            cf_full_name=Max("cf_full_name"),
+            scan_count=Count("scan_fk", distinct=True),
+            max_git_compare_ahead_by=Max("git_compare_ahead_by"),
+            max_git_compare_behind_by=Max("git_compare_behind_by"),
+            max_drift_time_simple=Max("drift_time_simple"),
+            max_drift_time_merge_base=Max("drift_time_merge_base"),
+        )
+    )
+    drift_summaries = [
+        DriftSummary(
+            date=day,
+            config_filename=summary.pop("pipeline_app_fk__config_filename"),
+            **summary,
+        )
+        for summary in summaries
+    ]
+    DriftSummary.objects.bulk_create(drift_summaries, batch_size=settings.CHECK_WRITE_BATCH_SIZE)
+    return len(drift_summaries)
+
+
+def delete_in_batches(queryset, batch_size):
+    # Short transactions of batch_size rows each, so a large prune never holds long locks
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(queryset.order_by("id").values_list("id", flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            queryset.model.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def prune_scan(scan, batch_size):
+    env_count = delete_in_batches(PipelineEnv.objects.filter(scan_fk=scan), batch_size)
+    app_count = delete_in_batches(PipelineApp.objects.filter(scan_fk=scan), batch_size)
+    scan_id = scan.id
+    scan.delete()
+    log.info(f"Pruned scan {scan_id} ({scan.start_time}, {scan.status}) - {app_count} pipelines, {env_count} environments")
+
+
+def kept_scan_ids(cutoff):
+    # The latest completed scan is kept however old it is - the dashboard shows it, and the next scan starts from it
+    # A partial one is kept with the scans it builds on
+    latest_scan = Scan.objects.filter(status=Scan.Status.COMPLETED).order_by("-start_time").first()
+    kept_ids = set(latest_scan.view_scan_ids()) if latest_scan is not None else set()
+    # So is every partial scan within the window - its base scan and the partial scans of that base it is read with
+    base_ids = set(Scan.objects.filter(partial=True, start_time__gte=cutoff, base_scan_fk__isnull=False).values_list("base_scan_fk_id", flat=True))
+    kept_ids.update(base_ids)
+    kept_ids.update(Scan.objects.filter(base_scan_fk_id__in=base_ids, status=Scan.Status.COMPLETED).values_list("id", flat=True))
+    return kept_ids
+
+
+def apply_retention(days=None, batch_size=None):
+    # Scans from before the retention window are rolled up into DriftSummary rows by day, then deleted
+    if days is None:
+        days = settings.RETENTION_DAYS
+    if batch_size is None:
+        batch_size = settings.RETENTION_BATCH_SIZE
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=days), time.min)
+    log.info(f"Pruning scans started before {cutoff}")
+
+    kept_ids = kept_scan_ids(cutoff)
+    old_scans = Scan.objects.filter(start_time__lt=cutoff).exclude(id__in=kept_ids)
+    days_to_prune = sorted({start_time.date() for start_time in old_scans.values_list("start_time", flat=True)})
+    for day in days_to_prune:
+        # A day already rolled up was interrupted while pruning, and its summary came from the full day
+        if not DriftSummary.objects.filter(date=day).exists():
+            summary_count = rollup_day(day)
+            log.info(f"Rolled up {day} - {summary_count} environments")
+        for scan in day_scans(day).exclude(id__in=kept_ids).order_by("start_time"):
+            prune_scan(scan, batch_size)
+    log.info(f"Pruned {len(days_to_prune)} days of scans")
+
+    # Configs and branch lists no remaining scan or captured branch list refers to. A blob stored within the grace window
+    # may be about to be referred to by a scan still running, and the rows are locked so store_blobs waits to store them again
+    stored_before = datetime.now() - timedelta(seconds=settings.RETENTION_BLOB_GRACE)
+    unused_blobs = Blob.objects.select_for_update(of=("self",)).filter(
+        stored_time__lt=stored_before, config_pipeline_apps__isnull=True, branch_list_pipeline_apps__isnull=True, repo_branch_lists__isnull=True
+    )
+    blob_count = delete_in_batches(unused_blobs, batch_size)
+    log.info(f"Pruned {blob_count} unused blobs")
+
+    rescan_count = delete_in_batches(RescanRequest.objects.filter(processed_time__lt=cutoff), batch_size)
+    log.info(f"Pruned {rescan_count} completed rescan requests")
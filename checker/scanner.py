@@ -0,0 +1,118 @@
+from django.conf import settings
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from oauth2_client.credentials_manager import OAuthError
+from .cf_cache import CfGuidCache, CfAppIndex
+from .check import start_scan, fail_scan, scan_pipelines, cf_login, close_worker_connections
+from .commit_store import CompareCache
+from .git_mirror import GitMirrors
+from .github_cache import prune_github_cache
+from .rate_limit import log_rate_limit_budgets
+from .rescan import queued_rescans, complete_rescans
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Scanner:
+    # Runs scans in one long-lived process, so the worker threads (and their Github clients), the CF session and the caches outlive each scan
+    def __init__(self, workers=None, incremental=None, interval=None, cache_max_age=None, rescan_poll=None):
+        self.workers = settings.CHECK_WORKERS if workers is None else workers
+        self.incremental = settings.CHECK_INCREMENTAL if incremental is None else incremental
+        self.interval = settings.SCANNER_INTERVAL if interval is None else interval
+        self.cache_max_age = settings.SCANNER_CACHE_MAX_AGE if cache_max_age is None else cache_max_age
+        self.rescan_poll = settings.SCANNER_RESCAN_POLL if rescan_poll is None else rescan_poll
+        self.cf = None
+        self.cf_guids = None
+        self.compares = None
+        self.cache_time = None
+        self.scan_count = 0
+        self.stopping = threading.Event()
+        # Pipelines and environments use separate pools so a pipeline waiting on its environments cannot starve them
+        self.env_executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pipeline_executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def cf_client(self):
+        # Logs in once, then refreshes the access token before each scan - a password login only when the refresh token has expired
+        if self.cf is not None and self.cf.refresh_token is not None:
+            try:
+                self.cf.init_with_token(self.cf.refresh_token)
+                return self.cf
+            except OAuthError as ex:
+                log.info(f"CF token refresh failed, logging in again: {ex}")
+        self.cf = cf_login()
+        self.cf_guids = None
+        return self.cf
+
+    def caches(self, cf):
+        # Org and space GUIDs and compares of immutable commits stay valid between scans, but are dropped after cache_max_age seconds.
+        # Names that did not resolve are looked up again each scan
+        if self.cf_guids is None or time.monotonic() - self.cache_time > self.cache_max_age:
+            self.cf_guids = CfGuidCache(cf)
+            self.compares = CompareCache()
+            self.cache_time = time.monotonic()
+        else:
+            self.cf_guids.forget_misses()
+        # Mirrors are fetched the first time a scan needs them, so each scan gets new ones to fetch commits pushed since the last
+        setattr(self.compares, "mirrors", GitMirrors() if settings.GIT_MIRROR_ENABLED else None)
+        # Apps are created and deleted between scans, so the app index is only kept for one scan
+        return self.cf_guids, CfAppIndex(cf), self.compares
+
+    def run_scan(self, rescan_requests=None):
+        # With rescan_requests, a partial scan of just their pipelines
+        rescan_files = None if rescan_requests is None else {rescan_request.config_filename for rescan_request in rescan_requests}
+        scan = start_scan(partial=rescan_files is not None)
+        try:
+            cf = self.cf_client()
+            cf_guids, cf_apps, compares = self.caches(cf)
+            scan_pipelines(scan, self.incremental, cf, cf_guids, cf_apps, compares, self.env_executor, self.pipeline_executor, rescan_files)
+        except BaseException:
+            fail_scan(scan)
+            raise
+        finally:
+            # The worker threads are kept, but not their database connections while the scanner waits
+            close_worker_connections()
+            self.scan_count += 1
+            complete_rescans(scan, rescan_requests)
+        log_rate_limit_budgets()
+
+        if settings.GITHUB_CACHE_ENABLED:
+            prune_github_cache()
+        return scan
+
+    def run_queued_rescans(self):
+        rescan_requests = queued_rescans()
+        if rescan_requests:
+            self.run_scan(rescan_requests)
+
+    def run(self, max_scans=0):
+        # Full scans start every interval seconds - a scan longer than the interval is followed straight away by the next one
+        # In between, pipelines queued by webhooks are rescanned within rescan_poll seconds
+        log.info(f"Scanner started (workers={self.workers}, interval={self.interval}s, rescan poll={self.rescan_poll}s)")
+        next_start = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                if time.monotonic() >= next_start:
+                    next_start = time.monotonic() + self.interval
+                    scan_function = self.run_scan
+                else:
+                    scan_function = self.run_queued_rescans
+                try:
+                    scan_function()
+                except Exception as ex:
+                    log.error(f"Scan FAILED: {type(ex).__name__} {ex.args!r}")
+                if max_scans and self.scan_count >= max_scans:
+                    break
+                self.stopping.wait(max(0, min(self.rescan_poll, next_start - time.monotonic())))
+        finally:
+            self.env_executor.shutdown()
+            self.pipeline_executor.shutdown()
+        log.info(f"Scanner stopped after {self.scan_count} scans")
+
+    def stop(self, *args):
+        # Usable as a signal handler - the current scan finishes and no new one starts
+        log.info("Scanner stopping")
+        self.stopping.set()
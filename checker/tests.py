@@ -1,3 +1,1074 @@
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 
-# Create your tests here.
+from aiohttp import web
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+from types import SimpleNamespace
+from unittest import mock
+import aiohttp
+import asyncio
+import hashlib
+import hmac
+import inspect
+import json
+import os
+import re
+import requests
+import subprocess
+import tempfile
+import threading
+from github import GithubException
+from oauth2_client.credentials_manager import CredentialManager
+from . import check, config_snapshot, rate_limit, views
+from .async_check import AsyncGithub
+from .benchmark import Fleet, FakeServer, BENCHMARK_PIPELINE_REPO, run_benchmark, run_benchmark_process
+from .blob_store import store_blobs, content_hash
+from .cf_client import SharedTokenCloudFoundryClient
+from .cf_cache import CfAppEnvs, CfAppIndex, CfGuidCache
+from .commit_store import CompareCache, get_commit_count, read_compare, write_compare
+from .export import EXPORT_COLUMNS, parse_time
+from .git_mirror import GitMirror, GitMirrors, GitMirrorError
+from .github_cache import HTTPSCachingConnectionClass, prune_github_cache
+from .github_graphql import fetch_repos
+from .models import Scan, PipelineApp, PipelineEnv, DriftSummary, Blob, CfGuid, GitCommit, GitCompare, GithubCacheEntry, RescanRequest
+from .rescan import verify_signature, affected_pipelines
+from .retention import apply_retention
+
+TESTDATA = os.path.join(os.path.dirname(__file__), "testdata")
+
+
+def load_payload(name):
+    with open(os.path.join(TESTDATA, name), "rb") as payload_file:
+        return payload_file.read()
+
+
+def sign(body, secret):
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def make_scan(start_time, status=Scan.Status.COMPLETED, environments=("dev",)):
+    scan = Scan.objects.create(start_time=start_time, end_time=start_time, status=status)
+    pipeline_app = PipelineApp.objects.create(
+        scan_fk=scan, scan_start_time=start_time, repo_scan_start_time=start_time, config_filename="app.yaml", scm_repo_name="app", scm_repo_id="1"
+    )
+    for config_env in environments:
+        PipelineEnv.objects.create(pipeline_app_fk=pipeline_app, scan_fk=scan, config_env=config_env, cf_full_name=f"org/{config_env}/app")
+    return scan
+
+
+class RetentionTests(TestCase):
+    def test_old_scans_are_rolled_up_and_pruned(self):
+        old_scan = make_scan(datetime.now() - timedelta(days=41))
+        latest_scan = make_scan(datetime.now())
+        apply_retention(days=30)
+        self.assertFalse(Scan.objects.filter(id=old_scan.id).exists())
+        self.assertTrue(Scan.objects.filter(id=latest_scan.id).exists())
+        self.assertEqual(DriftSummary.objects.filter(date=old_scan.start_time.date()).count(), 1)
+
+    def test_latest_completed_scan_is_kept_however_old(self):
+        latest_scan = make_scan(datetime.now() - timedelta(days=40))
+        failed_scan = make_scan(datetime.now() - timedelta(days=39), status=Scan.Status.FAILED)
+        apply_retention(days=30)
+        self.assertTrue(Scan.objects.filter(id=latest_scan.id).exists())
+        self.assertEqual(PipelineEnv.objects.filter(scan_fk=latest_scan).count(), 1)
+        self.assertFalse(Scan.objects.filter(id=failed_scan.id).exists())
+
+    def test_partial_scans_within_the_window_are_kept_with_the_scans_they_build_on(self):
+        old_scan = make_scan(datetime.now() - timedelta(days=45))
+        base_scan = make_scan(datetime.now() - timedelta(days=40))
+        old_partial_scan = make_scan(datetime.now() - timedelta(days=35), environments=("staging",))
+        partial_scan = make_scan(datetime.now() - timedelta(days=10), environments=("prod",))
+        Scan.objects.filter(id__in=[old_partial_scan.id, partial_scan.id]).update(partial=True, base_scan_fk=base_scan)
+        latest_scan = make_scan(datetime.now())
+        apply_retention(days=30)
+        self.assertEqual(set(Scan.objects.values_list("id", flat=True)), {base_scan.id, old_partial_scan.id, partial_scan.id, latest_scan.id})
+        self.assertFalse(Scan.objects.filter(id=old_scan.id).exists())
+        partial_scan.refresh_from_db()
+        self.assertEqual(partial_scan.pipeline_envs().count(), 1)
+
+    def test_unused_blobs_are_kept_for_the_grace_window(self):
+        old_time = datetime.now() - timedelta(days=2)
+        blobs = store_blobs([["old"], ["stored-again"], ["new"]])
+        old_blob, stored_again_blob, new_blob = (blobs[content_hash([content])] for content in ["old", "stored-again", "new"])
+        Blob.objects.filter(id__in=[old_blob.id, stored_again_blob.id]).update(stored_time=old_time)
+        # A scan storing content the prune would delete marks it as stored again, and gets the same blob back
+        self.assertEqual(store_blobs([["stored-again"]])[content_hash(["stored-again"])].id, stored_again_blob.id)
+        apply_retention(days=30)
+        self.assertEqual(set(Blob.objects.values_list("id", flat=True)), {stored_again_blob.id, new_blob.id})
+
+    def test_blob_pruned_while_storing_is_written_again(self):
+        real_bulk_create = Blob.objects.bulk_create
+
+        def bulk_create_then_prune(*args, **kwargs):
+            real_bulk_create(*args, **kwargs)
+            if bulk_create.call_count == 1:
+                Blob.objects.all().delete()
+
+        with mock.patch.object(Blob.objects, "bulk_create", side_effect=bulk_create_then_prune) as bulk_create:
+            blobs = store_blobs([["content"]])
+        self.assertEqual(bulk_create.call_count, 2)
+        self.assertTrue(Blob.objects.filter(id=blobs[content_hash(["content"])].id).exists())
+
+
+class IncrementalTests(TestCase):
+    def pipeline_app(self, **fields):
+        fingerprint = {"config_sha": "c" * 40, "scm_repo_primary_branch_name": "main", "scm_repo_primary_branch_head_commit_sha": "a" * 40}
+        return PipelineApp(config_filename="app.yaml", **{**fingerprint, **fields})
+
+    def pipeline_env(self, pipeline_app, **fields):
+        fingerprint = {"cf_full_name": "org/dev/app", "cf_app_guid": "guid", "cf_app_git_commit": "b" * 40}
+        return PipelineEnv(pipeline_app_fk=pipeline_app, config_env="dev", **{**fingerprint, **fields})
+
+    def test_unchanged_pipeline_keeps_the_head_commit_results(self):
+        previous_app = self.pipeline_app(
+            id=1, scm_repo_primary_branch_head_commit_date=datetime(2024, 1, 1), scm_repo_primary_branch_head_commit_author="dev",
+            scm_repo_primary_branch_head_commit_committer="web-flow", scm_repo_primary_branch_head_commit_count=500,
+        )
+        pipeline_app = self.pipeline_app()
+        self.assertTrue(check.carry_forward_pipeline(previous_app, pipeline_app))
+        for field in check.HEAD_COMMIT_FIELDS:
+            self.assertEqual(getattr(pipeline_app, field), getattr(previous_app, field))
+
+    def test_changed_pipeline_is_read_again(self):
+        previous_app = self.pipeline_app(id=1, scm_repo_primary_branch_head_commit_count=500)
+        self.assertFalse(check.carry_forward_pipeline(None, self.pipeline_app()))
+        for pipeline_app in [self.pipeline_app(scm_repo_primary_branch_head_commit_sha="d" * 40), self.pipeline_app(config_sha="e" * 40), self.pipeline_app(scm_repo_primary_branch_name="master")]:
+            self.assertFalse(check.carry_forward_pipeline(previous_app, pipeline_app))
+            self.assertIsNone(pipeline_app.scm_repo_primary_branch_head_commit_count)
+
+    def test_environment_with_the_same_deployment_keeps_the_drift_results(self):
+        pipeline_app = self.pipeline_app()
+        results = {field: self.result_value(field) for field in check.ENV_COMMIT_FIELDS}
+        previous_env = self.pipeline_env(pipeline_app, **results)
+        pipeline_env = self.pipeline_env(pipeline_app)
+        self.assertTrue(check.carry_forward_environment(previous_env, pipeline_env))
+        for field in check.ENV_COMMIT_FIELDS:
+            self.assertEqual(getattr(pipeline_env, field), results[field])
+
+    def test_environment_is_processed_again_when_its_deployment_changed_or_was_not_finished(self):
+        pipeline_app = self.pipeline_app()
+        previous_env = self.pipeline_env(pipeline_app, drift_time_merge_base=timedelta(days=1))
+        self.assertFalse(check.carry_forward_environment(None, self.pipeline_env(pipeline_app)))
+        self.assertFalse(check.carry_forward_environment(previous_env, self.pipeline_env(pipeline_app, cf_app_git_commit="f" * 40)))
+        self.assertFalse(check.carry_forward_environment(previous_env, self.pipeline_env(pipeline_app, cf_app_guid="other-guid")))
+        unfinished_env = self.pipeline_env(pipeline_app, cf_commit_count=10)
+        self.assertFalse(check.carry_forward_environment(unfinished_env, self.pipeline_env(pipeline_app)))
+
+    def test_previous_pipeline_is_from_a_completed_scan(self):
+        completed_scan = make_scan(datetime.now() - timedelta(hours=2))
+        make_scan(datetime.now() - timedelta(hours=1), status=Scan.Status.FAILED)
+        previous_app = check.read_previous_pipeline("app.yaml", datetime.now())
+        self.assertEqual(previous_app.scan_fk_id, completed_scan.id)
+
+    @staticmethod
+    def result_value(field):
+        if field.endswith("_date"):
+            return datetime(2024, 1, 1)
+        if field.startswith("drift_time"):
+            return timedelta(days=2)
+        if field.endswith("_commit") or field.endswith("_author"):
+            return field
+        return 7
+
+
+class RunCheckCommandTests(TestCase):
+    @override_settings(CHECK_INCREMENTAL=True, CHECK_ENGINE="threads")
+    def test_incremental_default_can_be_turned_off(self):
+        with mock.patch("checker.management.commands.run_check.run_check") as run_check:
+            call_command("run_check", workers=2)
+            call_command("run_check", "--no-incremental", workers=2)
+        self.assertEqual([call.kwargs["incremental"] for call in run_check.call_args_list], [True, False])
+
+    @override_settings(CHECK_INCREMENTAL=False, CHECK_ENGINE="async")
+    def test_incremental_can_be_turned_on(self):
+        with mock.patch("checker.management.commands.run_check.run_check_async") as run_check_async:
+            call_command("run_check")
+            call_command("run_check", "--incremental")
+        self.assertEqual([call.kwargs["incremental"] for call in run_check_async.call_args_list], [False, True])
+
+
+class CommitCountTests(TestCase):
+    head_sha = "a" * 40
+    anchor_sha = "b" * 40
+
+    def setUp(self):
+        self.repo = mock.Mock()
+        self.compares = mock.Mock(mirrors=None)
+        self.git_commit = GitCommit.objects.create(repo="uktrade/app", sha=self.head_sha, date=datetime(2024, 1, 2))
+
+    def test_count_from_the_anchor_commit(self):
+        GitCommit.objects.create(repo="uktrade/app", sha=self.anchor_sha, date=datetime(2024, 1, 1), count=100)
+        # The head has 3 commits the anchor does not, and the anchor 5 the head does not
+        self.compares.compare.return_value = GitCompare(ahead_by=3, behind_by=5)
+        self.assertEqual(get_commit_count(self.repo, self.git_commit, self.compares), 98)
+        self.compares.compare.assert_called_once_with(self.repo, "uktrade/app", self.anchor_sha, self.head_sha)
+        self.repo.get_commits.assert_not_called()
+        self.assertEqual(GitCommit.objects.get(sha=self.head_sha).count, 98)
+
+    def test_newest_counted_commit_is_the_anchor(self):
+        GitCommit.objects.create(repo="uktrade/app", sha="c" * 40, date=datetime(2023, 12, 1), count=50)
+        GitCommit.objects.create(repo="uktrade/app", sha=self.anchor_sha, date=datetime(2024, 1, 1), count=100)
+        GitCommit.objects.create(repo="uktrade/other", sha="d" * 40, date=datetime(2024, 1, 3), count=1000)
+        self.compares.compare.return_value = GitCompare(ahead_by=1, behind_by=0)
+        self.assertEqual(get_commit_count(self.repo, self.git_commit, self.compares), 101)
+
+    def test_without_an_anchor_github_walks_the_history(self):
+        self.repo.get_commits.return_value.totalCount = 42
+        self.assertEqual(get_commit_count(self.repo, self.git_commit, self.compares), 42)
+        self.compares.compare.assert_not_called()
+        self.repo.get_commits.assert_called_once_with(self.head_sha)
+
+    def test_failed_anchor_compare_falls_back_to_the_history(self):
+        GitCommit.objects.create(repo="uktrade/app", sha=self.anchor_sha, date=datetime(2024, 1, 1), count=100)
+        self.compares.compare.side_effect = GithubException(404, {"message": "Not Found"}, None)
+        self.repo.get_commits.return_value.totalCount = 42
+        self.assertEqual(get_commit_count(self.repo, self.git_commit, self.compares), 42)
+
+    def test_known_count_is_not_worked_out_again(self):
+        self.git_commit.count = 7
+        self.assertEqual(get_commit_count(self.repo, self.git_commit, self.compares), 7)
+        self.compares.compare.assert_not_called()
+        self.repo.get_commits.assert_not_called()
+
+    def test_cf_commit_count_from_the_head_commit_count(self):
+        pipeline_app = PipelineApp(scm_repo_primary_branch_head_commit_count=500)
+        pipeline_env = PipelineEnv()
+        cf_compare = GitCompare(ahead_by=2, behind_by=30, merge_base_sha="e" * 40)
+        self.assertEqual(check.set_compare(pipeline_app, pipeline_env, cf_compare), 472)
+        self.assertEqual((pipeline_env.git_compare_ahead_by, pipeline_env.git_compare_behind_by, pipeline_env.git_compare_merge_base_commit), (2, 30, "e" * 40))
+
+
+class CompareCacheTests(TestCase):
+    base_sha = "a" * 40
+    head_sha = "b" * 40
+
+    def setUp(self):
+        self.repo = mock.Mock()
+        self.repo.compare.return_value = SimpleNamespace(ahead_by=3, behind_by=1, merge_base_commit=SimpleNamespace(sha="c" * 40))
+
+    def test_compare_is_fetched_once_and_stored(self):
+        compares = CompareCache()
+        git_compare = compares.compare(self.repo, "uktrade/app", self.base_sha, self.head_sha)
+        self.assertIs(compares.compare(self.repo, "uktrade/app", self.base_sha, self.head_sha), git_compare)
+        self.repo.compare.assert_called_once_with(self.base_sha, self.head_sha)
+        stored = read_compare("uktrade/app", self.base_sha, self.head_sha)
+        self.assertEqual((stored.ahead_by, stored.behind_by, stored.merge_base_sha), (3, 1, "c" * 40))
+
+    def test_stored_compare_is_reused_by_a_new_cache(self):
+        write_compare(GitCompare(repo="uktrade/app", base_sha=self.base_sha, head_sha=self.head_sha, ahead_by=5, behind_by=2, merge_base_sha="d" * 40))
+        git_compare = CompareCache().compare(self.repo, "uktrade/app", self.base_sha, self.head_sha)
+        self.assertEqual((git_compare.ahead_by, git_compare.behind_by, git_compare.merge_base_sha), (5, 2, "d" * 40))
+        self.repo.compare.assert_not_called()
+
+    def test_compare_between_branches_is_never_cached(self):
+        compares = CompareCache()
+        compares.compare(self.repo, "uktrade/app", "main", "feature-1")
+        compares.compare(self.repo, "uktrade/app", "main", "feature-1")
+        self.assertEqual(self.repo.compare.call_count, 2)
+        self.assertFalse(GitCompare.objects.exists())
+        self.assertEqual(compares.compares, {})
+
+
+def graphql_ref(name, sha, count, login="dev"):
+    user = {"user": {"login": login}} if login else {"user": None}
+    return {"name": name, "target": {"oid": sha, "committedDate": "2024-01-02T03:04:05Z", "author": user, "committer": user, "history": {"totalCount": count}}}
+
+
+def graphql_repository(name, default_ref, master=None, main=None):
+    return {"name": name, "databaseId": 1, "isPrivate": False, "isArchived": False, "defaultBranchRef": default_ref, "master": master, "main": main}
+
+
+@override_settings(GITHUB_BRANCH_LIST_ENABLED=False)
+class FetchReposTests(TestCase):
+    def setUp(self):
+        # Canned answers by repo name, aliased r0, r1... as fetch_repos names them in each batch
+        self.repositories = {
+            "uktrade/develop-default": graphql_repository(
+                "develop-default", graphql_ref("develop", "d" * 40, 30), master=graphql_ref("master", "m" * 40, 20), main=graphql_ref("main", "a" * 40, 10, login=None)
+            ),
+            "uktrade/main-default": graphql_repository("main-default", graphql_ref("main", "b" * 40, 5), main=graphql_ref("main", "b" * 40, 5)),
+            "uktrade/empty": graphql_repository("empty", None),
+            "uktrade/missing": None,
+        }
+        self.queries = []
+        session = mock.MagicMock()
+        session.__enter__.return_value = session
+        session.post.side_effect = self.post
+        patcher = mock.patch("checker.github_graphql.requests.Session", return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, url, json, headers):
+        self.queries.append(json["query"])
+        aliases = re.findall(r'(r\d+): repository\(owner: "([^"]+)", name: "([^"]+)"\)', json["query"])
+        data = {alias: self.repositories[f"{owner}/{name}"] for alias, owner, name in aliases}
+        return mock.Mock(headers={}, json=lambda: {"data": data})
+
+    def test_repos_are_read_in_batches(self):
+        repo_infos = fetch_repos(list(self.repositories) + ["uktrade/main-default"], batch_size=3)
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual([query.count("repository(") for query in self.queries], [3, 1])
+        # A repo missing from the result is left for the REST API
+        self.assertEqual(set(repo_infos), {"uktrade/develop-default", "uktrade/main-default", "uktrade/empty"})
+
+    def test_heads_of_the_default_master_and_main_branches(self):
+        repo_info = fetch_repos(["uktrade/develop-default"])["uktrade/develop-default"]
+        self.assertEqual(repo_info["default_branch"], "develop")
+        self.assertEqual(set(repo_info["heads"]), {"develop", "master", "main"})
+        self.assertEqual(
+            repo_info["heads"]["main"], {"sha": "a" * 40, "date": datetime(2024, 1, 2, 3, 4, 5), "author": None, "committer": None, "count": 10}
+        )
+        self.assertEqual(repo_info["heads"]["master"]["author"], "dev")
+        self.assertEqual(repo_info["heads"]["develop"]["count"], 30)
+
+    def test_missing_refs_give_no_heads(self):
+        repo_infos = fetch_repos(["uktrade/main-default", "uktrade/empty"])
+        self.assertEqual(list(repo_infos["uktrade/main-default"]["heads"]), ["main"])
+        self.assertEqual((repo_infos["uktrade/empty"]["default_branch"], repo_infos["uktrade/empty"]["heads"]), (None, {}))
+
+    def test_primary_branch_and_head_commit_count_from_the_heads(self):
+        pipeline_app = PipelineApp(config_filename="app.yaml")
+        pipeline_app.config = {"scm": "uktrade/develop-default"}
+        check.set_repo_info(pipeline_app, fetch_repos(["uktrade/develop-default"])["uktrade/develop-default"])
+        self.assertEqual(pipeline_app.scm_repo_primary_branch_name, "main")
+        self.assertEqual(pipeline_app.scm_repo_primary_branch_head_commit_sha, "a" * 40)
+        self.assertEqual(pipeline_app.scm_repo_primary_branch_head_commit_count, 10)
+        self.assertEqual(GitCommit.objects.get(repo="uktrade/develop-default", sha="a" * 40).count, 10)
+
+
+class CfGuidCacheTests(TestCase):
+    def setUp(self):
+        self.cf = mock.Mock()
+        self.cf.v3.organizations.list.return_value = [{"guid": "org-guid"}]
+        self.cf.v3.spaces.list.return_value = [{"guid": "space-guid"}]
+
+    def test_names_are_resolved_once_per_scan(self):
+        cf_guids = CfGuidCache(self.cf, ttl=0)
+        self.assertEqual(cf_guids.org_guid("uktrade"), "org-guid")
+        self.assertEqual(cf_guids.org_guid("uktrade"), "org-guid")
+        self.assertEqual(cf_guids.space_guid("dev", "org-guid"), "space-guid")
+        self.cf.v3.organizations.list.assert_called_once_with(names="uktrade")
+        self.cf.v3.spaces.list.assert_called_once_with(names="dev", organization_guids="org-guid")
+        self.assertFalse(CfGuid.objects.exists())
+
+    def test_stored_guid_is_reused_until_it_expires(self):
+        CfGuidCache(self.cf, ttl=3600).org_guid("uktrade")
+        self.cf.v3.organizations.list.return_value = [{"guid": "new-org-guid"}]
+        self.assertEqual(CfGuidCache(self.cf, ttl=3600).org_guid("uktrade"), "org-guid")
+        self.assertEqual(self.cf.v3.organizations.list.call_count, 1)
+
+        CfGuid.objects.update(resolved_time=datetime.now() - timedelta(seconds=3601))
+        self.assertIsNone(CfGuidCache(self.cf, ttl=3600).read_stored("org", "uktrade", ""))
+        self.assertEqual(CfGuidCache(self.cf, ttl=3600).org_guid("uktrade"), "new-org-guid")
+        self.assertEqual(self.cf.v3.organizations.list.call_count, 2)
+        stored = CfGuid.objects.get(kind="org", name="uktrade")
+        self.assertEqual(stored.guid, "new-org-guid")
+        self.assertGreater(stored.resolved_time, datetime.now() - timedelta(seconds=60))
+
+    def test_missing_name_is_not_stored(self):
+        self.cf.v3.organizations.list.return_value = []
+        self.assertEqual(CfGuidCache(self.cf, ttl=3600).org_guid("missing"), "")
+        self.assertFalse(CfGuid.objects.exists())
+
+
+class FakeCfEntity(dict):
+    # An entity's fields, and the entities it was listed with, which cloudfoundry_client returns from methods
+    def __init__(self, fields, **included):
+        super().__init__(fields)
+        for name, entity in included.items():
+            setattr(self, name, lambda entity=entity: entity)
+
+
+def cf_app(guid, name, space_name, org_name):
+    return FakeCfEntity({"guid": guid, "name": name}, space=FakeCfEntity({"name": space_name}, organization=FakeCfEntity({"name": org_name})))
+
+
+class CfAppIndexTests(TestCase):
+    def setUp(self):
+        self.apps = {
+            "org-1": [cf_app("guid-1", "app", "dev", "org1"), cf_app("guid-2", "app", "prod", "org1")],
+            "org-2": [cf_app("guid-3", "app", "dev", "org2")],
+        }
+        self.cf = mock.Mock()
+        self.cf.v3.apps.list.side_effect = lambda organization_guids, **params: iter(self.apps[organization_guids])
+
+    def test_each_org_is_listed_once(self):
+        cf_apps = CfAppIndex(self.cf, page_size=500)
+        self.assertEqual(cf_apps.app_guid("org-1", "org1/dev/app"), "guid-1")
+        self.assertEqual(cf_apps.app_guid("org-1", "org1/prod/app"), "guid-2")
+        self.assertEqual(cf_apps.app_guid("org-1", "org1/staging/app"), "")
+        self.cf.v3.apps.list.assert_called_once_with(organization_guids="org-1", include="space,space.organization", per_page=500)
+        self.assertEqual(cf_apps.app_guid("org-2", "org2/dev/app"), "guid-3")
+        self.assertEqual(self.cf.v3.apps.list.call_count, 2)
+
+    def test_concurrent_lookups_share_one_listing(self):
+        cf_apps = CfAppIndex(self.cf)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            guids = list(executor.map(lambda name: cf_apps.app_guid("org-1", name), ["org1/dev/app", "org1/prod/app"] * 4))
+        self.assertEqual(guids, ["guid-1", "guid-2"] * 4)
+        self.assertEqual(self.cf.v3.apps.list.call_count, 1)
+
+
+class CfAppEnvsTests(TestCase):
+    def setUp(self):
+        self.cf = mock.Mock()
+        self.cf.v3.apps.get_env.side_effect = lambda application_guid: {
+            "environment_variables": {"GIT_BRANCH": "main", "GIT_COMMIT": f"{application_guid}-deployed"}
+        }
+
+    def test_known_app_without_events_is_not_read(self):
+        cf_envs = CfAppEnvs(self.cf, since="2024-01-01T00:00:00Z", known={"guid-1": ("main", "guid-1-known")})
+        self.assertEqual(cf_envs.git_env("guid-1"), ("main", "guid-1-known"))
+        self.cf.v3.apps.get_env.assert_not_called()
+
+    def test_changed_or_unknown_app_is_read(self):
+        cf_envs = CfAppEnvs(self.cf, since="2024-01-01T00:00:00Z", known={"guid-1": ("main", "guid-1-known")})
+        cf_envs.changed.add("guid-1")
+        self.assertEqual(cf_envs.git_env("guid-1"), ("main", "guid-1-deployed"))
+        self.assertEqual(cf_envs.git_env("guid-2"), ("main", "guid-2-deployed"))
+        self.assertEqual(self.cf.v3.apps.get_env.call_count, 2)
+
+    def test_poll_marks_apps_with_events_as_changed(self):
+        audit_events = [
+            {"created_at": "2024-01-01T10:00:00Z", "target": {"guid": "guid-1"}},
+            {"created_at": "2024-01-01T11:00:00Z", "target": {"guid": "guid-3"}},
+        ]
+        cf_envs = CfAppEnvs(self.cf, since="2024-01-01T00:00:00Z", known={"guid-1": ("main", "guid-1-known"), "guid-2": ("main", "guid-2-known")})
+        with mock.patch("checker.cf_cache.EntityManager") as entity_manager:
+            entity_manager.return_value.list.return_value = audit_events
+            cf_envs.poll()
+        self.assertEqual(cf_envs.changed, {"guid-1", "guid-3"})
+        self.assertEqual(cf_envs.cursor, "2024-01-01T11:00:00Z")
+        self.assertEqual(cf_envs.git_env("guid-1"), ("main", "guid-1-deployed"))
+        self.assertEqual(cf_envs.git_env("guid-2"), ("main", "guid-2-known"))
+
+    def test_without_a_cursor_every_app_is_read(self):
+        cf_envs = CfAppEnvs(self.cf)
+        with mock.patch("checker.cf_cache.EntityManager") as entity_manager:
+            entity_manager.return_value.get_first.return_value = {"created_at": "2024-01-01T12:00:00Z"}
+            cf_envs.poll()
+        self.assertEqual(cf_envs.cursor, "2024-01-01T12:00:00Z")
+        self.assertEqual(cf_envs.git_env("guid-1"), ("main", "guid-1-deployed"))
+        entity_manager.return_value.list.assert_not_called()
+
+
+@override_settings(GITHUB_CACHE_ENABLED=True)
+class GithubCacheTests(TestCase):
+    def response(self, status_code, body=b"", headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = body
+        response.encoding = "utf-8"
+        response.headers.update(headers or {})
+        return response
+
+    def get(self, session, url, accept="application/vnd.github.v3+json", host="api.github.com"):
+        with mock.patch("checker.github_cache.get_session", return_value=session):
+            connection = HTTPSCachingConnectionClass(host)
+            connection.request("GET", url, None, {"Accept": accept})
+            return connection.getresponse()
+
+    def test_not_modified_response_is_replayed_from_the_cache(self):
+        session = mock.Mock()
+        session.get.side_effect = [
+            self.response(200, b'{"name": "app"}', {"ETag": '"v1"', "Content-Type": "application/json"}),
+            self.response(304, headers={"ETag": '"v1"', "X-RateLimit-Remaining": "4999", "X-RateLimit-Reset": "1700000000"}),
+        ]
+        self.get(session, "/repos/uktrade/app")
+        cached_response = self.get(session, "/repos/uktrade/app")
+        self.assertEqual(session.get.call_args.kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual((cached_response.status, cached_response.read()), (200, '{"name": "app"}'))
+        self.assertEqual(dict(cached_response.getheaders())["Content-Type"], "application/json")
+        self.assertEqual(dict(cached_response.getheaders())["X-RateLimit-Remaining"], "4999")
+
+    def test_host_and_accept_header_are_part_of_the_key(self):
+        session = mock.Mock()
+        session.get.side_effect = lambda *args, **kwargs: self.response(200, b"{}", {"ETag": '"v1"'})
+        self.get(session, "/repos/uktrade/app")
+        self.get(session, "/repos/uktrade/app", accept="application/vnd.github.raw")
+        self.get(session, "/repos/uktrade/app", host="github.example.com")
+        self.assertEqual(GithubCacheEntry.objects.count(), 3)
+        self.assertTrue(all("If-None-Match" not in call.kwargs["headers"] for call in session.get.call_args_list))
+
+    def test_commits_and_compares_are_not_cached(self):
+        session = mock.Mock()
+        session.get.side_effect = lambda *args, **kwargs: self.response(200, b"{}", {"ETag": '"v1"'})
+        self.get(session, f"/repos/uktrade/app/commits/{'a' * 40}")
+        self.get(session, f"/repos/uktrade/app/commits?sha={'a' * 40}&per_page=1")
+        self.get(session, f"/repos/uktrade/app/compare/{'a' * 40}...{'b' * 40}")
+        self.assertFalse(GithubCacheEntry.objects.exists())
+
+    def test_prune_evicts_the_least_recently_used_entries(self):
+        now = datetime.now()
+        for i, days in enumerate([3, 1, 2, 0]):
+            GithubCacheEntry.objects.create(key=f"key-{i}", url=f"/entry-{i}", headers={}, body="x" * 100, size=100, accessed_time=now - timedelta(days=days))
+        self.assertEqual(prune_github_cache(max_size=250), 2)
+        self.assertEqual(set(GithubCacheEntry.objects.values_list("url", flat=True)), {"/entry-1", "/entry-3"})
+        self.assertEqual(prune_github_cache(max_size=250), 0)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def limiter(self, rate=0, reserve=0):
+        return rate_limit.RateLimiter("test", rate, reserve, clock=self.clock, wall_clock=self.clock)
+
+    def test_schedule_paces_requests_after_a_burst(self):
+        limiter = self.limiter(rate=2)
+        self.assertEqual([limiter.schedule(rate_limit.HIGH) for _ in range(2)], [0, 0])
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 0.5)
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 1.0)
+        self.clock.now += 1
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 0.5)
+
+    def test_update_stops_requests_until_the_budget_resets(self):
+        limiter = self.limiter()
+        limiter.update({"X-RateLimit-Remaining": "1", "X-RateLimit-Reset": "1060", "X-RateLimit-Limit": "5000"})
+        self.assertEqual(limiter.budget(), {"remaining": 1, "limit": 5000, "reset_time": 1060.0})
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 0)
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 60)
+        self.clock.now = 1060
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 0)
+        self.assertEqual(limiter.budget()["remaining"], None)
+
+    def test_update_ignores_responses_without_rate_limit_headers(self):
+        limiter = self.limiter()
+        limiter.update({"Content-Type": "application/json"})
+        self.assertEqual(limiter.budget(), {"remaining": None, "limit": None, "reset_time": None})
+
+    def test_reserve_is_kept_for_high_priority_requests(self):
+        limiter = self.limiter(reserve=2)
+        limiter.update({"X-RateLimit-Remaining": "3", "X-RateLimit-Reset": "1030"})
+        self.assertEqual(limiter.schedule(rate_limit.LOW), 0)
+        self.assertEqual(limiter.schedule(rate_limit.LOW), 30)
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 0)
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 0)
+        self.assertEqual(limiter.schedule(rate_limit.HIGH), 30)
+
+
+class PrimaryBranchTests(TestCase):
+    def repo(self, branch_names, default_branch="develop", error_status=404):
+        def get_branch(branch_name):
+            if branch_name not in branch_names:
+                raise GithubException(error_status, {"message": "Branch not found"}, None)
+            return SimpleNamespace(name=branch_name)
+
+        return mock.Mock(full_name="uktrade/app", default_branch=default_branch, get_branch=mock.Mock(side_effect=get_branch))
+
+    def test_missing_candidates_fall_back_to_the_next(self):
+        repo = self.repo(["master", "develop"])
+        self.assertEqual(check.read_primary_branch(repo).name, "master")
+        self.assertEqual([call.args[0] for call in repo.get_branch.call_args_list], ["main", "master"])
+        repo = self.repo(["develop"])
+        self.assertEqual(check.read_primary_branch(repo).name, "develop")
+        self.assertEqual([call.args[0] for call in repo.get_branch.call_args_list], ["main", "master", "develop"])
+
+    def test_no_candidate_branch(self):
+        with self.assertRaisesMessage(ValueError, "No primary branch in uktrade/app"):
+            check.read_primary_branch(self.repo(["feature-1"]))
+
+    def test_other_errors_are_not_a_missing_branch(self):
+        repo = self.repo(["master"], error_status=500)
+        with self.assertRaises(GithubException):
+            check.read_primary_branch(repo)
+        repo.get_branch.assert_called_once_with("main")
+
+
+class PriorityTests(TestCase):
+    @override_settings(GITHUB_BRANCH_LIST_ENABLED=False)
+    def test_repo_read_starting_a_pipeline_is_low_priority(self):
+        priorities = []
+        branch = SimpleNamespace(name="main", commit=SimpleNamespace(sha="a" * 40))
+
+        def get_repo(name):
+            priorities.append(rate_limit.request_priority.get())
+            return SimpleNamespace(name="app", id=1, private=False, archived=False, default_branch="main", full_name=name, get_branch=lambda branch_name: branch)
+
+        pipeline_app = PipelineApp(config_filename="app.yaml")
+        pipeline_app.config = {"scm": "uktrade/app"}
+        with mock.patch.object(check, "get_github", return_value=SimpleNamespace(get_repo=get_repo)):
+            check.read_repo(pipeline_app)
+        self.assertEqual(priorities, [rate_limit.LOW])
+        self.assertEqual(rate_limit.request_priority.get(), rate_limit.HIGH)
+
+
+class CfClientTests(TestCase):
+    def test_threads_sharing_a_client_refresh_an_expired_token_once(self):
+        server = FakeServer(Fleet(1))
+        url = server.start()
+        try:
+            with override_settings(CF_ENDPOINT=url, CF_PROXY=""):
+                cf = check.cf_login()
+        finally:
+            server.stop()
+        cf.refresh_token = "refresh-token"
+        expired_token = cf._access_token
+        workers = 4
+        # Every thread's first request fails with the expired token before any of them refreshes it
+        all_failed = threading.Barrier(workers)
+
+        def request(url, **kwargs):
+            if cf._access_token == expired_token:
+                all_failed.wait()
+                return mock.Mock(status_code=401, json=lambda: {"errors": [{"code": 1000, "title": "CF-InvalidAuthToken"}]})
+            return mock.Mock(status_code=200)
+
+        def refresh():
+            setattr(cf, "_access_token", "new-token")
+
+        with mock.patch.object(cf, "_refresh_token", side_effect=refresh) as refresh_token, ThreadPoolExecutor(max_workers=workers) as executor:
+            responses = list(executor.map(lambda _: cf._bearer_request(request, "/v3/apps"), range(workers)))
+        self.assertEqual(refresh_token.call_count, 1)
+        self.assertEqual([response.status_code for response in responses], [200] * workers)
+
+    def test_library_internals_the_token_refresh_overrides_are_unchanged(self):
+        # SharedTokenCloudFoundryClient replaces _bearer_request, and uses _access_token, _refresh_token and _is_token_expired.
+        # If this fails after an upgrade, check the override against the new library before updating the pin and this test
+        self.assertEqual(metadata.version("oauth2-client"), "1.2.1")
+        bearer_request_source = inspect.getsource(CredentialManager._bearer_request)
+        self.assertEqual(hashlib.sha256(bearer_request_source.encode()).hexdigest(), "9e2ff936c54c61f8e028739dd711b749f8cd114cb7892a93318d677af7115e28")
+        self.assertIsInstance(inspect.getattr_static(CredentialManager, "_access_token"), property)
+        self.assertEqual(list(inspect.signature(CredentialManager._refresh_token).parameters), ["self"])
+        self.assertEqual(list(inspect.signature(SharedTokenCloudFoundryClient._is_token_expired).parameters), ["response"])
+        # Every request method goes through _bearer_request
+        credential_manager = object.__new__(CredentialManager)
+        with mock.patch.object(credential_manager, "_bearer_request") as bearer_request, mock.patch.object(credential_manager, "_get_session"):
+            for method in ["get", "post", "put", "patch", "delete"]:
+                getattr(credential_manager, method)("http://cf.test/v3/apps")
+        self.assertEqual(bearer_request.call_count, 5)
+
+
+class AsyncGithubTests(TransactionTestCase):
+    @override_settings(GITHUB_CACHE_ENABLED=True)
+    def test_not_modified_response_is_answered_from_the_cache(self):
+        conditions = []
+
+        async def branches(request):
+            conditions.append(request.headers.get("If-None-Match"))
+            if request.headers.get("If-None-Match") == '"v1"':
+                return web.Response(status=304, headers={"ETag": '"v1"'})
+            return web.json_response([{"name": "main"}], headers={"ETag": '"v1"', "Link": '<http://github.test/branches?page=2>; rel="next"'})
+
+        async def read_twice():
+            app = web.Application()
+            app.router.add_get("/repos/uktrade/app/branches", branches)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            host, port = runner.addresses[0][:2]
+            try:
+                async with aiohttp.ClientSession() as session:
+                    github = AsyncGithub(session, 1)
+                    return [await github.request(f"http://{host}:{port}/repos/uktrade/app/branches", {"per_page": 100}) for _ in range(2)]
+            finally:
+                await runner.cleanup()
+
+        (first_data, _, first_links), (second_data, second_headers, second_links) = asyncio.run(read_twice())
+        self.assertEqual(conditions, [None, '"v1"'])
+        self.assertEqual(second_data, first_data)
+        self.assertEqual(second_headers["ETag"], '"v1"')
+        self.assertEqual(str(second_links["next"]["url"]), str(first_links["next"]["url"]))
+
+
+class ScannerTests(TestCase):
+    @override_settings(GIT_MIRROR_ENABLED=True)
+    def test_compares_are_kept_but_mirrors_are_fetched_every_scan(self):
+        from .scanner import Scanner
+
+        scanner = Scanner(workers=1)
+        try:
+            cf = SimpleNamespace()
+            _, _, first_compares = scanner.caches(cf)
+            first_mirrors = first_compares.mirrors
+            _, _, second_compares = scanner.caches(cf)
+            self.assertIs(first_compares, second_compares)
+            self.assertIsNot(first_mirrors, second_compares.mirrors)
+        finally:
+            scanner.env_executor.shutdown()
+            scanner.pipeline_executor.shutdown()
+
+    def test_org_missing_from_one_scan_is_looked_up_again_by_the_next(self):
+        from .scanner import Scanner
+
+        scanner = Scanner(workers=1)
+        try:
+            organizations = mock.Mock()
+            organizations.list.side_effect = [[], [{"guid": "org-guid"}]]
+            cf = SimpleNamespace(v3=SimpleNamespace(organizations=organizations))
+            cf_guids, _, _ = scanner.caches(cf)
+            self.assertEqual(cf_guids.org_guid("uktrade"), "")
+            self.assertEqual(cf_guids.org_guid("uktrade"), "")
+            cf_guids, _, _ = scanner.caches(cf)
+            self.assertEqual(cf_guids.org_guid("uktrade"), "org-guid")
+            self.assertEqual(organizations.list.call_count, 2)
+        finally:
+            scanner.env_executor.shutdown()
+            scanner.pipeline_executor.shutdown()
+
+
+class GitMirrorTests(TestCase):
+    # A local repo - main has c1..c4, and "feature" branches from c2 with one commit of its own
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "source")
+        self.git("init", "--quiet", "--initial-branch=main", self.source, cwd=self.tmp.name)
+        self.commits = {}
+        for name, timestamp in [("c1", 1700000000), ("c2", 1700000100)]:
+            self.commit(name, timestamp)
+        self.git("checkout", "--quiet", "-b", "feature")
+        self.commit("f1", 1700000200)
+        self.git("checkout", "--quiet", "main")
+        for name, timestamp in [("c3", 1700000300), ("c4", 1700000400)]:
+            self.commit(name, timestamp)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def git(self, *args, cwd=None, env=None):
+        return subprocess.run(["git", *args], cwd=cwd or self.source, env=env, capture_output=True, text=True, check=True).stdout.strip()
+
+    def commit(self, name, timestamp):
+        env = dict(os.environ, GIT_AUTHOR_NAME="Dev", GIT_AUTHOR_EMAIL="dev@example.com", GIT_COMMITTER_NAME="Dev", GIT_COMMITTER_EMAIL="dev@example.com")
+        env.update(GIT_AUTHOR_DATE=f"{timestamp} +0000", GIT_COMMITTER_DATE=f"{timestamp} +0000")
+        self.git("commit", "--quiet", "--allow-empty", "-m", name, env=env)
+        self.commits[name] = self.git("rev-parse", "HEAD")
+
+    def mirror(self):
+        return GitMirrors(mirror_dir=os.path.join(self.tmp.name, "mirrors"), url=f"file://{self.source}").get("uktrade/app")
+
+    def test_drift_from_local_mirror(self):
+        mirror = self.mirror()
+        self.assertEqual(mirror.ahead_behind(self.commits["c4"], self.commits["f1"]), (1, 2))
+        self.assertEqual(mirror.merge_base(self.commits["c4"], self.commits["f1"]), self.commits["c2"])
+        self.assertEqual(mirror.commit_count(self.commits["c4"]), 4)
+        self.assertEqual(mirror.commit_count(self.commits["f1"]), 3)
+        self.assertEqual(mirror.commit_date(self.commits["c1"]), datetime(2023, 11, 14, 22, 13, 20))
+
+    def test_refs_that_are_not_full_shas_are_refused(self):
+        mirror = self.mirror()
+        for ref in ["--output=/tmp/x", "main", self.commits["c4"][:12]]:
+            with self.assertRaises(GitMirrorError):
+                mirror.ahead_behind(self.commits["c4"], ref)
+            with self.assertRaises(GitMirrorError):
+                mirror.commit_count(ref)
+
+    @override_settings(GITHUB_TOKEN="secret-token")
+    def test_token_is_not_on_the_command_line(self):
+        mirror = GitMirror("uktrade/app", self.tmp.name, "https://github.com/uktrade/app.git")
+        with mock.patch("subprocess.run", return_value=SimpleNamespace(stdout="")) as run:
+            mirror.git("fetch", "--quiet", "origin")
+        command, env = run.call_args.args[0], run.call_args.kwargs["env"]
+        self.assertNotIn("secret-token", " ".join(command))
+        self.assertEqual(env["GIT_CONFIG_KEY_0"], "http.extraHeader")
+        self.assertTrue(env["GIT_CONFIG_VALUE_0"].startswith("Authorization: Basic "))
+
+
+class WorkerConnectionTests(TestCase):
+    def test_each_worker_thread_opens_one_connection_for_the_scan(self):
+        created = []
+
+        def record(sender, connection, **kwargs):
+            created.append(connection)
+
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        connection_created.connect(record)
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                for future in [executor.submit(check.run_in_worker, query) for _ in range(20)]:
+                    future.result()
+        finally:
+            connection_created.disconnect(record)
+        self.assertLessEqual(len(created), 2)
+        self.assertLessEqual(len(check.worker_connections), 2)
+        check.close_worker_connections()
+        self.assertEqual(check.worker_connections, set())
+
+
+@override_settings(GIT_PIPELINE_REPO=BENCHMARK_PIPELINE_REPO, GITHUB_WEBHOOK_SECRET="s3cret")
+class WebhookTests(TestCase):
+    def setUp(self):
+        scan = make_scan(datetime.now())
+        pipeline_app = scan.pipeline_apps().get()
+        pipeline_app.config_filename = "app0003.yaml"
+        pipeline_app.config_blob = next(iter(store_blobs([{"scm": "uktrade/app0003"}]).values()))
+        pipeline_app.scm_repo_primary_branch_name = "main"
+        pipeline_app.save()
+
+    def post(self, name, secret="s3cret", event="push"):
+        body = load_payload(name)
+        request = RequestFactory().post(
+            "/webhooks/github", body, content_type="application/json",
+            HTTP_X_GITHUB_EVENT=event, HTTP_X_HUB_SIGNATURE_256=sign(body, secret), HTTP_X_GITHUB_DELIVERY="delivery-1",
+        )
+        return views.github_webhook(request)
+
+    def test_verify_signature(self):
+        body = load_payload("push_app_repo.json")
+        self.assertTrue(verify_signature(body, sign(body, "s3cret")))
+        self.assertFalse(verify_signature(body, sign(body, "wrong")))
+        self.assertFalse(verify_signature(body + b" ", sign(body, "s3cret")))
+        self.assertFalse(verify_signature(body, None))
+        self.assertFalse(verify_signature(body, sign(body, "s3cret"), secret=""))
+
+    def test_push_to_app_repo_affects_pipelines_on_its_primary_branch(self):
+        payload = json.loads(load_payload("push_app_repo.json"))
+        self.assertEqual(affected_pipelines(payload), ["app0003.yaml"])
+        payload["ref"] = "refs/heads/feature-1"
+        self.assertEqual(affected_pipelines(payload), [])
+
+    def test_push_to_config_repo_affects_changed_configs(self):
+        payload = json.loads(load_payload("push_config_repo.json"))
+        self.assertEqual(affected_pipelines(payload), ["app0001.yaml", "app0099.yaml"])
+        payload["ref"] = "refs/heads/feature-1"
+        self.assertEqual(affected_pipelines(payload), [])
+
+    def test_webhook_queues_rescans(self):
+        self.assertEqual(self.post("push_app_repo.json", secret="wrong").status_code, 403)
+        self.assertEqual(self.post("ping.json", event="ping").status_code, 200)
+        self.assertEqual(self.post("push_app_repo.json").status_code, 202)
+        self.assertEqual(list(RescanRequest.objects.values_list("config_filename", "delivery_id")), [("app0003.yaml", "delivery-1")])
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        # The last scan's rows all tie on everything the dashboard shows except their id
+        make_scan(datetime.now() - timedelta(hours=1), environments=["old"] * 3)
+        self.scan = make_scan(datetime.now(), environments=["dev"] * 5)
+        self.ids = list(self.scan.pipeline_envs().order_by("id").values_list("id", flat=True))
+
+    def page(self, **params):
+        with mock.patch.object(views, "render", wraps=views.render) as render:
+            response = views.home(RequestFactory().get("/", params))
+        self.assertEqual(response.status_code, 200)
+        return render.call_args.args[2]
+
+    def test_keyset_page_neither_skips_nor_repeats_tied_rows(self):
+        queryset = self.scan.pipeline_envs()
+        rows, has_previous, has_next = views.keyset_page(queryset, page_size=2)
+        self.assertEqual(([row.id for row in rows], has_previous, has_next), (self.ids[:2], False, True))
+        rows, has_previous, has_next = views.keyset_page(queryset, after=rows[-1].id, page_size=2)
+        self.assertEqual(([row.id for row in rows], has_previous, has_next), (self.ids[2:4], True, True))
+        rows, has_previous, has_next = views.keyset_page(queryset, after=rows[-1].id, page_size=2)
+        self.assertEqual(([row.id for row in rows], has_previous, has_next), (self.ids[4:], True, False))
+        rows, has_previous, has_next = views.keyset_page(queryset, before=rows[0].id, page_size=2)
+        self.assertEqual(([row.id for row in rows], has_previous, has_next), (self.ids[2:4], True, True))
+        rows, has_previous, has_next = views.keyset_page(queryset, before=rows[0].id, page_size=2)
+        self.assertEqual(([row.id for row in rows], has_previous, has_next), (self.ids[:2], False, True))
+
+    def test_home_pages_through_the_latest_scan(self):
+        scan = make_scan(datetime.now() + timedelta(minutes=1), environments=["dev"] * (views.PAGE_SIZE + 2))
+        ids = list(scan.pipeline_envs().order_by("id").values_list("id", flat=True))
+        first = self.page()
+        self.assertEqual([row.id for row in first["pipeline_envs"]], ids[:views.PAGE_SIZE])
+        self.assertEqual((first["has_previous"], first["has_next"], first["last_id"]), (False, True, ids[views.PAGE_SIZE - 1]))
+        second = self.page(after=first["last_id"])
+        self.assertEqual([row.id for row in second["pipeline_envs"]], ids[views.PAGE_SIZE:])
+        self.assertEqual((second["has_previous"], second["has_next"], second["first_id"]), (True, False, ids[views.PAGE_SIZE]))
+        self.assertEqual([row.id for row in self.page(before=second["first_id"])["pipeline_envs"]], ids[:views.PAGE_SIZE])
+        # Past the last row there is nothing to page to, and no links to show
+        last = self.page(after=ids[-1])
+        self.assertEqual((last["pipeline_envs"], last["has_previous"], last["has_next"]), ([], False, False))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.old_scan = make_scan(datetime(2024, 1, 1, 12), environments=("dev",))
+        self.scan = make_scan(datetime(2024, 1, 2, 12), environments=("dev", "prod"))
+
+    def export(self, **params):
+        return views.export(RequestFactory().get("/export", params))
+
+    def test_csv_export_streams_the_latest_scan(self):
+        response = self.export()
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="pipeline-envs.csv"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(","), [name for name, lookup in EXPORT_COLUMNS])
+        self.assertEqual([line.split(",")[0] for line in lines[1:]], [str(self.scan.id)] * 2)
+        self.assertEqual([line.split(",")[8] for line in lines[1:]], ["dev", "prod"])
+
+    def test_json_lines_export_of_a_date_range(self):
+        response = self.export(format="json", since="2024-01-01", until="2024-01-02T00:00:00")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["scan_id"], row["config_env"], row["cf_full_name"]) for row in rows], [(self.old_scan.id, "dev", "org/dev/app")])
+        self.assertEqual(rows[0]["scan_start_time"], "2024-01-01T12:00:00")
+
+    def test_bad_date_or_format_is_a_bad_request(self):
+        response = self.export(since="yesterday")
+        self.assertEqual((response.status_code, response.content), (400, b"Not a date or time: yesterday"))
+        self.assertEqual(self.export(until="2024-13-01").status_code, 400)
+        self.assertEqual(self.export(format="xml").status_code, 400)
+        with self.assertRaisesMessage(CommandError, "Not a date or time: yesterday"):
+            call_command("export_scans", since="yesterday")
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time("2024-01-02"), datetime(2024, 1, 2))
+        self.assertEqual(parse_time("2024-01-02T03:04:05"), datetime(2024, 1, 2, 3, 4, 5))
+        self.assertIsNone(parse_time(""))
+
+
+class MetricsTests(TestCase):
+    def metrics(self):
+        response = views.metrics(RequestFactory().get("/metrics"))
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        return response.content.decode().splitlines()
+
+    def test_latest_completed_scan_metrics(self):
+        make_scan(datetime(2024, 1, 1, 12), status=Scan.Status.FAILED)
+        scan = make_scan(datetime(2024, 1, 2, 12), environments=("dev", "prod"))
+        scan.end_time = scan.start_time + timedelta(seconds=90)
+        scan.pipeline_count, scan.environment_count, scan.failed_pipeline_count = 1, 2, 0
+        scan.phase_times = {"config_read": 1.5, "persist": 0.25}
+        scan.api_calls = {"github": 40, "cf": 12}
+        scan.save()
+        Scan.objects.create(start_time=datetime(2024, 1, 3, 12))
+        RescanRequest.objects.create(config_filename="app.yaml", reason="test", requested_time=datetime.now())
+
+        lines = self.metrics()
+        self.assertIn("# TYPE checker_scans gauge", lines)
+        for sample in [
+            'checker_scans{status="running"} 1',
+            'checker_scans{status="completed"} 1',
+            'checker_scans{status="failed"} 1',
+            "checker_queued_rescans 1",
+            f"checker_last_scan_start_time_seconds {scan.start_time.timestamp()}",
+            "checker_last_scan_duration_seconds 90.0",
+            "checker_last_scan_pipelines 1",
+            "checker_last_scan_environments 2",
+            "checker_last_scan_failed_pipelines 0",
+            'checker_last_scan_phase_seconds{phase="config_read"} 1.5',
+            'checker_last_scan_phase_seconds{phase="persist"} 0.25',
+            'checker_last_scan_api_calls{backend="github"} 40',
+            'checker_last_scan_api_calls{backend="cf"} 12',
+        ]:
+            self.assertIn(sample, lines)
+
+    def test_no_scan_metrics_before_the_first_completed_scan(self):
+        lines = self.metrics()
+        self.assertIn('checker_scans{status="completed"} 0', lines)
+        self.assertFalse([line for line in lines if line.startswith("checker_last_scan")])
+
+    def test_rate_limit_budgets_of_the_latest_finished_scan(self):
+        make_scan(datetime.now() - timedelta(hours=1))
+        failed_scan = make_scan(datetime.now(), status=Scan.Status.FAILED)
+        failed_scan.rate_limits = {
+            "github": {"remaining": 12, "limit": 5000, "reset_time": 1700000000.0},
+            "cf": {"remaining": None, "limit": None, "reset_time": None},
+        }
+        failed_scan.save()
+        Scan.objects.create(start_time=datetime.now())
+
+        lines = self.metrics()
+        self.assertIn('checker_rate_limit_remaining{api="github"} 12', lines)
+        self.assertIn('checker_rate_limit_limit{api="github"} 5000', lines)
+        self.assertIn('checker_rate_limit_reset_time_seconds{api="github"} 1700000000.0', lines)
+        self.assertFalse([line for line in lines if 'api="cf"' in line])
+
+
+class PartialScanTests(TransactionTestCase):
+    def test_partial_scan_writes_only_rescanned_pipelines(self):
+        from .scanner import Scanner
+
+        fleet = Fleet(6)
+        server = FakeServer(fleet)
+        url = server.start()
+        rate_limit.limiters.clear()
+        config_snapshot.snapshots.clear()
+        scanner = Scanner(workers=2, interval=0)
+        try:
+            with override_settings(
+                GITHUB_API_URL=url, GITHUB_GRAPHQL_URL=f"{url}/graphql", GIT_PIPELINE_REPO=BENCHMARK_PIPELINE_REPO, GIT_MIRROR_ENABLED=False,
+                CF_ENDPOINT=url, CF_PROXY="", GITHUB_REQUEST_RATE=0, CF_REQUEST_RATE=0,
+            ):
+                full_scan = scanner.run_scan()
+                RescanRequest.objects.create(config_filename="app0003.yaml", reason="test", requested_time=datetime.now())
+                scanner.run_queued_rescans()
+                partial_scan = Scan.objects.order_by("-start_time").first()
+                response = views.home(RequestFactory().get("/"))
+        finally:
+            scanner.env_executor.shutdown()
+            scanner.pipeline_executor.shutdown()
+            server.stop()
+            rate_limit.limiters.clear()
+
+        self.assertEqual(full_scan.status, Scan.Status.COMPLETED)
+        self.assertEqual(partial_scan.status, Scan.Status.COMPLETED)
+        self.assertTrue(partial_scan.partial)
+        self.assertEqual(partial_scan.base_scan_fk_id, full_scan.id)
+        # Only the rescanned pipeline is written again, and every other row is read from the full scan
+        self.assertEqual(list(PipelineApp.objects.filter(scan_fk=partial_scan).values_list("config_filename", flat=True)), ["app0003.yaml"])
+        self.assertEqual(PipelineEnv.objects.filter(scan_fk=partial_scan).count(), fleet.environments)
+        pipeline_envs = partial_scan.pipeline_envs()
+        self.assertEqual(pipeline_envs.count(), fleet.pipelines * fleet.environments)
+        self.assertEqual(
+            {pipeline_env.scan_fk_id for pipeline_env in pipeline_envs if pipeline_env.pipeline_app_fk.config_filename == "app0003.yaml"},
+            {partial_scan.id},
+        )
+        self.assertEqual(response.status_code, 200)
+        for repo_name in fleet.repo_names:
+            self.assertContains(response, repo_name)
+
+
+class BenchmarkTests(TransactionTestCase):
+    def test_incremental_scan_after_deploys_reads_only_the_deployed_apps(self):
+        fleet = Fleet(4)
+        result = run_benchmark(fleet, workers=2, deploys=3)
+        self.assertEqual(result["status"], Scan.Status.COMPLETED)
+        self.assertEqual(result["environments_written"], fleet.pipelines * fleet.environments)
+        self.assertEqual(result["api_calls_by_endpoint"]["GET /v3/apps/{guid}/env"], 3)
+        scan = Scan.objects.order_by("-start_time").first()
+        for repo_name, env_name in fleet.app_guids.values():
+            pipeline_env = PipelineEnv.objects.get(scan_fk=scan, pipeline_app_fk__config_filename=f"{repo_name}.yaml", config_env=env_name)
+            self.assertEqual(pipeline_env.cf_app_git_commit, fleet.deployed_sha(repo_name, env_name))
+
+        # /metrics reports the scan just written
+        lines = views.metrics(RequestFactory().get("/metrics")).content.decode().splitlines()
+        self.assertIn(f"checker_last_scan_environments {fleet.pipelines * fleet.environments}", lines)
+        self.assertIn(f"checker_last_scan_pipelines {fleet.pipelines}", lines)
+        self.assertIn(f'checker_last_scan_api_calls{{backend="cf"}} {scan.api_calls["cf"]}', lines)
+        self.assertTrue([line for line in lines if line.startswith('checker_last_scan_phase_seconds{phase="persist"}')])
+
+    def test_async_engine_reads_audit_events_and_repos_in_graphql(self):
+        fleet = Fleet(4)
+        result = run_benchmark(fleet, engine="async", graphql=True, deploys=3)
+        self.assertEqual(result["status"], Scan.Status.COMPLETED)
+        self.assertEqual(result["environments_written"], fleet.pipelines * fleet.environments)
+        self.assertEqual(result["api_calls_by_endpoint"]["GET /v3/apps/{guid}/env"], 3)
+        self.assertEqual(result["api_calls_by_endpoint"]["POST /graphql"], 1)
+        self.assertNotIn("GET /repos/{owner}/{repo}", result["api_calls_by_endpoint"])
+        scan = Scan.objects.order_by("-start_time").first()
+        self.assertTrue(scan.cf_audit_cursor)
+
+    def test_branch_lists_are_read_only_when_enabled(self):
+        fleet = Fleet(2)
+        result = run_benchmark(fleet)
+        self.assertNotIn("GET /repos/{owner}/{repo}/branches", result["api_calls_by_endpoint"])
+        result = run_benchmark(fleet, branch_lists=True)
+        self.assertEqual(result["status"], Scan.Status.COMPLETED)
+        self.assertEqual(result["api_calls_by_endpoint"]["GET /repos/{owner}/{repo}/branches"], fleet.pipelines)
+        scan = Scan.objects.order_by("-start_time").first()
+        self.assertEqual([len(pipeline_app.scm_repo_branch_list) for pipeline_app in scan.pipeline_apps()], [fleet.branches] * fleet.pipelines)
+
+    def test_each_fleet_is_measured_in_its_own_process(self):
+        result = run_benchmark_process(Fleet(2), workers=2)
+        self.assertEqual(result["status"], Scan.Status.COMPLETED)
+        self.assertEqual(result["environments_written"], 4)
+        self.assertGreater(result["max_rss_kb"], 0)
@@ -1,15 +1,142 @@
+from django.conf import settings
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from django.db.models import Max
-from django.core.paginator import Paginator
-from .models import PipelineApp, PipelineEnv
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import json
+from .models import Scan, PipelineEnv, RescanRequest
+from .export import EXPORT_FORMATS, export_rows, export_lines, parse_time
+from .metrics import prometheus_metric
+from .rescan import verify_signature, handle_push
+
+PAGE_SIZE = 100
+
+# Only the columns the dashboard shows are read
+HOME_FIELDS = [
+    "id",
+    "config_env",
+    "cf_full_name",
+    "cf_app_git_branch",
+    "cf_app_git_commit",
+    "cf_commit_date",
+    "cf_commit_author",
+    "git_compare_ahead_by",
+    "git_compare_behind_by",
+    "drift_time_simple",
+    "drift_time_merge_base",
+    "log_message",
+    "pipeline_app_fk__id",
+    "pipeline_app_fk__config_filename",
+    "pipeline_app_fk__scm_repo_primary_branch_name",
+]
+
+
+def parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def keyset_page(queryset, after=None, before=None, page_size=PAGE_SIZE):
+    # Seeks from the last id seen instead of counting and skipping rows, so every page costs the same to read
+    if before is not None:
+        rows = list(queryset.filter(id__lt=before).order_by("-id")[:page_size + 1])
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            queryset = queryset.filter(id__gt=after)
+        rows = list(queryset.order_by("id")[:page_size + 1])
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_previous = after is not None
+    return rows, has_previous, has_next
+
 
 def home(request):
-    last_scan_time = PipelineApp.objects.aggregate(Max('scan_start_time'))["scan_start_time__max"]
-    pipeline_envs = PipelineEnv.objects.filter(pipeline_app_fk__scan_start_time=last_scan_time)
-    paginator = Paginator(pipeline_envs, 100)
-    page = request.GET.get('page', 1)
+    # The latest completed scan is one index lookup, and a scan still being written is never shown
+    last_scan = Scan.objects.filter(status=Scan.Status.COMPLETED).order_by("-start_time").only("id", "start_time", "partial", "base_scan_fk").first()
+    pipeline_envs = last_scan.pipeline_envs() if last_scan else PipelineEnv.objects.none()
+    pipeline_envs = pipeline_envs.select_related("pipeline_app_fk").only(*HOME_FIELDS)
+    rows, has_previous, has_next = keyset_page(pipeline_envs, after=parse_id(request.GET.get("after")), before=parse_id(request.GET.get("before")))
     return render(request, 'home.html', {
-        'last_scan_time' : last_scan_time,
-        'pipeline_envs' : paginator.page(page),
+        'last_scan_time' : last_scan.start_time if last_scan else None,
+        'pipeline_envs' : rows,
+        'has_previous' : has_previous and bool(rows),
+        'has_next' : has_next and bool(rows),
+        'first_id' : rows[0].id if rows else None,
+        'last_id' : rows[-1].id if rows else None,
         }
     )
+
+
+def export(request):
+    # Streams one scan (?scan=), a date range of scans (?since=&until=) or the latest scan as CSV or JSON lines
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        since = parse_time(request.GET.get("since"))
+        until = parse_time(request.GET.get("until"))
+    except ValueError as ex:
+        return HttpResponseBadRequest(str(ex))
+    rows = export_rows(scan_id=parse_id(request.GET.get("scan")), since=since, until=until)
+
+    content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(export_lines(export_format, rows), content_type=content_type)
+    extension = "csv" if export_format == "csv" else "jsonl"
+    response["Content-Disposition"] = f'attachment; filename="pipeline-envs.{extension}"'
+    return response
+
+
+def metrics(request):
+    # Prometheus text format - the latest completed scan's measurements, and scan counts by status
+    lines = []
+    scan_counts = dict(Scan.objects.values_list("status").annotate(count=Count("id")))
+    prometheus_metric(lines, "checker_scans", "Scans recorded, by status", [({"status": status}, scan_counts.get(status, 0)) for status in Scan.Status.values])
+    prometheus_metric(lines, "checker_queued_rescans", "Pipelines queued for rescan by Github webhooks", [({}, RescanRequest.objects.filter(processed_time__isnull=True).count())])
+
+    last_scan = Scan.objects.filter(status=Scan.Status.COMPLETED).order_by("-start_time").first()
+    if last_scan is not None:
+        prometheus_metric(lines, "checker_last_scan_start_time_seconds", "Start time of the latest completed scan", [({}, last_scan.start_time.timestamp())])
+        prometheus_metric(lines, "checker_last_scan_duration_seconds", "Wall time of the latest completed scan", [({}, (last_scan.end_time - last_scan.start_time).total_seconds())])
+        prometheus_metric(lines, "checker_last_scan_pipelines", "Pipelines written by the latest completed scan", [({}, last_scan.pipeline_count)])
+        prometheus_metric(lines, "checker_last_scan_environments", "Environments written by the latest completed scan", [({}, last_scan.environment_count)])
+        prometheus_metric(lines, "checker_last_scan_failed_pipelines", "Pipelines the latest completed scan failed to process", [({}, last_scan.failed_pipeline_count)])
+        prometheus_metric(lines, "checker_last_scan_phase_seconds", "Time spent in each phase of the latest completed scan, summed across workers", [({"phase": phase}, seconds) for phase, seconds in last_scan.phase_times.items()])
+        prometheus_metric(lines, "checker_last_scan_api_calls", "API calls made by the latest completed scan, by backend", [({"backend": backend}, calls) for backend, calls in last_scan.api_calls.items()])
+
+    # Failed scans count too, since running out of budget is a common reason for a scan to fail
+    finished_scan = Scan.objects.exclude(status=Scan.Status.RUNNING).order_by("-start_time").first()
+    if finished_scan is not None:
+        budgets = [(api, budget) for api, budget in finished_scan.rate_limits.items() if budget["remaining"] is not None]
+        prometheus_metric(lines, "checker_rate_limit_remaining", "Requests left in each API's rate limit when the latest scan finished", [({"api": api}, budget["remaining"]) for api, budget in budgets])
+        prometheus_metric(lines, "checker_rate_limit_limit", "Size of each API's rate limit when the latest scan finished", [({"api": api}, budget["limit"]) for api, budget in budgets if budget["limit"] is not None])
+        prometheus_metric(lines, "checker_rate_limit_reset_time_seconds", "Time each API's rate limit resets, as of the latest scan", [({"api": api}, budget["reset_time"]) for api, budget in budgets])
+    return HttpResponse("\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@csrf_exempt
+@require_POST
+def github_webhook(request):
+    # Github push events queue a rescan of the pipelines the pushed repo and branch affect
+    if not settings.GITHUB_WEBHOOK_SECRET:
+        return HttpResponseNotFound("Github webhooks are not enabled")
+    if not verify_signature(request.body, request.headers.get("X-Hub-Signature-256")):
+        return HttpResponseForbidden("Invalid signature")
+
+    event = request.headers.get("X-GitHub-Event", "")
+    if event == "ping":
+        return JsonResponse({"event": event})
+    if event != "push":
+        return JsonResponse({"event": event, "ignored": True})
+    try:
+        # The signature covers the raw body, whether the webhook sends JSON or a form with a "payload" field
+        payload = json.loads(request.POST["payload"] if request.content_type == "application/x-www-form-urlencoded" else request.body)
+        queued = handle_push(payload, request.headers.get("X-GitHub-Delivery", ""))
+    except (KeyError, TypeError, ValueError) as ex:
+        return HttpResponseBadRequest(f"Not a push payload: {ex!r}")
+    return JsonResponse({"event": event, "queued": queued}, status=202 if queued else 200)
@@ -147,6 +147,7 @@ except ImportError:
 
 # Account credentials
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN", "")
+GITHUB_WEBHOOK_SECRET = os.environ.get("GITHUB_WEBHOOK_SECRET", "")
 CF_USERNAME = os.environ.get("CF_USERNAME", "")
 CF_PASSWORD = os.environ.get("CF_PASSWORD", "")
 CF_ENDPOINT = os.environ.get("CF_ENDPOINT", "")
@@ -156,3 +157,42 @@ CF_PROXY = os.environ.get("CF_PROXY", "")
 GIT_CLEANUP_LIST = ["git@github.com:","https://github.com/",".git"]
 GIT_RESPONSE_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S %Z"
 GIT_PIPELINE_REPO = os.environ.get("GIT_PIPELINE_REPO", "")
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_GRAPHQL_URL = os.environ.get("GITHUB_GRAPHQL_URL", f"{GITHUB_API_URL}/graphql")
+GIT_GRAPHQL_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Scan tuning
+CHECK_ENGINE = os.environ.get("CHECK_ENGINE", "threads")
+CHECK_WORKERS = int(os.environ.get("CHECK_WORKERS", "1"))
+CHECK_INCREMENTAL = os.environ.get("CHECK_INCREMENTAL", "False") == "True"
+CHECK_WRITE_BATCH_SIZE = int(os.environ.get("CHECK_WRITE_BATCH_SIZE", "500"))
+GITHUB_CACHE_ENABLED = os.environ.get("GITHUB_CACHE_ENABLED", "True") == "True"
+GITHUB_GRAPHQL_ENABLED = os.environ.get("GITHUB_GRAPHQL_ENABLED", "False") == "True"
+GITHUB_CONFIG_SNAPSHOT_ENABLED = os.environ.get("GITHUB_CONFIG_SNAPSHOT_ENABLED", "True") == "True"
+GITHUB_BRANCH_LIST_ENABLED = os.environ.get("GITHUB_BRANCH_LIST_ENABLED", "False") == "True"
+BRANCH_LIST_MAX_AGE_HOURS = int(os.environ.get("BRANCH_LIST_MAX_AGE_HOURS", "24"))
+GITHUB_GRAPHQL_BATCH_SIZE = int(os.environ.get("GITHUB_GRAPHQL_BATCH_SIZE", "25"))
+GITHUB_CACHE_MAX_SIZE = int(os.environ.get("GITHUB_CACHE_MAX_SIZE", str(256 * 1024 * 1024)))
+CF_GUID_CACHE_TTL = int(os.environ.get("CF_GUID_CACHE_TTL", "0"))
+CF_APP_PAGE_SIZE = int(os.environ.get("CF_APP_PAGE_SIZE", "5000"))
+CF_AUDIT_EVENTS_ENABLED = os.environ.get("CF_AUDIT_EVENTS_ENABLED", "False") == "True"
+CF_AUDIT_EVENT_TYPES = os.environ.get(
+    "CF_AUDIT_EVENT_TYPES",
+    "audit.app.create,audit.app.update,audit.app.restage,audit.app.start,audit.app.deployment.create,audit.app.droplet.mapped",
+).split(",")
+GITHUB_ASYNC_CONCURRENCY = int(os.environ.get("GITHUB_ASYNC_CONCURRENCY", "10"))
+CF_ASYNC_CONCURRENCY = int(os.environ.get("CF_ASYNC_CONCURRENCY", "10"))
+GITHUB_REQUEST_RATE = float(os.environ.get("GITHUB_REQUEST_RATE", "20"))
+CF_REQUEST_RATE = float(os.environ.get("CF_REQUEST_RATE", "20"))
+RATE_LIMIT_RESERVE = int(os.environ.get("RATE_LIMIT_RESERVE", "200"))
+GIT_MIRROR_ENABLED = os.environ.get("GIT_MIRROR_ENABLED", "False") == "True"
+GIT_MIRROR_DIR = os.environ.get("GIT_MIRROR_DIR", str(BASE_DIR / "git-mirrors"))
+GIT_MIRROR_URL = os.environ.get("GIT_MIRROR_URL", "https://github.com/{repo}.git")
+GIT_MIRROR_TIMEOUT = int(os.environ.get("GIT_MIRROR_TIMEOUT", "600"))
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "2000"))
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "30"))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "1000"))
+RETENTION_BLOB_GRACE = int(os.environ.get("RETENTION_BLOB_GRACE", "3600"))
+SCANNER_INTERVAL = int(os.environ.get("SCANNER_INTERVAL", "3600"))
+SCANNER_CACHE_MAX_AGE = int(os.environ.get("SCANNER_CACHE_MAX_AGE", "86400"))
+SCANNER_RESCAN_POLL = int(os.environ.get("SCANNER_RESCAN_POLL", "5"))
@@ -20,4 +20,7 @@ from checker import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home, name='home'),
+    path('export/', views.export, name='export'),
+    path('metrics', views.metrics, name='metrics'),
+    path('webhooks/github', views.github_webhook, name='github_webhook'),
 ]